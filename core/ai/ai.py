@@ -1,13 +1,13 @@
 # ai.py
 
-import os, logging
+import os, json, time, logging
 from typing import List
-from exa_py import Exa
-from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
-import requests
+from core.ai import providers
+from core.ai.providers import get_brave_session, get_exa_client, get_gemini_client
+from core.utils import metrics
 from core.utils.config import Config
 from core.utils.timing import timed_route
 
@@ -16,6 +16,9 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL = "gemini-embedding-001"
+EMBEDDING_DIMS = 768
+
 class Content(BaseModel):
     app_name: str
     engagement_counts: list[str]
@@ -27,37 +30,70 @@ class Content(BaseModel):
     themes: list[str]
     moods: list[str]
 
+class KeyedContent(Content):
+    image_id: str
+
+BATCH_EXTRACTION_INSTRUCTION = """
+Several images follow, each introduced by a line "Image <id>:". Extract each
+image on its own exactly as described above, and return a JSON array with one
+object per image whose image_id is that image's id.
+"""
+
+# ---------------------------------- USAGE ------------------------------------
+
+def record_usage(name, request_bytes, response, latency, usage=None):
+    """
+    Request size, token counts and latency of one generate call, as
+    llm.<name>.* histograms and, when given, into the caller's `usage` dict.
+    """
+    meta = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(meta, "prompt_token_count", None) or 0
+    output_tokens = getattr(meta, "candidates_token_count", None) or 0
+    metrics.observe(f"llm.{name}.request_bytes", request_bytes)
+    metrics.observe(f"llm.{name}.prompt_tokens", prompt_tokens)
+    metrics.observe(f"llm.{name}.output_tokens", output_tokens)
+    metrics.observe(f"llm.{name}.latency", latency)
+    logger.info(f"llm.{name}: {request_bytes/1024:.1f} KB, {prompt_tokens} prompt + {output_tokens} output tokens, {latency:.2f}s")
+    if usage is not None:
+        usage.update({
+            "request_bytes": request_bytes,
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "latency": round(latency, 3),
+        })
+
 # ---------------------------------- GENERATE ------------------------------------
  
 @timed_route("call_llm_api")
-def call_llm_api(image_b64, sys_prompt=Config.IMAGE_CONTENT_EXTRACTION_SYSTEM_PROMPT, temp=0.2):
+def call_llm_api(image_b64, sys_prompt=Config.IMAGE_CONTENT_EXTRACTION_SYSTEM_PROMPT, temp=0.2, usage=None):
     logger.info(f"Calling LLM func...")
 
-    return call_gemini_with_images(image_b64, sys_prompt, temp)
+    return call_gemini_with_images(image_b64, sys_prompt, temp, usage=usage)
 
 @timed_route("call_gemini_with_images")
-def call_gemini_with_images(image_b64, sys_prompt, temp):
+def call_gemini_with_images(image_b64, sys_prompt, temp, usage=None):
     logger.info(f"Calling Gemini generate...")
 
     try:
-        client = genai.Client(
-            api_key=os.environ.get("GEMINI_API_KEY"),
-        )
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=[
-                types.Part.from_bytes(data=image_b64, mime_type="image/jpeg")
-            ],
-            config=types.GenerateContentConfig(
-                system_instruction=sys_prompt,
-                temperature=temp,
-                response_schema=Content,
-                response_mime_type="application/json",
-                thinking_config = types.ThinkingConfig(
-                    thinking_budget=0,
+        client = get_gemini_client()
+        with providers.slot("gemini_generate"):
+            start = time.perf_counter()
+            response = client.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=[
+                    types.Part.from_bytes(data=image_b64, mime_type="image/jpeg")
+                ],
+                config=types.GenerateContentConfig(
+                    system_instruction=sys_prompt,
+                    temperature=temp,
+                    response_schema=Content,
+                    response_mime_type="application/json",
+                    thinking_config = types.ThinkingConfig(
+                        thinking_budget=0,
+                    ),
                 ),
-            ),
-        )
+            )
+        record_usage("extract", len(image_b64), response, time.perf_counter() - start, usage)
 
         return response.text
             
@@ -65,25 +101,69 @@ def call_gemini_with_images(image_b64, sys_prompt, temp):
         logger.info(f"Error getting Gemini generate: {e}")
         return ""
 
+@timed_route("call_llm_api_batch")
+def call_llm_api_batch(images, sys_prompt=Config.IMAGE_CONTENT_EXTRACTION_SYSTEM_PROMPT, temp=0.2, usage=None):
+    """
+    Extraction for several images in one structured-output call. `images` is
+    a list of (image_id, image_b64). Returns {image_id: Content JSON} for the
+    images the response covered; callers retry the rest one at a time.
+    """
+    logger.info(f"Calling Gemini generate for {len(images)} images...")
+
+    try:
+        client = get_gemini_client()
+        contents = []
+        for image_id, image_b64 in images:
+            contents.append(types.Part.from_text(text=f"Image {image_id}:"))
+            contents.append(types.Part.from_bytes(data=image_b64, mime_type="image/jpeg"))
+
+        with providers.slot("gemini_generate"):
+            start = time.perf_counter()
+            response = client.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=contents,
+                config=types.GenerateContentConfig(
+                    system_instruction=sys_prompt + BATCH_EXTRACTION_INSTRUCTION,
+                    temperature=temp,
+                    response_schema=list[KeyedContent],
+                    response_mime_type="application/json",
+                    thinking_config = types.ThinkingConfig(
+                        thinking_budget=0,
+                    ),
+                ),
+            )
+        record_usage("extract_batch", sum(len(b) for _, b in images), response, time.perf_counter() - start, usage)
+
+        wanted = {image_id for image_id, _ in images}
+        results = {}
+        for item in json.loads(response.text):
+            image_id = str(item.pop("image_id", ""))
+            if image_id in wanted and image_id not in results:
+                results[image_id] = json.dumps(item)
+        return results
+
+    except Exception as e:
+        logger.info(f"Error getting Gemini batch generate: {e}")
+        return {}
+
 @timed_route("call_gemini_with_text")
 def call_gemini_with_text(sys_prompt, usr_prompt, temp = 0.2):
     logger.info(f"Calling Gemini generate...")
 
     try:
-        client = genai.Client(
-            api_key=os.environ.get("GEMINI_API_KEY"),
-        )
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=usr_prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=sys_prompt,
-                temperature=temp,
-                thinking_config = types.ThinkingConfig(
-                    thinking_budget=0,
+        client = get_gemini_client()
+        with providers.slot("gemini_generate"):
+            response = client.models.generate_content(
+                model="gemini-2.0-flash",
+                contents=usr_prompt,
+                config=types.GenerateContentConfig(
+                    system_instruction=sys_prompt,
+                    temperature=temp,
+                    thinking_config = types.ThinkingConfig(
+                        thinking_budget=0,
+                    ),
                 ),
-            ),
-        )
+            )
 
         return response.text
             
@@ -94,28 +174,31 @@ def call_gemini_with_text(sys_prompt, usr_prompt, temp = 0.2):
 # ---------------------------------- EMBEDDINGS ----------------------------------
  
 @timed_route("call_vec_api")
-def call_vec_api(query_text, task_type):
+def call_vec_api(query_text, task_type, timeout=None):
     logger.info(f"Calling vec embedding func...")
 
-    response_json = get_gemini_embedding(query_text, task_type)
+    response_json = get_gemini_embedding(query_text, task_type, timeout=timeout)
     return response_json
 
 @timed_route("get_gemini_embedding")
-def get_gemini_embedding(text, task_type):
+def get_gemini_embedding(text, task_type, timeout=None):
+    """`timeout` (seconds) bounds both the wait for a provider slot and the request itself."""
     logger.info(f"Getting Gemini embedding...")
     
     try:
-        client = genai.Client(
-            api_key = os.environ.get("GEMINI_API_KEY")
-        )
-        response = client.models.embed_content(
-            model="gemini-embedding-001",
-            contents=text,
-            config=types.EmbedContentConfig(
-                task_type=task_type,
-                output_dimensionality=768
+        client = get_gemini_client()
+        start = time.monotonic()
+        with providers.slot("gemini_embed", timeout=timeout):
+            remaining = timeout - (time.monotonic() - start) if timeout is not None else None
+            response = client.models.embed_content(
+                model=EMBEDDING_MODEL,
+                contents=text,
+                config=types.EmbedContentConfig(
+                    task_type=task_type,
+                    output_dimensionality=EMBEDDING_DIMS,
+                    http_options=types.HttpOptions(timeout=max(1, int(remaining * 1000))) if remaining is not None else None
+                )
             )
-        )
 
         embedding = response.embeddings[0].values
         return embedding
@@ -124,6 +207,59 @@ def get_gemini_embedding(text, task_type):
         logger.info(f"Error getting Gemini embedding: {e}")
         return []
 
+@timed_route("get_gemini_embeddings")
+def get_gemini_embeddings(texts, task_type, timeout=None):
+    """
+    Embeds several texts in one request. Returns one vector per text, or []
+    for each on failure. `timeout` (seconds) bounds the slot wait and the request.
+    """
+    logger.info(f"Getting {len(texts)} Gemini embeddings...")
+
+    try:
+        client = get_gemini_client()
+        start = time.monotonic()
+        with providers.slot("gemini_embed", timeout=timeout):
+            remaining = timeout - (time.monotonic() - start) if timeout is not None else None
+            response = client.models.embed_content(
+                model=EMBEDDING_MODEL,
+                contents=list(texts),
+                config=types.EmbedContentConfig(
+                    task_type=task_type,
+                    output_dimensionality=EMBEDDING_DIMS,
+                    http_options=types.HttpOptions(timeout=max(1, int(remaining * 1000))) if remaining is not None else None
+                )
+            )
+
+        return [e.values for e in response.embeddings]
+            
+    except Exception as e:
+        logger.info(f"Error getting Gemini embeddings: {e}")
+        return [[] for _ in texts]
+
+@timed_route("call_vec_api_batch")
+def call_vec_api_batch(texts, task_type, batch_size=100, retries=3):
+    """
+    Embeds many texts with one provider request per `batch_size` texts, for
+    backfills and re-indexing. A failed request is retried with backoff; texts
+    whose request still fails come back as [] in their position.
+    """
+    logger.info(f"Calling batched vec embedding func for {len(texts)} texts...")
+
+    vectors = [[] for _ in texts]
+    for i in range(0, len(texts), batch_size):
+        pending = list(range(i, min(i + batch_size, len(texts))))
+        for attempt in range(retries):
+            if attempt:
+                time.sleep(2 ** (attempt - 1))
+            # Only resend the texts that are still missing a vector
+            for idx, vec in zip(pending, get_gemini_embeddings([texts[j] for j in pending], task_type)):
+                if len(vec) == EMBEDDING_DIMS:
+                    vectors[idx] = vec
+            pending = [idx for idx in pending if not vectors[idx]]
+            if not pending:
+                break
+    return vectors
+
 # ---------------------------------- SEARCH ----------------------------------
 
 @timed_route("get_exa_search")
@@ -131,11 +267,7 @@ def get_exa_search(query: str, inc_domains = None):
     logger.info(f"Getting Exa AI search...")
     
     try:
-        token = os.environ.get("EXA_AI_API_KEY")
-        if not token:
-            raise RuntimeError("EXA_AI_API_KEY not set")
-        
-        exa = Exa(api_key=token)
+        exa = get_exa_client()
         
         kwargs = {
             "query": query,
@@ -145,7 +277,8 @@ def get_exa_search(query: str, inc_domains = None):
         if inc_domains:  # only add if user has interacted
             kwargs["include_domains"] = inc_domains
         
-        result = exa.search_and_contents(**kwargs)
+        with providers.slot("exa"):
+            result = exa.search_and_contents(**kwargs)
 
         return result.results
             
@@ -166,12 +299,13 @@ def get_brave_search(query: str, inc_domains = None):
         if inc_domains:
             params["include_domains"] = ",".join(inc_domains)
 
-        resp = requests.get(
-            "https://api.search.brave.com/res/v1/web/search",
-            headers={"Accept": "application/json",
-                     "x-subscription-token": token},
-            params=params,
-        )
+        with providers.slot("brave"):
+            resp = get_brave_session().get(
+                "https://api.search.brave.com/res/v1/web/search",
+                headers={"Accept": "application/json",
+                         "x-subscription-token": token},
+                params=params,
+            )
         resp.raise_for_status()
         data = resp.json()
         return data.get("web", {}).get("results", [])
@@ -0,0 +1,302 @@
+# batcher.py
+
+import time, queue, logging, threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from core.utils import metrics
+from core.utils.config import Config
+from core.ai.ai import call_llm_api_batch, call_vec_api, get_gemini_embeddings
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent embedding requests for one task type and sends each
+    window's worth as a single multi-content request, then hands every caller
+    its own vector. Up to `concurrency` batches are in flight at once, each
+    bounded by `timeout`, so one slow request doesn't hold up the windows
+    behind it. The dispatch thread starts on first use, so it belongs to the
+    process (gunicorn worker) that uses it rather than the one that imported
+    it.
+    """
+
+    def __init__(self, task_type, window_ms, max_batch, concurrency, timeout=None):
+        self.task_type = task_type
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(concurrency)
+        self._pool = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"embed-batch-{self.task_type}")
+                self._thread = threading.Thread(
+                    target=self._loop, name=f"embed-batcher-{self.task_type}", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, text):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text, timeout=None):
+        """Vector for `text`, or [] if the batch failed or didn't finish in time."""
+        try:
+            return self.submit(text).result(timeout=timeout)
+        except Exception as e:
+            logger.info(f"Batched embedding failed: {e}")
+            return []
+
+    # ---------------------------------- DISPATCH ------------------------------------
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # Requests keep collecting while every slot is busy
+            self._slots.acquire()
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._pool.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        # Identical texts in one window are only sent once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+
+        start = time.perf_counter()
+        try:
+            vectors = get_gemini_embeddings(texts, self.task_type, timeout=self.timeout)
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(texts)} failed: {e}")
+            vectors = [[] for _ in texts]
+        finally:
+            self._slots.release()
+        latency = time.perf_counter() - start
+
+        metrics.observe("embed_batch.size", len(texts))
+        metrics.observe("embed_batch.latency", latency)
+        metrics.inc("embed_batch.batches")
+        metrics.inc("embed_batch.requests", len(batch))
+
+        by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            future.set_result(by_text.get(text, []))
+
+query_batcher = EmbeddingBatcher(
+    "RETRIEVAL_QUERY",
+    window_ms=Config.EMBED_BATCH_WINDOW_MS,
+    max_batch=Config.EMBED_BATCH_MAX,
+    concurrency=Config.EMBED_BATCH_CONCURRENCY,
+    timeout=Config.EMBED_BATCH_TIMEOUT
+)
+
+# Query embedding requests run here so the caller can stop waiting at the deadline
+query_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="embed-query")
+
+# Successful provider latencies the hedge delay is derived from
+HEDGE_MIN_SAMPLES = 20
+
+def _query_attempt(text, timeout, batched):
+    """One request for the query embedding; [] on failure or timeout."""
+    start = time.perf_counter()
+    if batched:
+        vector = query_batcher.embed(text, timeout=timeout)
+    else:
+        vector = call_vec_api(query_text=text, task_type="RETRIEVAL_QUERY", timeout=timeout)
+    if vector:
+        metrics.observe("embed_query.latency", time.perf_counter() - start)
+    return vector
+
+def hedge_delay(deadline):
+    """Seconds to give the first request before hedging: the recent percentile latency, within bounds."""
+    delay = metrics.percentile("embed_query.latency", Config.QUERY_EMBED_HEDGE_PERCENTILE, min_samples=HEDGE_MIN_SAMPLES)
+    if delay is None:
+        delay = Config.QUERY_EMBED_HEDGE_DEFAULT_MS / 1000
+    return min(max(delay, Config.QUERY_EMBED_HEDGE_MIN_MS / 1000), deadline)
+
+def embed_query(text):
+    """
+    Query embedding through the batcher (or a direct call when batching is
+    off) within QUERY_EMBED_DEADLINE_MS. A first request that is still out
+    after hedge_delay(), or has already failed, gets a second one sent
+    straight to the provider, and the first vector back wins. Returns [] once
+    the deadline passes, leaving the slow requests to finish on their own.
+    """
+    batched = Config.EMBED_BATCH_WINDOW_MS > 0
+    deadline = Config.QUERY_EMBED_DEADLINE_MS / 1000
+    if deadline <= 0:
+        return _query_attempt(text, Config.EMBED_BATCH_TIMEOUT if batched else None, batched)
+
+    start = time.monotonic()
+    end = start + deadline
+    hedge_at = start + hedge_delay(deadline) if Config.QUERY_EMBED_HEDGE_PERCENTILE > 0 else None
+    pending = {query_executor.submit(_query_attempt, text, deadline, batched)}
+    hedge = None
+
+    while pending:
+        now = time.monotonic()
+        if now >= end:
+            break
+        until = min(end, hedge_at) if hedge is None and hedge_at is not None else end
+        done, pending = wait(pending, timeout=max(0, until - now), return_when=FIRST_COMPLETED)
+        for future in done:
+            vector = future.result()
+            if vector:
+                if future is hedge:
+                    metrics.inc("embed_query.hedge_won")
+                return vector
+
+        if hedge is None and hedge_at is not None and (done or time.monotonic() >= hedge_at):
+            metrics.inc("embed_query.hedged")
+            hedge = query_executor.submit(_query_attempt, text, max(0.001, end - time.monotonic()), False)
+            pending.add(hedge)
+
+    if pending:
+        metrics.inc("embed_query.deadline_exceeded")
+        logger.warning(f"Query embedding missed its {deadline:.2f}s deadline")
+    else:
+        metrics.inc("embed_query.failed")
+    return []
+
+# ---------------------------------- EXTRACTION ------------------------------------
+
+class ExtractionBatcher:
+    """
+    Packs the extraction requests of entries processed side by side into one
+    multi-image call while the ingest queue is deep (services/worker.py turns
+    it on and off). At most `concurrency` batches are in flight; requests that
+    arrive meanwhile wait for a free slot and go out together, so a busy queue
+    fills its batches without a long window. A request that ends up alone, or
+    that the response leaves out, resolves to None and the caller extracts it
+    on its own.
+    """
+
+    def __init__(self, window_ms, max_batch, max_bytes, concurrency):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.active = False
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(concurrency)
+        self._pool = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def set_active(self, active):
+        if active != self.active:
+            logger.info(f"Batched extraction {'on' if active else 'off'}")
+        self.active = active
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="extract-batch")
+                self._thread = threading.Thread(target=self._loop, name="extract-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, image_id, image_b64, usage=None):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((str(image_id), image_b64, usage, future))
+        return future
+
+    def extract(self, image_id, image_b64, usage=None, timeout=None):
+        """Content JSON for the image, or None if the caller should extract it alone."""
+        try:
+            return self.submit(image_id, image_b64, usage).result(timeout=timeout)
+        except Exception as e:
+            logger.info(f"Batched extraction failed: {e}")
+            return None
+
+    # ---------------------------------- DISPATCH ------------------------------------
+
+    def _loop(self):
+        carry = None
+        while True:
+            first = carry or self._queue.get()
+            carry = None
+            # Wait for a free slot first; requests queue up behind a full one
+            self._slots.acquire()
+            batch, size = [first], len(first[1])
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if size + len(item[1]) > self.max_bytes:
+                    carry = item
+                    break
+                batch.append(item)
+                size += len(item[1])
+            self._pool.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        try:
+            if len(batch) == 1:
+                metrics.inc("extract_batch.singles")
+                batch[0][3].set_result(None)
+                return
+
+            batch_usage = {}
+            start = time.perf_counter()
+            try:
+                results = call_llm_api_batch([(image_id, b64) for image_id, b64, _, _ in batch], usage=batch_usage)
+            except Exception as e:
+                logger.error(f"Extraction batch of {len(batch)} failed: {e}")
+                results = {}
+            latency = time.perf_counter() - start
+
+            missing = len(batch) - len(results)
+            metrics.observe("extract_batch.size", len(batch))
+            metrics.observe("extract_batch.latency", latency)
+            metrics.inc("extract_batch.batches")
+            metrics.inc("extract_batch.requests", len(batch))
+            metrics.inc("extract_batch.missing", missing)
+            if missing:
+                logger.warning(f"Extraction batch of {len(batch)} left out {missing} images")
+
+            for image_id, image_b64, usage, future in batch:
+                content = results.get(image_id)
+                if content is not None and usage is not None:
+                    # Each entry carries its own payload size and an even share of the batch's tokens
+                    usage.update({
+                        "request_bytes": len(image_b64),
+                        "prompt_tokens": batch_usage.get("prompt_tokens", 0) // len(batch),
+                        "output_tokens": batch_usage.get("output_tokens", 0) // len(batch),
+                        "latency": round(latency, 3),
+                        "batch_size": len(batch),
+                    })
+                future.set_result(content)
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+extraction_batcher = ExtractionBatcher(
+    window_ms=Config.EXTRACT_BATCH_WINDOW_MS,
+    max_batch=Config.EXTRACT_BATCH_MAX,
+    max_bytes=Config.EXTRACT_BATCH_MAX_KB * 1024,
+    concurrency=Config.EXTRACT_BATCH_CONCURRENCY
+)
@@ -0,0 +1,145 @@
+# embeddings.py
+
+import time, base64, sqlite3, logging, threading
+from hashlib import sha256
+import numpy as np
+from cachetools import LRUCache
+from core.utils import metrics
+from core.utils.cache import get_redis
+from core.utils.config import Config
+from core.utils.timing import timed_route
+from core.ai.ai import call_vec_api, EMBEDDING_MODEL, EMBEDDING_DIMS
+from core.ai.batcher import embed_query
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "emb:"
+
+# Tier 1: per-process LRU of key -> (vector, provider latency of the original call)
+_memory = LRUCache(maxsize=Config.EMBEDDING_CACHE_SIZE)
+_memory_lock = threading.Lock()
+
+# Tier 2 without Redis: one sqlite connection per thread, shared across workers through the file
+_disk = threading.local()
+
+# ---------------------------------- HELPERS ------------------------------------
+
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+def _make_key(text, task_type):
+    h = sha256(f"{EMBEDDING_MODEL}:{EMBEDDING_DIMS}:{task_type}:{text}".encode()).hexdigest()
+    return f"{KEY_PREFIX}{h}"
+
+def _encode(vector, latency):
+    blob = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode()
+    return f"{latency:.4f}:{blob}"
+
+def _decode(value):
+    latency, blob = value.split(":", 1)
+    return np.frombuffer(base64.b64decode(blob), dtype=np.float32).tolist(), float(latency)
+
+def _disk_conn():
+    conn = getattr(_disk, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(Config.EMBEDDING_CACHE_PATH, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at INTEGER NOT NULL
+            )
+        """)
+        _disk.conn = conn
+    return conn
+
+# ---------------------------------- SHARED TIER ------------------------------------
+
+def _shared_get(key):
+    try:
+        redis = get_redis()
+        if redis:
+            value = redis.get(key)
+        elif Config.EMBEDDING_CACHE_PATH:
+            row = _disk_conn().execute(
+                "SELECT value FROM embeddings WHERE key = ? AND created_at > ?",
+                (key, int(time.time()) - Config.EMBEDDING_CACHE_TTL)
+            ).fetchone()
+            value = row[0] if row else None
+        else:
+            return None
+        return _decode(value) if value else None
+    except Exception as e:
+        logger.warning(f"Embedding cache read failed: {e}")
+        return None
+
+def _shared_set(key, vector, latency):
+    try:
+        value = _encode(vector, latency)
+        redis = get_redis()
+        if redis:
+            redis.setex(key, Config.EMBEDDING_CACHE_TTL, value)
+        elif Config.EMBEDDING_CACHE_PATH:
+            conn = _disk_conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, int(time.time()))
+            )
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"Embedding cache write failed: {e}")
+
+# ---------------------------------- LOOKUP ------------------------------------
+
+def _record(outcome, saved_latency=0.0):
+    metrics.inc(f"embed_cache.{outcome}")
+    if saved_latency:
+        metrics.inc("embed_cache.saved_seconds", saved_latency)
+
+    hits = sum(metrics.get_counter(f"embed_cache.{t}") for t in ("hit_memory", "hit_shared"))
+    total = hits + metrics.get_counter("embed_cache.miss") + metrics.get_counter("embed_cache.failure")
+    metrics.set_gauge("embed_cache.hit_ratio", round(hits / total, 4) if total else 0)
+
+@timed_route("cached_embedding")
+def cached_embedding(text, task_type="RETRIEVAL_QUERY"):
+    """
+    Embedding for `text` through the in-process LRU, then the shared tier
+    (Redis, or the sqlite file at EMBEDDING_CACHE_PATH), then the provider.
+    Returns [] on provider failure, which is never cached.
+
+    Only the cache key uses the normalized text; the provider embeds `text`
+    as given, so a miss returns the same vector as an uncached call.
+    """
+    key = _make_key(normalize_text(text), task_type)
+
+    with _memory_lock:
+        cached = _memory.get(key)
+    if cached:
+        _record("hit_memory", cached[1])
+        return list(cached[0])
+
+    cached = _shared_get(key)
+    if cached:
+        with _memory_lock:
+            _memory[key] = cached
+        _record("hit_shared", cached[1])
+        return list(cached[0])
+
+    start = time.perf_counter()
+    if task_type == "RETRIEVAL_QUERY":
+        vector = embed_query(text)
+    else:
+        vector = call_vec_api(query_text=text, task_type=task_type)
+    latency = time.perf_counter() - start
+
+    if not vector or len(vector) != EMBEDDING_DIMS:
+        _record("failure")
+        return []
+
+    metrics.observe("embed_cache.provider_latency", latency)
+    _record("miss")
+    with _memory_lock:
+        _memory[key] = (list(vector), latency)
+    _shared_set(key, vector, latency)
+    return list(vector)
@@ -0,0 +1,170 @@
+# providers.py
+
+import os, time, logging, threading
+from contextlib import contextmanager
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPSConnectionPool
+from exa_py import Exa
+from google import genai
+from google.genai import types
+from core.utils import metrics
+from core.utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+# One long-lived client per provider and process, each with a bounded pool of
+# keep-alive connections, and one Provider per quota that every outbound call
+# goes through: a token bucket paces calls to the quota's rate, a semaphore
+# caps calls in flight, and both report to core/utils/metrics as
+# provider.<name>.* (in_flight gauge, queue_wait histogram, calls, rejected
+# and connections counters).
+
+class ProviderBusy(TimeoutError):
+    """No slot for the call within its timeout."""
+
+class TokenBucket:
+    """`rate` tokens a second up to `burst` banked; rate <= 0 never waits."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        if self.rate <= 0:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+class Provider:
+    def __init__(self, name, concurrency, rpm):
+        self.name = name
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rpm / 60, burst=concurrency)
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _set_in_flight(self, delta):
+        with self._lock:
+            self._in_flight += delta
+            metrics.set_gauge(f"provider.{self.name}.in_flight", self._in_flight)
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """Hold one of the provider's call slots; raises ProviderBusy after `timeout` seconds."""
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+        if not self.bucket.acquire(deadline):
+            metrics.inc(f"provider.{self.name}.rejected")
+            raise ProviderBusy(f"{self.name}: rate limit")
+        remaining = max(0, deadline - time.monotonic()) if deadline is not None else None
+        if not self._slots.acquire(timeout=remaining):
+            metrics.inc(f"provider.{self.name}.rejected")
+            raise ProviderBusy(f"{self.name}: {self.concurrency} calls in flight")
+
+        metrics.observe(f"provider.{self.name}.queue_wait", time.monotonic() - start)
+        metrics.inc(f"provider.{self.name}.calls")
+        self._set_in_flight(1)
+        try:
+            yield
+        finally:
+            self._set_in_flight(-1)
+            self._slots.release()
+
+PROVIDERS = {
+    "gemini_generate": Provider("gemini_generate", Config.GEMINI_GENERATE_CONCURRENCY, Config.GEMINI_GENERATE_RPM),
+    "gemini_embed": Provider("gemini_embed", Config.GEMINI_EMBED_CONCURRENCY, Config.GEMINI_EMBED_RPM),
+    "exa": Provider("exa", Config.EXA_CONCURRENCY, Config.EXA_RPM),
+    "brave": Provider("brave", Config.BRAVE_CONCURRENCY, Config.BRAVE_RPM),
+}
+
+def slot(name, timeout=None):
+    return PROVIDERS[name].slot(timeout)
+
+# ---------------------------------- CLIENTS ------------------------------------
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _client(name, build):
+    if name not in _clients:
+        with _clients_lock:
+            if name not in _clients:
+                _clients[name] = build()
+                logger.info(f"Created {name} client")
+    return _clients[name]
+
+def _count_connections(name):
+    """httpx request hook that counts the new connections (TCP + TLS handshakes) a request opens."""
+    def trace(event, info):
+        if event == "connection.connect_tcp.complete":
+            metrics.inc(f"provider.{name}.connections")
+
+    def hook(request):
+        request.extensions["trace"] = trace
+    return hook
+
+def _build_gemini():
+    pool = Config.GEMINI_GENERATE_CONCURRENCY + Config.GEMINI_EMBED_CONCURRENCY
+    return genai.Client(
+        api_key=os.environ.get("GEMINI_API_KEY"),
+        http_options=types.HttpOptions(client_args={
+            "limits": httpx.Limits(
+                max_connections=pool,
+                max_keepalive_connections=pool,
+                keepalive_expiry=Config.PROVIDER_KEEPALIVE_SECONDS,
+            ),
+            "event_hooks": {"request": [_count_connections("gemini")]},
+        }),
+    )
+
+def get_gemini_client():
+    """One client per process, so calls reuse its pooled keep-alive connections."""
+    return _client("gemini", _build_gemini)
+
+def get_exa_client():
+    token = os.environ.get("EXA_AI_API_KEY")
+    if not token:
+        raise RuntimeError("EXA_AI_API_KEY not set")
+    return _client("exa", lambda: Exa(api_key=token))
+
+class _CountingAdapter(HTTPAdapter):
+    """Keep-alive pool for one provider that counts the connections it opens."""
+
+    def __init__(self, name, pool_size):
+        self.name = name
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        name = self.name
+
+        class Pool(HTTPSConnectionPool):
+            def _new_conn(self):
+                metrics.inc(f"provider.{name}.connections")
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = dict(self.poolmanager.pool_classes_by_scheme, https=Pool)
+
+def _build_session(name, pool_size):
+    session = requests.Session()
+    session.mount("https://", _CountingAdapter(name, pool_size))
+    return session
+
+def get_brave_session():
+    return _client("brave", lambda: _build_session("brave", Config.BRAVE_CONCURRENCY))
@@ -1,9 +1,11 @@
 # image.py
 
 import json, base64, io, math, os, uuid, logging
+import numpy as np
 from typing import Tuple
 from typing import List, Optional
 from core.utils.config import Config
+from core.content.storage import THUMBNAIL_FORMATS, atomic_write, store_bytes, thumbnail_files, thumbnail_variant_path
 from werkzeug.utils import secure_filename
 from PIL import Image
 
@@ -14,6 +16,145 @@ def encode_image_to_base64(path):
     with open(path, "rb") as f:
         return base64.b64encode(f.read()).decode("utf-8")
 
+# ---------------------------------- JPEG ENCODING ------------------------------------
+
+QUALITY_MIN, QUALITY_MAX = 5, 95
+PROBE_PIXELS = 512 * 512
+PROBE_TILE = 32
+PROBE_QUALITIES = (5, 25, 60, 85, 95)
+MAX_ENCODES = 6
+# A result within this fraction of the target is good enough to stop refining
+NEAR_TARGET = 0.9
+
+def _jpeg(img, quality, optimize=True):
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality, optimize=optimize)
+    return buffer.getvalue()
+
+def _resize(img, scale):
+    if scale >= 1.0:
+        return img
+    size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+    # reducing_gap does most of the shrink with a fast box reduce() before LANCZOS
+    return img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+def _probe_tiles(img):
+    """
+    A mosaic of full-resolution tiles spread over the image. Unlike a
+    downscaled copy it keeps the native detail per pixel that drives JPEG size.
+    """
+    if img.width * img.height <= PROBE_PIXELS:
+        return img
+    grid = int(math.sqrt(PROBE_PIXELS // (PROBE_TILE * PROBE_TILE)))
+    tile_w, tile_h = min(PROBE_TILE, img.width // grid), min(PROBE_TILE, img.height // grid)
+    probe = Image.new("RGB", (tile_w * grid, tile_h * grid))
+    for row in range(grid):
+        for col in range(grid):
+            x = col * (img.width - tile_w) // max(1, grid - 1)
+            y = row * (img.height - tile_h) // max(1, grid - 1)
+            probe.paste(img.crop((x, y, x + tile_w, y + tile_h)), (col * tile_w, row * tile_h))
+    return probe
+
+def _probe_curve(img):
+    """
+    Bytes per pixel as a function of quality, estimated from a few quick
+    encodes of sampled tiles and interpolated in log space.
+    """
+    probe = _probe_tiles(img)
+    pixels = probe.width * probe.height
+    points = [(q, math.log(len(_jpeg(probe, q, optimize=False)) / pixels)) for q in PROBE_QUALITIES]
+
+    def bytes_per_pixel(quality):
+        # Piecewise linear between probes, extended from the end segments
+        (q0, y0), (q1, y1) = points[0], points[1]
+        for a, b in zip(points, points[1:]):
+            (q0, y0), (q1, y1) = a, b
+            if quality <= q1:
+                break
+        return math.exp(y0 + (y1 - y0) * (quality - q0) / (q1 - q0))
+
+    return bytes_per_pixel
+
+def _encode_jpeg(img, target_bytes):
+    """
+    Largest-quality JPEG of `img` under `target_bytes`, scaling down in 0.8
+    steps when even the lowest quality won't fit. Scale and quality are
+    predicted from a probe; every full encode then narrows the quality range
+    and recalibrates the prediction, so this usually takes one or two encodes
+    instead of a binary search per scale.
+    Returns (jpeg bytes, the image that was encoded).
+    """
+    curve = _probe_curve(img)
+    ratios = {}     # quality -> actual / probed bytes, from full encodes
+
+    def predicted(quality, pixels):
+        below = [q for q in ratios if q <= quality]
+        above = [q for q in ratios if q >= quality]
+        if below and above:
+            # Between two full encodes: interpolate their corrections
+            q0, q1 = max(below), min(above)
+            t = (quality - q0) / (q1 - q0) if q1 != q0 else 0
+            ratio = math.exp((1 - t) * math.log(ratios[q0]) + t * math.log(ratios[q1]))
+        else:
+            ratio = ratios[max(below) if below else min(above)] if ratios else 1.0
+        return curve(quality) * ratio * pixels
+
+    scale = 1.0
+    while scale > 0.1 and predicted(QUALITY_MIN, img.width * img.height * scale * scale) > target_bytes:
+        scale *= 0.8
+    # The probe overstates low-quality sizes, so check whether a larger step still fits
+    while scale < 1.0:
+        larger = min(1.0, scale / 0.8)
+        if len(_jpeg(_resize(img, larger), QUALITY_MIN)) > target_bytes:
+            break
+        scale = larger
+    resized = _resize(img, scale)
+
+    # Largest quality known to fit and smallest known to overshoot, at this scale
+    lo, hi = QUALITY_MIN - 1, QUALITY_MAX + 1
+    best = None
+    for _ in range(MAX_ENCODES):
+        pixels = resized.width * resized.height
+        candidates = [q for q in range(hi - 1, lo, -1) if predicted(q, pixels) <= target_bytes]
+        if candidates:
+            quality = candidates[0]
+        elif lo >= QUALITY_MIN:
+            break
+        else:
+            quality = QUALITY_MIN
+
+        data = _jpeg(resized, quality)
+        ratios[quality] = len(data) / (curve(quality) * pixels)
+
+        if len(data) <= target_bytes:
+            lo, best = quality, (data, quality)
+            if len(data) >= target_bytes * NEAR_TARGET or quality + 1 >= hi:
+                break
+        elif quality > QUALITY_MIN:
+            hi = quality
+        else:
+            # Not even the lowest quality fits; drop a scale step and search again
+            scale *= 0.8
+            if scale <= 0.1:
+                break
+            resized = _resize(img, scale)
+            lo, hi = QUALITY_MIN - 1, QUALITY_MAX + 1
+
+    if best:
+        data, quality = best
+        logger.info(f"Compressed to {len(data)/1024:.1f} KB at scale {scale:.2f}, quality {quality}")
+        return data, resized
+
+    # fallback: save at lowest quality, smallest scale
+    img = img.copy()
+    img.thumbnail((320, 320), Image.LANCZOS)
+    logger.warning("Fallback compression used")
+    return _jpeg(img, QUALITY_MIN), img
+
+def compressed_path_for(source_path):
+    name, _ = os.path.splitext(os.path.basename(source_path))
+    return os.path.join(Config.UPLOAD_DIR, secure_filename(f"{name}.jpg"))
+
 def compress_image(tempfile, max_size_kb=500):
     logger.info(f"Compressing image at {tempfile}")
     try:
@@ -24,56 +165,14 @@ def compress_image(tempfile, max_size_kb=500):
             logger.error(f"Invalid file name format: {file_name}")
             return None
 
-        name, _ = os.path.splitext(file_name)
-        final_filename = secure_filename(f"{name}.jpg")
-        final_filepath = os.path.join(Config.UPLOAD_DIR, final_filename)
+        final_filepath = compressed_path_for(temp_path)
 
         img = Image.open(temp_path)
         if img.mode != "RGB":
             img = img.convert("RGB")
 
-        target_bytes = max_size_kb * 1024
-
-        # keep scaling down until we succeed
-        scale = 1.0
-        while scale > 0.1:
-            # resize if scale < 1.0
-            if scale < 1.0:
-                new_w = int(img.width * scale)
-                new_h = int(img.height * scale)
-                if new_w < 1 or new_h < 1:
-                    break
-                img_resized = img.resize((new_w, new_h), Image.LANCZOS)
-            else:
-                img_resized = img
-
-            # binary search JPEG quality
-            low, high = 5, 95
-            best_bytes = None
-            while low <= high:
-                mid = (low + high) // 2
-                buffer = io.BytesIO()
-                img_resized.save(buffer, format="JPEG", quality=mid, optimize=True)
-                size = buffer.tell()
-                if size <= target_bytes:
-                    best_bytes = buffer.getvalue()
-                    low = mid + 1
-                else:
-                    high = mid - 1
-
-            if best_bytes:
-                with open(final_filepath, "wb") as f:
-                    f.write(best_bytes)
-                logger.info(f"Compressed to {len(best_bytes)/1024:.1f} KB at scale {scale:.2f}")
-                return final_filepath
-
-            # if still too large, reduce scale and retry
-            scale *= 0.8
-
-        # fallback: save at lowest quality, smallest scale
-        img.thumbnail((320, 320), Image.LANCZOS)
-        img.save(final_filepath, format="JPEG", quality=5, optimize=True)
-        logger.warning(f"Fallback compression used for {final_filepath}")
+        jpeg_bytes, _ = _encode_jpeg(img, max_size_kb * 1024)
+        atomic_write(final_filepath, jpeg_bytes)
         return final_filepath
 
     except Exception as e:
@@ -90,7 +189,9 @@ def generate_thumbnail(file_path):
         if ext.endswith(('.jpg', '.jpeg', '.png', '.webp')):
             with Image.open(file_path) as img:
                 img.thumbnail((300, 300))
-                img.save(dest_path, "JPEG")
+                buffer = io.BytesIO()
+                img.save(buffer, "JPEG")
+            atomic_write(dest_path, buffer.getvalue())
         else:
             return None  # unsupported
         
@@ -102,6 +203,297 @@ def generate_thumbnail(file_path):
         logger.error(f"Failed to create thumbnail for {file_path}: {e}")
         return None
 
+# ---------------------------------- THUMBNAIL VARIANTS ------------------------------------
+
+def save_thumbnail_variants(img, thumbnail_path):
+    """Write every configured size and format of `img` next to `thumbnail_path`."""
+    # Largest first, each cut from the previous one rather than the full image
+    current = img
+    for size in sorted(Config.THUMBNAIL_SIZES, reverse=True):
+        current = current.copy()
+        current.thumbnail((size, size), Image.LANCZOS)
+        for fmt, (pil_format, _, _) in THUMBNAIL_FORMATS.items():
+            buffer = io.BytesIO()
+            options = {"method": 4} if fmt == "webp" else {"optimize": True}
+            current.save(buffer, pil_format, quality=Config.THUMBNAIL_QUALITY, **options)
+            atomic_write(thumbnail_variant_path(thumbnail_path, size, fmt), buffer.getvalue())
+
+# ---------------------------------- PLACEHOLDERS ------------------------------------
+
+# A blurry stand-in small enough to send inline with every result, so a grid
+# can paint before any thumbnail arrives. blurhash isn't a dependency, so this
+# is a tiny WebP as a data URI (a couple hundred bytes) that browsers and
+# image views decode natively; clients scale it up with a blur.
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 30
+DOMINANT_SAMPLE = 32
+DOMINANT_COLORS = 8
+
+def preview_source(img):
+    # One cheap box reduction shared by both, instead of each resampling the full image
+    small = img.convert("RGB") if img.mode != "RGB" else img.copy()
+    small.thumbnail((DOMINANT_SAMPLE * 2, DOMINANT_SAMPLE * 2), Image.BOX)
+    return small
+
+def placeholder_data_uri(img):
+    small = img.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.LANCZOS)
+    buffer = io.BytesIO()
+    small.save(buffer, "WEBP", quality=PLACEHOLDER_QUALITY, method=6)
+    return "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def dominant_color(img):
+    """Hex of the most common color after quantizing a small copy of `img`."""
+    small = img.copy()
+    small.thumbnail((DOMINANT_SAMPLE, DOMINANT_SAMPLE), Image.BOX)
+    quantized = small.quantize(colors=DOMINANT_COLORS, method=Image.Quantize.MEDIANCUT)
+    count, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+def image_previews(img):
+    """(placeholder data URI, dominant color hex) for `img`."""
+    small = preview_source(img)
+    return placeholder_data_uri(small), dominant_color(small)
+
+# ---------------------------------- PERCEPTUAL HASH ------------------------------------
+
+DHASH_SIZE = 8
+
+def dhash(img):
+    """
+    64-bit difference hash: whether each pixel of a 9x8 grayscale copy is
+    brighter than its right neighbour. Re-screenshots and light crops or
+    recompression of the same post land a few bits apart.
+    """
+    small = img.convert("L").resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(DHASH_SIZE):
+        for col in range(DHASH_SIZE):
+            left = pixels[row * (DHASH_SIZE + 1) + col]
+            right = pixels[row * (DHASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+# Two screenshots from one app template can land a few dHash bits apart with
+# entirely different text, so a match is confirmed on the stored files before
+# an extraction is reused: both are compared tile by tile on a VERIFY_SIDE
+# wide grayscale copy. A changed line of text shows up as a few tiles far off,
+# which an average over the whole image would wash out; recompression and
+# rescaling of the same screenshot stay close in every tile.
+VERIFY_SIDE = 384
+VERIFY_TILE = 16
+
+def _verify_source(path):
+    with Image.open(path) as img:
+        img.draft("L", (VERIFY_SIDE * 2, VERIFY_SIDE * 2))
+        gray = img.convert("L")
+    height = max(VERIFY_TILE, round(gray.height * VERIFY_SIDE / gray.width))
+    return np.asarray(gray.resize((VERIFY_SIDE, height), Image.BOX), dtype=np.float32)
+
+def tile_difference(path_a, path_b):
+    """
+    Largest mean absolute difference (0-255) over the tiles of two images,
+    or inf when their aspect ratios differ (crops are not confirmed).
+    """
+    a, b = _verify_source(path_a), _verify_source(path_b)
+    if abs(a.shape[0] - b.shape[0]) > 1:
+        return math.inf
+    rows = min(a.shape[0], b.shape[0]) // VERIFY_TILE
+    cols = VERIFY_SIDE // VERIFY_TILE
+    size = (rows * VERIFY_TILE, cols * VERIFY_TILE)
+    diff = np.abs(a[:size[0], :size[1]] - b[:size[0], :size[1]])
+    return float(diff.reshape(rows, VERIFY_TILE, cols, VERIFY_TILE).mean(axis=(1, 3)).max())
+
+# ---------------------------------- LLM PAYLOAD ------------------------------------
+
+# The extraction prompt mostly needs the text to stay readable, and the
+# provider bills images by 768px tile (258 tokens each; one tile when both
+# sides fit in 384px). So the payload is the smallest copy whose small print
+# keeps an x-height of LLM_MIN_TEXT_PX, nudged down onto a tile boundary when
+# that costs little; images with little text get LLM_PAYLOAD_PHOTO_SIDE.
+
+TILE_SIDE = 768
+TILE_TOKENS = 258
+SMALL_IMAGE_SIDE = 384
+ANALYSIS_WIDTH = 1280
+EDGE_THRESHOLD = 40
+TEXT_ROW_ENERGY = 0.04
+MIN_TEXT_DENSITY = 0.05
+# Give up at most this much scale to save a row or column of tiles
+TILE_SNAP = 0.12
+
+def estimate_tokens(width, height):
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return TILE_TOKENS
+    return TILE_TOKENS * math.ceil(width / TILE_SIDE) * math.ceil(height / TILE_SIDE)
+
+def text_profile(img):
+    """
+    (text density, small-print text height in source px). Rows with many
+    strong horizontal gradients are text; a run of them spans roughly one
+    line's x-height, and the 25th percentile of the runs is the small print.
+    """
+    factor = min(1.0, ANALYSIS_WIDTH / img.width)
+    small = img if factor == 1.0 else img.resize((ANALYSIS_WIDTH, max(1, round(img.height * factor))), Image.BOX)
+    gray = np.asarray(small.convert("L"), dtype=np.int16)
+    edges = np.abs(np.diff(gray, axis=1)) > EDGE_THRESHOLD
+    rows = edges.mean(axis=1) > TEXT_ROW_ENERGY
+
+    # Lengths of the runs of text rows
+    padded = np.concatenate(([0], rows.astype(np.int8), [0]))
+    changes = np.flatnonzero(np.diff(padded))
+    heights = changes[1::2] - changes[::2]
+    heights = heights[(heights >= 3) & (heights <= 200 * factor)]
+    if not len(heights):
+        return 0.0, None
+    return float(rows.mean()), float(np.percentile(heights, 25)) / factor
+
+def payload_scale(width, height, density, text_height):
+    long_side = max(width, height)
+    if density < MIN_TEXT_DENSITY or not text_height:
+        scale = Config.LLM_PAYLOAD_PHOTO_SIDE / long_side
+    else:
+        scale = Config.LLM_MIN_TEXT_PX / text_height
+    scale = min(1.0, scale, Config.LLM_PAYLOAD_MAX_SIDE / long_side)
+
+    # Tall screenshots pay per row of tiles: drop to the boundary below if it's close
+    for side in (width, height):
+        tiles = math.ceil(side * scale / TILE_SIDE)
+        if tiles > 1:
+            snapped = (tiles - 1) * TILE_SIDE / side
+            if snapped >= scale * (1 - TILE_SNAP):
+                scale = snapped
+    return scale
+
+def llm_payload_image(img):
+    """
+    The smallest legible copy of `img` for the vision LLM, as (jpeg bytes,
+    accounting dict).
+    """
+    density, text_height = text_profile(img)
+    scale = payload_scale(img.width, img.height, density, text_height)
+    resized = _resize(img, scale)
+    data = _jpeg(resized, Config.LLM_PAYLOAD_QUALITY)
+    # Dense text can still be large; never send more than the compressed file's budget
+    if len(data) > Config.LLM_PAYLOAD_MAX_KB * 1024:
+        data, resized = _encode_jpeg(resized, Config.LLM_PAYLOAD_MAX_KB * 1024)
+    info = {
+        "width": resized.width,
+        "height": resized.height,
+        "payload_bytes": len(data),
+        "estimated_tokens": estimate_tokens(resized.width, resized.height),
+        "text_density": round(density, 3),
+        "text_height": round(text_height, 1) if text_height else None,
+    }
+    logger.info(f"LLM payload {resized.width}x{resized.height} ({len(data)/1024:.1f} KB, ~{info['estimated_tokens']} tokens)")
+    return data, info
+
+def llm_payload_for_path(path):
+    """(base64 payload, accounting dict) for a stored image; used when a retry skipped decoding."""
+    with Image.open(path) as img:
+        if Config.LLM_PAYLOAD_ADAPTIVE:
+            data, info = llm_payload_image(img.convert("RGB"))
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+            info = {"width": img.width, "height": img.height, "payload_bytes": len(data),
+                    "estimated_tokens": estimate_tokens(img.width, img.height)}
+    return base64.b64encode(data).decode("utf-8"), info
+
+class ImageContext:
+    """
+    One decoded upload. The compressed JPEG, the thumbnail and the LLM payload
+    all come from the same in-memory image, so the upload is read and decoded
+    once and the compressed file is never read back.
+    """
+
+    def __init__(self, source_path, max_size_kb=500):
+        self.source_path = source_path
+        self.max_size_kb = max_size_kb
+        with Image.open(source_path) as img:
+            self.image = img.convert("RGB") if img.mode != "RGB" else img.copy()
+        self._jpeg = None
+        self._encoded = None
+        self._small = None
+        self.payload_info = None
+
+    def _compress(self):
+        if self._jpeg is None:
+            self._jpeg, self._encoded = _encode_jpeg(self.image, self.max_size_kb * 1024)
+        return self._jpeg
+
+    @property
+    def jpeg_bytes(self):
+        return self._compress()
+
+    def llm_payload(self):
+        """Base64 JPEG for call_llm_api: the smallest legible size, or the compressed file."""
+        if not Config.LLM_PAYLOAD_ADAPTIVE:
+            data = self._compress()
+            self.payload_info = {"width": self._encoded.width, "height": self._encoded.height, "payload_bytes": len(data),
+                                 "estimated_tokens": estimate_tokens(self._encoded.width, self._encoded.height)}
+        else:
+            data, self.payload_info = llm_payload_image(self.image)
+        return base64.b64encode(data).decode("utf-8")
+
+    def thumbnail_bytes(self, size=(300, 300)):
+        self._compress()
+        thumb = self._encoded.copy()
+        thumb.thumbnail(size)
+        buffer = io.BytesIO()
+        thumb.save(buffer, "JPEG")
+        return buffer.getvalue()
+
+    def save_compressed(self, dest_path=None):
+        """Under its content name in UPLOAD_DIR unless `dest_path` is given."""
+        if not dest_path:
+            return store_bytes(Config.UPLOAD_DIR, self._compress(), "jpg")
+        atomic_write(dest_path, self._compress())
+        return dest_path
+
+    def save_thumbnail(self, size=(300, 300)):
+        """The 300px JPEG stored as thumbnail_path, plus its size/format variants."""
+        dest_path = store_bytes(Config.THUMBNAIL_DIR, self.thumbnail_bytes(size), "jpg")
+        # The same thumbnail stored before already has its variants
+        if len(thumbnail_files(dest_path)) < 1 + len(Config.THUMBNAIL_SIZES) * len(THUMBNAIL_FORMATS):
+            save_thumbnail_variants(self.image, dest_path)
+        return dest_path
+
+    def _preview_source(self):
+        if self._small is None:
+            self._small = preview_source(self.image)
+        return self._small
+
+    def previews(self):
+        """Placeholder and dominant color, from the full decode rather than the thumbnail."""
+        small = self._preview_source()
+        return placeholder_data_uri(small), dominant_color(small)
+
+    def dhash(self):
+        return dhash(self._preview_source())
+
+def process_upload(source_path, max_size_kb=500):
+    """
+    Decode an upload once and write its compressed JPEG and thumbnail.
+    Returns a dict of compressed_path, thumbnail_path, llm_payload,
+    llm_payload_info, placeholder, dominant_color and dhash.
+    """
+    logger.info(f"Processing image at {source_path}")
+    ctx = ImageContext(source_path, max_size_kb=max_size_kb)
+    placeholder, color = ctx.previews()
+    payload = ctx.llm_payload()
+    return {
+        "compressed_path": ctx.save_compressed(),
+        "thumbnail_path": ctx.save_thumbnail(),
+        "llm_payload": payload,
+        "llm_payload_info": ctx.payload_info,
+        "placeholder": placeholder,
+        "dominant_color": color,
+        "dhash": ctx.dhash(),
+    }
+
 def create_mosaic(image_paths, final_size=(800, 800), grid_size=None, bg_color=(255, 255, 255)):
     """
     Create a mosaic grid from input images.
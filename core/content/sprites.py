@@ -0,0 +1,107 @@
+# sprites.py
+
+import io, os, json, math, hashlib, logging
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from core.utils import metrics
+from core.utils.config import Config
+from core.content import storage
+from core.content.images import THUMBNAIL_FORMATS, atomic_write, thumbnail_variant_path
+
+logger = logging.getLogger(__name__)
+
+# PIL releases the GIL while decoding, so threads are enough here
+_decode_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="sprite-decode")
+
+def sprite_dir():
+    return Config.SPRITE_DIR or os.path.join(Config.THUMBNAIL_DIR, "sprites")
+
+def _source_path(thumbnail_path, tile):
+    # The smallest stored variant that covers a tile, else the original thumbnail
+    for size in sorted(Config.THUMBNAIL_SIZES):
+        if size >= tile:
+            variant = thumbnail_variant_path(thumbnail_path, size, "jpeg")
+            if os.path.exists(variant):
+                return variant
+    return thumbnail_path
+
+def _load_tile(path, tile):
+    with Image.open(path) as img:
+        img.draft("RGB", (tile, tile))
+        img = img.convert("RGB")
+        img.thumbnail((tile, tile), Image.LANCZOS)
+        return img
+
+def _safe_load(thumbnail_path, tile):
+    try:
+        return _load_tile(_source_path(thumbnail_path, tile), tile)
+    except Exception as e:
+        logger.warning(f"Skipping {thumbnail_path} in sprite: {e}")
+        return None
+
+@lru_cache(maxsize=4096)
+def _hash_legacy(path, mtime_ns, size):
+    return storage.hash_file(path)
+
+def _content_digest(thumbnail_path):
+    # Content-addressed names lead with the SHA-256 of the file; older uuid
+    # names say nothing about the bytes, so those files are hashed (once per
+    # version on disk)
+    name = os.path.basename(thumbnail_path)
+    if storage.CONTENT_NAME.match(name):
+        return name[:64]
+    try:
+        st = os.stat(thumbnail_path)
+    except OSError:
+        return f"missing:{name}"
+    return _hash_legacy(thumbnail_path, st.st_mtime_ns, st.st_size)
+
+def sprite_key(thumbnail_paths, tile, fmt, columns):
+    # Keyed on the thumbnails' content, so a rewritten thumbnail never serves a stale sprite
+    digests = "\n".join(_content_digest(p) for p in thumbnail_paths)
+    return hashlib.sha256(f"{tile}:{fmt}:{columns}\n{digests}".encode()).hexdigest()[:32]
+
+def build_sprite(entries, tile=150, fmt="jpeg", columns=10):
+    """
+    One image holding the thumbnails of `entries` ((data_id, thumbnail_path)
+    pairs) in a grid of `tile`-px cells, plus where each landed. Sprites are
+    stored under their key and reused by later requests for the same set.
+    Returns (sprite file name, layout dict).
+    """
+    entries = [(data_id, path) for data_id, path in entries if path]
+    key = sprite_key([p for _, p in entries], tile, fmt, columns)
+    name = f"{key}.{THUMBNAIL_FORMATS[fmt][1]}"
+    image_path = os.path.join(sprite_dir(), name)
+    layout_path = os.path.join(sprite_dir(), f"{key}.json")
+
+    if os.path.exists(image_path) and os.path.exists(layout_path):
+        metrics.inc("sprites.hit")
+        with open(layout_path) as f:
+            return name, json.load(f)
+    metrics.inc("sprites.miss")
+
+    tiles = list(_decode_pool.map(lambda e: _safe_load(e[1], tile), entries))
+    columns = max(1, min(columns, len(entries)))
+    rows = max(1, math.ceil(len(entries) / columns))
+    sprite = Image.new("RGB", (columns * tile, rows * tile), (255, 255, 255))
+
+    offsets = {}
+    for idx, ((data_id, _), img) in enumerate(zip(entries, tiles)):
+        if img is None:
+            continue
+        row, col = divmod(idx, columns)
+        x = col * tile + (tile - img.width) // 2
+        y = row * tile + (tile - img.height) // 2
+        sprite.paste(img, (x, y))
+        offsets[str(data_id)] = [x, y, img.width, img.height]
+
+    buffer = io.BytesIO()
+    sprite.save(buffer, THUMBNAIL_FORMATS[fmt][0], quality=Config.THUMBNAIL_QUALITY)
+    layout = {"width": sprite.width, "height": sprite.height, "tile": tile, "tiles": offsets}
+
+    os.makedirs(sprite_dir(), exist_ok=True)
+    atomic_write(image_path, buffer.getvalue())
+    atomic_write(layout_path, json.dumps(layout).encode())
+    logger.info(f"Built sprite {name} with {len(offsets)} tiles ({len(buffer.getvalue())/1024:.1f} KB)")
+    return name, layout
@@ -0,0 +1,128 @@
+# storage.py
+
+import os, re, uuid, hashlib, logging
+from sqlalchemy import text
+from core.utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Files are named by the SHA-256 of their bytes and sharded two levels deep on
+# the leading hex digits (ab/cd/abcd...jpg), so no directory grows past a few
+# thousand entries and identical content is only ever stored once. Public
+# names are still bare file names; everything that turns one into a path goes
+# through resolve(), which also finds the flat uuid names of older entries.
+
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+CONTENT_NAME = re.compile(r"^[0-9a-f]{64}(_\d+)?\.[a-z0-9]+$")
+
+def relative_path(name):
+    """Where `name` lives under its root: sharded for content names, flat otherwise."""
+    if not CONTENT_NAME.match(name):
+        return name
+    shards = [name[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+    return os.path.join(*shards, name)
+
+def resolve(root, name):
+    return os.path.join(root, relative_path(name))
+
+def atomic_write(path, data):
+    """Write `data` to `path` via a temp file and rename, so readers never see a partial file."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def content_path(root, digest, ext):
+    return resolve(root, f"{digest}.{ext}")
+
+def store_bytes(root, data, ext):
+    """Write `data` under its content name in `root`; a file that's already there is left alone."""
+    path = content_path(root, hash_bytes(data), ext)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, data)
+    return path
+
+# ---------------------------------- THUMBNAIL VARIANTS ------------------------------------
+
+# format -> (PIL format, extension, mime type)
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+
+def thumbnail_variant_path(thumbnail_path, size, fmt):
+    """`{name}.jpg` -> `{name}_{size}.{ext}` next to it."""
+    base, _ = os.path.splitext(thumbnail_path)
+    return f"{base}_{size}.{THUMBNAIL_FORMATS[fmt][1]}"
+
+def thumbnail_files(thumbnail_path):
+    """The thumbnail and whichever of its variants exist."""
+    if not thumbnail_path:
+        return []
+    paths = [thumbnail_path] + [
+        thumbnail_variant_path(thumbnail_path, size, fmt)
+        for size in Config.THUMBNAIL_SIZES
+        for fmt in THUMBNAIL_FORMATS
+    ]
+    return [p for p in paths if os.path.exists(p)]
+
+# ---------------------------------- REFERENCES ------------------------------------
+
+# A stored file is shared by every data row that points at it and by any
+# staging row still on its way to one; it goes with the last reference.
+
+def referenced(session, paths):
+    """The subset of `paths` still referenced by a data row or an unfinished staging row."""
+    if not paths:
+        return set()
+    rows = session.execute(
+        text("""
+            SELECT file_path FROM data WHERE file_path = ANY(:paths)
+            UNION SELECT thumbnail_path FROM data WHERE thumbnail_path = ANY(:paths)
+            UNION SELECT compressed_path FROM staging
+                WHERE data_id IS NULL AND status <> 'failed' AND compressed_path = ANY(:paths)
+            UNION SELECT thumbnail_path FROM staging
+                WHERE data_id IS NULL AND status <> 'failed' AND thumbnail_path = ANY(:paths)
+        """),
+        {"paths": list(paths)}
+    ).scalars().all()
+    return set(rows)
+
+def release(session, file_paths=(), thumbnail_paths=()):
+    """
+    Remove the files of deleted rows that nothing references any more.
+    Call after the delete has committed. Returns the number of files removed.
+    """
+    thumbnail_paths = {p for p in thumbnail_paths if p}
+    candidates = {p for p in file_paths if p} | thumbnail_paths
+    orphans = candidates - referenced(session, candidates)
+    removed = 0
+    for path in orphans:
+        # A thumbnail goes together with its size/format variants
+        targets = thumbnail_files(path) if path in thumbnail_paths else [path]
+        for target in targets:
+            try:
+                os.remove(target)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to remove {target}: {e}")
+    logger.info(f"Released {len(candidates)} paths, removed {removed} files")
+    return removed
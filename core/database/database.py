@@ -1,7 +1,8 @@
 # database.py
 
 import logging
-from sqlalchemy import event, DDL, create_engine
+from psycopg2.extras import execute_values
+from sqlalchemy import event, text, DDL, create_engine
 from sqlalchemy.orm import sessionmaker
 from core.utils.config import Config
 from core.database.models import Base, DataEntry
@@ -43,28 +44,174 @@ event.listen(
     analyze.execute_if(dialect="postgresql")
 )
 
-fts_index = DDL("""
-CREATE INDEX IF NOT EXISTS data_tags_fts_idx
+trgm_index = DDL("""
+CREATE INDEX IF NOT EXISTS data_tags_trgm_idx
 ON data
-USING gin (to_tsvector('english', tags));
+USING gin (lower(tags) gin_trgm_ops);
 """)
 event.listen(
     DataEntry.__table__,
     "after_create",
-    fts_index.execute_if(dialect="postgresql")
+    trgm_index.execute_if(dialect="postgresql")
 )
 
-trgm_index = DDL("""
-CREATE INDEX IF NOT EXISTS data_tags_trgm_idx
-ON data
-USING gin (lower(tags) gin_trgm_ops);
+user_ts_index = DDL("""
+CREATE INDEX IF NOT EXISTS data_user_id_timestamp_idx
+ON data (user_id, timestamp);
 """)
 event.listen(
     DataEntry.__table__,
     "after_create",
-    trgm_index.execute_if(dialect="postgresql")
+    user_ts_index.execute_if(dialect="postgresql")
 )
 
+# ---------------------------------- UPGRADES ------------------------------------
+
+# Builds the weighted search document from the extracted tags JSON so that
+# keywords/themes rank above account names, and both above the OCR text.
+# Tags that are not a JSON object (older entries) are indexed as plain text.
+tags_tsv_function = """
+CREATE OR REPLACE FUNCTION data_tags_tsv(raw text) RETURNS tsvector AS $$
+DECLARE
+    doc jsonb;
+BEGIN
+    IF raw IS NULL OR raw = '' THEN
+        RETURN NULL;
+    END IF;
+    BEGIN
+        doc := raw::jsonb;
+    EXCEPTION WHEN others THEN
+        RETURN setweight(to_tsvector('english', raw), 'D');
+    END;
+    IF jsonb_typeof(doc) <> 'object' THEN
+        RETURN setweight(to_tsvector('english', raw), 'D');
+    END IF;
+    RETURN
+        setweight(to_tsvector('english', concat_ws(' ', doc->>'keywords', doc->>'themes')), 'A') ||
+        setweight(to_tsvector('english', concat_ws(' ', doc->>'app_name', doc->>'account_identifiers', doc->>'moods')), 'B') ||
+        setweight(to_tsvector('english', concat_ws(' ', doc->>'links', doc->>'engagement_counts', doc->>'accent_colors')), 'C') ||
+        setweight(to_tsvector('english', coalesce(doc->>'full_ocr', '')), 'D');
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+"""
+
+# Keeps tags_tsv in sync for writers that only set tags (refresh scripts, manual fixes)
+tags_tsv_trigger = """
+CREATE OR REPLACE FUNCTION data_tags_tsv_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' AND NEW.tags_tsv IS NOT NULL THEN
+        RETURN NEW;
+    END IF;
+    IF TG_OP = 'UPDATE' AND NEW.tags IS NOT DISTINCT FROM OLD.tags THEN
+        RETURN NEW;
+    END IF;
+    NEW.tags_tsv := data_tags_tsv(NEW.tags);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS data_tags_tsv_update ON data;
+CREATE TRIGGER data_tags_tsv_update
+BEFORE INSERT OR UPDATE OF tags ON data
+FOR EACH ROW EXECUTE FUNCTION data_tags_tsv_trigger();
+"""
+
+# Applied on every start after create_all, which never alters existing tables.
+# Every statement must be idempotent.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE data ADD COLUMN IF NOT EXISTS tags_tsv tsvector;",
+    tags_tsv_function,
+    tags_tsv_trigger,
+    "CREATE INDEX IF NOT EXISTS data_tags_tsv_idx ON data USING gin (tags_tsv);",
+    # /get_similar pages through one entry's list in distance order
+    "CREATE INDEX IF NOT EXISTS data_neighbors_data_id_distance_idx ON data_neighbors (data_id, distance, neighbor_id);",
+    # Lets deletes of data rows find the lists they appear in
+    "CREATE INDEX IF NOT EXISTS data_neighbors_neighbor_id_idx ON data_neighbors (neighbor_id);",
+    # Ingest queue bookkeeping on staging
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS locked_until integer;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS locked_by varchar;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS last_error varchar;",
+    # Persisted ingest stage outputs
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS compressed_path varchar;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS thumbnail_path varchar;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS extracted_content varchar;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS tags_vector vector(768);",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS data_id integer;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS stage_timings jsonb;",
+    # Placeholders returned inline with results
+    "ALTER TABLE data ADD COLUMN IF NOT EXISTS placeholder varchar;",
+    "ALTER TABLE data ADD COLUMN IF NOT EXISTS dominant_color varchar;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS placeholder varchar;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS dominant_color varchar;",
+    # Content-addressed storage: dedup by upload hash, reference checks before removing files
+    "ALTER TABLE data ADD COLUMN IF NOT EXISTS source_hash varchar;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS source_hash varchar;",
+    "CREATE INDEX IF NOT EXISTS data_source_hash_idx ON data (source_hash);",
+    "CREATE INDEX IF NOT EXISTS data_file_path_idx ON data (file_path);",
+    "CREATE INDEX IF NOT EXISTS data_thumbnail_path_idx ON data (thumbnail_path);",
+    # Perceptual hashes for near-duplicate reuse; one index per 16-bit chunk (multi-index hashing)
+    "ALTER TABLE data ADD COLUMN IF NOT EXISTS dhash bigint;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS dhash bigint;",
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS duplicate_of integer;",
+    "CREATE INDEX IF NOT EXISTS data_dhash_chunk0_idx ON data (user_id, ((dhash >> 48) & 65535));",
+    "CREATE INDEX IF NOT EXISTS data_dhash_chunk1_idx ON data (user_id, ((dhash >> 32) & 65535));",
+    "CREATE INDEX IF NOT EXISTS data_dhash_chunk2_idx ON data (user_id, ((dhash >> 16) & 65535));",
+    "CREATE INDEX IF NOT EXISTS data_dhash_chunk3_idx ON data (user_id, ((dhash >> 0) & 65535));",
+    # Extraction payload and token accounting
+    "ALTER TABLE staging ADD COLUMN IF NOT EXISTS llm_usage jsonb;",
+    # Workers only ever scan the unfinished rows
+    "CREATE INDEX IF NOT EXISTS staging_claimable_idx ON staging (id) WHERE status IN ('pending', 'processing');",
+]
+
+TSV_BACKFILL_BATCH = 5000
+
+def backfill_tags_tsv():
+    """
+    Fill tags_tsv for rows written before the column existed, one short
+    transaction per batch, and only then drop data_tags_fts_idx, which it
+    replaces. Full-text search matches on tags_tsv alone, so until this has
+    run older rows can't be found. One process does the work; the others
+    skip it rather than wait.
+    """
+    pending = "tags_tsv IS NULL AND tags IS NOT NULL AND tags <> ''"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(724160);")).scalar():
+            return
+        try:
+            if conn.execute(text(f"SELECT 1 FROM data WHERE {pending} LIMIT 1;")).scalar():
+                last_id, total = 0, 0
+                while True:
+                    ids = conn.execute(
+                        text(f"""
+                            UPDATE data SET tags_tsv = data_tags_tsv(tags)
+                            WHERE id IN (
+                                SELECT id FROM data
+                                WHERE id > :last_id AND {pending}
+                                ORDER BY id
+                                LIMIT :batch_size
+                            )
+                            RETURNING id
+                        """),
+                        {"last_id": last_id, "batch_size": TSV_BACKFILL_BATCH}
+                    ).scalars().all()
+                    if not ids:
+                        break
+                    last_id, total = max(ids), total + len(ids)
+                logger.info(f"Backfilled tags_tsv for {total} rows.")
+            conn.execute(text("DROP INDEX IF EXISTS data_tags_fts_idx;"))
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(724160);"))
+
+def upgrade_schema():
+    with engine.begin() as conn:
+        # Serialize concurrent gunicorn workers running the same upgrades
+        conn.execute(text("SELECT pg_advisory_xact_lock(724159);"))
+        for stmt in SCHEMA_UPGRADES:
+            conn.execute(text(stmt))
+    logger.info(f"Applied {len(SCHEMA_UPGRADES)} schema upgrades.")
+    backfill_tags_tsv()
+
 def init_db():
     global engine, Session
     if engine is None:
@@ -73,10 +220,35 @@ def init_db():
         engine = create_engine(Config.ENGINE_URL)
         Session = sessionmaker(bind=engine)
         Base.metadata.create_all(bind=engine)
+        upgrade_schema()
         
         logger.info("Database initialized.")
 
 def get_db_session():
     if Session is None:
         init_db()
-    return Session()
\ No newline at end of file
+    return Session()
+
+def batch_update(session, table, columns, rows, casts=None):
+    """
+    Write `rows` of (id, *values) into `columns` of `table` with a single
+    UPDATE ... FROM (VALUES ...) in the session's transaction. `casts` maps a
+    column to the type its value is cast to, e.g. {"tags_vector": "vector"}.
+    """
+    if not rows:
+        return
+    casts = casts or {}
+    assignments = ", ".join(
+        f"{c} = v.{c}::{casts[c]}" if c in casts else f"{c} = v.{c}" for c in columns
+    )
+    cur = session.connection().connection.cursor()
+    execute_values(
+        cur,
+        f"""
+            UPDATE {table} SET {assignments}
+            FROM (VALUES %s) AS v(id, {", ".join(columns)})
+            WHERE {table}.id = v.id
+        """,
+        rows,
+        page_size=len(rows)
+    )
@@ -2,15 +2,18 @@
 
 from pgvector.sqlalchemy import Vector
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from werkzeug.security import (
     generate_password_hash, 
     check_password_hash
 )
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     Date, 
+    Float,
     Integer, 
     String,
     ForeignKey,
@@ -50,6 +53,28 @@ class StagingEntry(Base):
     source_type = Column(String)
     status = Column(String, default=ProcessingStatus.PENDING, nullable=False)
 
+    # Queue bookkeeping for services/worker.py
+    attempts = Column(Integer, default=0, nullable=False)
+    locked_until = Column(Integer)
+    locked_by = Column(String)
+    last_error = Column(String)
+
+    # Stage outputs, so a retry resumes where the last attempt stopped
+    source_hash = Column(String)
+    compressed_path = Column(String)
+    thumbnail_path = Column(String)
+    placeholder = Column(String)
+    dominant_color = Column(String)
+    dhash = Column(BigInteger)
+    # Data entry whose tags, embedding and colors this one reuses
+    duplicate_of = Column(Integer)
+    extracted_content = Column(String)
+    # Payload size and provider tokens/latency of the extraction call
+    llm_usage = Column(JSONB)
+    tags_vector = Column(Vector(768))
+    data_id = Column(Integer)
+    stage_timings = Column(JSONB)
+
 class DataEntry(Base):
     __tablename__ = 'data'
 
@@ -57,8 +82,16 @@ class DataEntry(Base):
     user_id = Column(Integer)
     file_path = Column(String)
     thumbnail_path = Column(String)
+    # Inline preview for result grids: tiny WebP data URI and "#rrggbb"
+    placeholder = Column(String)
+    dominant_color = Column(String)
+    # SHA-256 of the upload as received, for reusing the work on identical uploads
+    source_hash = Column(String)
+    # 64-bit perceptual hash (signed), looked up by core/processing/duplicates.py
+    dhash = Column(BigInteger)
     tags = Column(String)
     tags_vector = Column(Vector(768))
+    tags_tsv = Column(TSVECTOR)
     timestamp = Column(Integer)
 
 class DataColor(Base):
@@ -69,6 +102,24 @@ class DataColor(Base):
     color_hex = Column(String)
     color_vector = Column(Vector(3))
 
+class DataNeighbor(Base):
+    __tablename__ = 'data_neighbors'
+
+    data_id = Column(Integer, ForeignKey('data.id', ondelete='CASCADE'), primary_key=True)
+    neighbor_id = Column(Integer, ForeignKey('data.id', ondelete='CASCADE'), primary_key=True)
+    distance = Column(Float, nullable=False)
+
+# ---------------------------------- MAINTENANCE ------------------------------------
+
+class MaintenanceCheckpoint(Base):
+    __tablename__ = 'maintenance_checkpoints'
+
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    updated_at = Column(Integer)
+
 # ---------------------------------- TRACKING ------------------------------------
 
 class PostInteraction(Base):
@@ -0,0 +1,247 @@
+# vectors.py
+
+import os, fcntl, logging
+from contextlib import contextmanager
+import numpy as np
+from core.utils.config import Config
+from core.database.models import DataEntry
+from core.utils.timing import timed_route
+
+logger = logging.getLogger(__name__)
+
+DIMS = 768
+VEC_ROW_BYTES = DIMS * 4
+ID_ROW_BYTES = 8
+
+# Per-user layout inside Config.VECTOR_STORE_DIR:
+#   <uid>.gen            current generation number (replaced atomically on compaction)
+#   <uid>.<gen>.vec      float32 rows, L2-normalized, appended at ingest
+#   <uid>.<gen>.ids      int64 data ids, same order as the vectors
+#   <uid>.lock           flock held by writers
+# Readers mmap the current generation, so gunicorn workers share the page cache.
+
+# Per-process view of each user's store: uid -> (gen, rows, ids, vecs)
+_views = {}
+
+# ---------------------------------- HELPERS ------------------------------------
+
+def is_enabled():
+    return bool(Config.VECTOR_STORE_DIR)
+
+def _path(user_id, suffix):
+    return os.path.join(Config.VECTOR_STORE_DIR, f"{user_id}.{suffix}")
+
+def _read_gen(user_id):
+    try:
+        with open(_path(user_id, "gen")) as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _write_gen(user_id, gen):
+    tmp = _path(user_id, "gen.tmp")
+    with open(tmp, "w") as f:
+        f.write(str(gen))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _path(user_id, "gen"))
+
+@contextmanager
+def _locked(user_id):
+    os.makedirs(Config.VECTOR_STORE_DIR, exist_ok=True)
+    with open(_path(user_id, "lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, DIMS)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _write_generation(user_id, gen, ids, vectors):
+    with open(_path(user_id, f"{gen}.vec"), "wb") as f:
+        f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    with open(_path(user_id, f"{gen}.ids"), "wb") as f:
+        f.write(np.asarray(ids, dtype=np.int64).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+def _remove_generation(user_id, gen):
+    for suffix in ("vec", "ids"):
+        try:
+            os.remove(_path(user_id, f"{gen}.{suffix}"))
+        except FileNotFoundError:
+            pass
+
+def _load(user_id):
+    """
+    Returns this process's (ids, vecs) mmap view of the user's store, or None.
+    A compaction or rebuild may swap and unlink the generation between reading
+    its number and opening its files; that retries once on the new generation
+    and otherwise returns None so the caller falls back to pgvector.
+    """
+    for _ in range(2):
+        gen = _read_gen(user_id)
+        if gen is None:
+            _views.pop(user_id, None)
+            return None
+        try:
+            return _map_generation(user_id, gen)
+        except OSError as e:
+            if _read_gen(user_id) == gen:
+                logger.warning(f"Vector store for user {user_id} unreadable (gen {gen}): {e}")
+                return None
+    return None
+
+def _map_generation(user_id, gen):
+    vec_size = os.path.getsize(_path(user_id, f"{gen}.vec"))
+    ids_size = os.path.getsize(_path(user_id, f"{gen}.ids"))
+
+    # An append may be half written; only trust rows present in both files
+    rows = min(vec_size // VEC_ROW_BYTES, ids_size // ID_ROW_BYTES)
+
+    cached = _views.get(user_id)
+    if cached and cached[0] == gen and cached[1] == rows:
+        return cached[2], cached[3]
+
+    if rows == 0:
+        ids = np.empty(0, dtype=np.int64)
+        vecs = np.empty((0, DIMS), dtype=np.float32)
+    else:
+        ids = np.memmap(_path(user_id, f"{gen}.ids"), dtype=np.int64, mode="r", shape=(rows,))
+        vecs = np.memmap(_path(user_id, f"{gen}.vec"), dtype=np.float32, mode="r", shape=(rows, DIMS))
+    _views[user_id] = (gen, rows, ids, vecs)
+    return ids, vecs
+
+# ---------------------------------- WRITING ------------------------------------
+
+def rebuild_user(session, user_id):
+    """Rewrite a user's store from the data table as a new generation."""
+    # Read under the lock so an append can't land between the read and the swap
+    with _locked(user_id):
+        rows = session.query(DataEntry.id, DataEntry.tags_vector) \
+            .filter(DataEntry.user_id == user_id, DataEntry.tags_vector.isnot(None)) \
+            .order_by(DataEntry.id) \
+            .all()
+        ids = [r[0] for r in rows]
+        vectors = _normalize([r[1] for r in rows]) if rows else np.empty((0, DIMS), dtype=np.float32)
+
+        old_gen = _read_gen(user_id)
+        gen = (old_gen or 0) + 1
+        _write_generation(user_id, gen, ids, vectors)
+        _write_gen(user_id, gen)
+        if old_gen is not None:
+            _remove_generation(user_id, old_gen)
+
+    logger.info(f"Rebuilt vector store for user {user_id} with {len(ids)} rows (gen {gen})")
+    return len(ids)
+
+def add_entry(session, user_id, data_id, vector):
+    """Append a new entry's vector, building the user's store first if it doesn't exist yet."""
+    if not is_enabled() or vector is None or len(vector) != DIMS:
+        return
+    try:
+        with _locked(user_id):
+            gen = _read_gen(user_id)
+            if gen is not None:
+                # Drop any half-written row left by a crashed writer so the files stay aligned
+                vec_path, ids_path = _path(user_id, f"{gen}.vec"), _path(user_id, f"{gen}.ids")
+                rows = min(os.path.getsize(vec_path) // VEC_ROW_BYTES, os.path.getsize(ids_path) // ID_ROW_BYTES)
+                os.truncate(vec_path, rows * VEC_ROW_BYTES)
+                os.truncate(ids_path, rows * ID_ROW_BYTES)
+
+                # Vectors first: readers only count rows present in both files
+                with open(vec_path, "ab") as f:
+                    f.write(_normalize(vector).tobytes())
+                with open(ids_path, "ab") as f:
+                    f.write(np.asarray([data_id], dtype=np.int64).tobytes())
+                return
+        # The new row is already committed, so the rebuild picks it up
+        rebuild_user(session, user_id)
+    except Exception as e:
+        logger.error(f"Failed to add entry {data_id} to vector store for user {user_id}: {e}")
+
+def remove_entries(user_id, data_ids):
+    """Compact the user's store without the given entries."""
+    if not is_enabled():
+        return
+    try:
+        drop = np.asarray(list(data_ids), dtype=np.int64)
+        with _locked(user_id):
+            old_gen = _read_gen(user_id)
+            if old_gen is None:
+                return
+            loaded = _load(user_id)
+            if loaded is None:
+                return
+            ids, vecs = loaded
+            keep = ~np.isin(ids, drop)
+            if keep.all():
+                return
+
+            gen = old_gen + 1
+            _write_generation(user_id, gen, ids[keep], vecs[keep])
+            _write_gen(user_id, gen)
+            _remove_generation(user_id, old_gen)
+        logger.info(f"Compacted vector store for user {user_id}: removed {int((~keep).sum())} rows")
+    except Exception as e:
+        logger.error(f"Failed to remove entries from vector store for user {user_id}: {e}")
+
+def drop_user(user_id):
+    if not is_enabled():
+        return
+    with _locked(user_id):
+        gen = _read_gen(user_id)
+        if gen is not None:
+            _remove_generation(user_id, gen)
+            os.remove(_path(user_id, "gen"))
+    _views.pop(user_id, None)
+
+# ---------------------------------- SEARCHING ------------------------------------
+
+def get_vector(user_id, data_id):
+    """Returns the stored (normalized) vector for an entry, or None."""
+    if not is_enabled():
+        return None
+    loaded = _load(user_id)
+    if loaded is None:
+        return None
+    ids, vecs = loaded
+    idx = np.flatnonzero(ids == data_id)
+    return np.array(vecs[idx[-1]]) if len(idx) else None
+
+@timed_route("vector_store_search")
+def search(user_id, query_vec, k, exclude_ids=()):
+    """
+    Exact cosine top-k over the user's store with one matmul. Returns a list of
+    (data_id, cosine_distance) sorted by distance, or None if the caller should
+    fall back to pgvector (store disabled, not built, or user too large).
+    """
+    if not is_enabled():
+        return None
+    if query_vec is None or len(query_vec) != DIMS:
+        return []
+    loaded = _load(user_id)
+    if loaded is None:
+        return None
+    ids, vecs = loaded
+    if len(ids) > Config.VECTOR_STORE_MAX_ROWS:
+        logger.info(f"User {user_id} has {len(ids)} vectors; falling back to pgvector")
+        return None
+    if len(ids) == 0:
+        return []
+
+    scores = vecs @ _normalize(query_vec)[0]
+    if exclude_ids:
+        scores[np.isin(ids, np.asarray(list(exclude_ids), dtype=np.int64))] = -np.inf
+
+    k = min(k, len(ids))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(ids[i]), float(1.0 - scores[i])) for i in top if np.isfinite(scores[i])]
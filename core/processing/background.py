@@ -1,113 +1,276 @@
 # core/processing/background.py
 
-import time, os, shutil, logging, base64, traceback
+import time, os, json, math, socket, logging, traceback
+from sqlalchemy import func
+from core.utils import metrics
 from core.utils.config import Config
+from core.utils.cache import bump_user_version
 from concurrent.futures import ThreadPoolExecutor
+from core.database import vectors
+from core.processing import duplicates, jobs, neighbors, pipeline
 from core.database.database import get_db_session
-from core.database.models import DataColor, StagingEntry, DataEntry, ProcessingStatus
-from core.content.images import call_col_vec, compress_image, encode_image_to_base64, generate_thumbnail
+from core.database.models import DataColor, StagingEntry, DataEntry
+from core.content.images import call_col_vec, llm_payload_for_path, process_upload, tile_difference
+from core.content.storage import hash_file
 from core.ai.ai import call_llm_api, call_vec_api
+from core.ai.batcher import extraction_batcher
 
 logger = logging.getLogger(__name__)
-executor = ThreadPoolExecutor(max_workers=4)
+# Entries in flight; their image and provider work is sized separately in pipeline.py
+executor = ThreadPoolExecutor(max_workers=Config.INGEST_MAX_IN_FLIGHT)
 
 def process_entry_async(staging_entry_id):
+    # In queue mode the web tier only inserts the staging row; services/worker.py claims it
+    if Config.INGEST_MODE == "queue":
+        return
     executor.submit(_process_entry, staging_entry_id)
 
+def refresh_neighbors_async(user_id, data_ids):
+    if data_ids:
+        executor.submit(_refresh_neighbors, user_id, data_ids)
+
+def _refresh_neighbors(user_id, data_ids):
+    session = get_db_session()
+    try:
+        neighbors.refresh_entries(session, user_id, data_ids)
+    except Exception as e:
+        logger.error(f"Failed to refresh neighbours for user {user_id}: {e}")
+        traceback.print_exc()
+    finally:
+        session.close()
+
 def _process_entry(entry_id):
     session = get_db_session()
+    try:
+        worker_id = f"web:{socket.gethostname()}:{os.getpid()}"
+        # One attempt: nothing retries on the web tier
+        if not jobs.claim_entry(session, entry_id, worker_id, max_attempts=1):
+            logger.info(f"Staging entry {entry_id} is not claimable; skipping.")
+            return
+    finally:
+        session.close()
+    run_claimed(entry_id, max_attempts=1)
+
+def run_claimed(entry_id, max_attempts=None):
+    """
+    Process a staging row this worker has claimed. On success the row is
+    COMPLETED; on failure it is re-queued while it has attempts left, and the
+    uploaded source file is only removed once the row is finished either way.
+    """
+    session = get_db_session()
+    source_type = None
+    finished = True
     try:
         staging_entry = session.query(StagingEntry).get(entry_id)
         if not staging_entry:
             return
-        
         source_type = staging_entry.source_type
-        original_path = staging_entry.file_path
-        user_id = staging_entry.user_id
+        source_path = staging_entry.file_path
 
-        staging_entry.status = ProcessingStatus.PROCESSING
-        session.commit()
+        try:
+            _process_entry_stages(session, staging_entry)
+            jobs.complete(session, staging_entry)
+            logger.info(f"[{source_type}] Entry {entry_id} processed.")
+        except Exception as e:
+            logger.error(f"[{source_type}] Entry {entry_id} processing error\n{e}")
+            traceback.print_exc()
+
+            session.rollback()
+            staging_entry = session.query(StagingEntry).get(entry_id)
+            if staging_entry:
+                finished = not jobs.fail(session, staging_entry, e, max_attempts)
+                if not finished:
+                    logger.info(f"Entry {entry_id} will be retried (attempt {staging_entry.attempts} failed)")
+
+        if finished and source_path and os.path.exists(source_path):
+            os.remove(source_path)
+    finally:
+        session.close()
 
-        file_name = os.path.basename(original_path)
-        final_filepath = os.path.join(Config.UPLOAD_DIR, file_name)
-        logger.info(f"original_path: {original_path}\nfile_name: {file_name}\nfinal_filepath: {final_filepath}\n")
-
-        # General case: copy file to upload directory
-        if os.path.abspath(original_path) != os.path.abspath(final_filepath):
-            shutil.copy(original_path, final_filepath)
-            logger.info(f"Copied file to upload dir: {final_filepath}")
-        else:
-            logger.info("Source and destination paths are the same; skipping copy.")
-
-        if source_type in ['image', 'imageurl']:
-            # Compress the image
-            with open(final_filepath, "rb") as f:
-                if not (new_filepath := compress_image(f)):
-                    raise Exception("Compression failed")
-            
-            # Generate thumbnail for the image
-            thumbnail_path = generate_thumbnail(new_filepath)
-
-            # Encode the image
-            image_base64 = encode_image_to_base64(new_filepath)
-
-            # Extract information for the posts
-            extracted_content = call_llm_api(
-                image_b64=image_base64
-            )
-
-            # Vectorize the info
-            tags_vector = call_vec_api(
-                query_text=extracted_content, 
-                task_type="RETRIEVAL_DOCUMENT"
-            )
-
-            # Vectorize the info
-            color_vectors = call_col_vec(extracted_content)
-            
-            final_filepath = new_filepath
-
-        else:
-            raise Exception(f"Unsupported source_type: {source_type}")
-
-        # Save main entry
-        data_entry = DataEntry(
-            user_id=user_id,
-            file_path=final_filepath,
-            thumbnail_path=thumbnail_path,
-            tags=extracted_content,
-            tags_vector=tags_vector,
-            timestamp=int(time.time())
+# ---------------------------------- STAGES ------------------------------------
+
+# Each stage writes its output to the staging row and commits, and a stage
+# counts as done once its duration is in stage_timings. A retry skips
+# straight to the first stage that hasn't finished.
+
+def _stage_dedup(session, entry, scratch):
+    # A byte-identical re-upload by the same user reuses the stored files, extraction and embedding;
+    # only the data row is new. Across users only the bytes on disk are shared, through store_bytes.
+    entry.source_hash = hash_file(entry.file_path)
+    original = (
+        session.query(DataEntry)
+        .filter(
+            DataEntry.user_id == entry.user_id,
+            DataEntry.source_hash == entry.source_hash,
+            DataEntry.tags_vector.isnot(None),
         )
-        session.add(data_entry)
-        session.commit()
+        .order_by(DataEntry.id.desc())
+        .first()
+    )
+    if not original or not all(p and os.path.exists(p) for p in (original.file_path, original.thumbnail_path)):
+        return
 
-        # Save per-color entries
-        for col in color_vectors:
-            dc = DataColor(
-                data_id=data_entry.id,
-                color_hex=col["hex"],
-                color_vector=col["lab"]
-            )
-            session.add(dc)
+    entry.compressed_path = original.file_path
+    entry.thumbnail_path = original.thumbnail_path
+    entry.placeholder = original.placeholder
+    entry.dominant_color = original.dominant_color
+    entry.dhash = original.dhash
+    entry.duplicate_of = original.id
+    entry.extracted_content = original.tags
+    entry.tags_vector = original.tags_vector
+    entry.stage_timings = dict(entry.stage_timings or {}, image=0, match=0, extract=0, embed=0)
+    metrics.inc("ingest.dedup")
+    metrics.inc("ingest.llm_calls_saved")
+    logger.info(f"Entry {entry.id}: identical to data entry {original.id}, reusing its work")
 
-        staging_entry.status = ProcessingStatus.COMPLETED
-        session.commit()
-        
-        l = f"[{source_type}] Entry {entry_id} processed."
-        logger.info(l)
-    
+def _stage_image(session, entry, scratch):
+    if entry.source_type not in ['image', 'imageurl']:
+        raise Exception(f"Unsupported source_type: {entry.source_type}")
+
+    # One decode of the staged upload yields the compressed file, the thumbnail, the placeholder and the LLM payload
+    try:
+        result = pipeline.run_cpu(process_upload, entry.file_path)
     except Exception as e:
-        e = f"[{source_type}] Entry {entry_id} processing error\n{e}"
-        logger.error(e)
-        traceback.print_exc()
-        
-        staging_entry = session.query(StagingEntry).get(entry_id)
-        if staging_entry:
-            staging_entry.status = ProcessingStatus.FAILED
-            session.commit()
-    
-    finally:
-        if staging_entry.file_path and os.path.exists(staging_entry.file_path):
-            os.remove(staging_entry.file_path)
-        session.close()
+        raise Exception(f"Image processing failed: {e}")
+    entry.compressed_path = result["compressed_path"]
+    entry.thumbnail_path = result["thumbnail_path"]
+    entry.placeholder = result["placeholder"]
+    entry.dominant_color = result["dominant_color"]
+    entry.dhash = duplicates.to_signed(result["dhash"])
+    scratch["image_base64"] = result["llm_payload"]
+    scratch["llm_payload_info"] = result["llm_payload_info"]
+
+def _stage_match(session, entry, scratch):
+    # A near-identical earlier upload of the user's (re-screenshot, recompression) lends its extraction and embedding
+    if entry.duplicate_of:
+        return
+    match = duplicates.find_near_duplicate(session, entry.user_id, entry.dhash)
+    if not match:
+        return
+    original = session.query(DataEntry).get(match[0])
+    # Same layout isn't same content: confirm on the files before borrowing another entry's text
+    try:
+        diff = pipeline.run_cpu(tile_difference, entry.compressed_path, original.file_path)
+    except Exception as e:
+        logger.warning(f"Entry {entry.id}: couldn't compare with data entry {original.id}: {e}")
+        diff = math.inf
+    if diff > Config.NEAR_DUPLICATE_MAX_TILE_DIFF:
+        metrics.inc("ingest.near_duplicate_rejected")
+        logger.info(f"Entry {entry.id}: {match[1]} bits from data entry {original.id} but differs (tile diff {diff:.1f}); extracting")
+        return
+    entry.duplicate_of = original.id
+    entry.extracted_content = original.tags
+    entry.tags_vector = original.tags_vector
+    entry.stage_timings = dict(entry.stage_timings or {}, extract=0, embed=0)
+    metrics.inc("ingest.near_duplicate")
+    metrics.inc("ingest.llm_calls_saved")
+    logger.info(f"Entry {entry.id}: {match[1]} bits from data entry {original.id}, reusing its extraction")
+
+def _stage_extract(session, entry, scratch):
+    # A resumed attempt skipped the image stage, so build the payload from the stored file
+    if "image_base64" not in scratch:
+        scratch["image_base64"], scratch["llm_payload_info"] = pipeline.run_cpu(llm_payload_for_path, entry.compressed_path)
+    usage = dict(scratch["llm_payload_info"] or {})
+    extracted_content = None
+    # While the queue is deep, share a multi-image call with other entries in flight
+    if extraction_batcher.active:
+        extracted_content = extraction_batcher.extract(entry.id, scratch["image_base64"], usage, timeout=Config.EXTRACT_BATCH_TIMEOUT)
+    if extracted_content is None:
+        extracted_content = pipeline.run_io(call_llm_api, image_b64=scratch["image_base64"], usage=usage)
+    entry.llm_usage = usage
+    # Errors come back as "" rather than raising; don't embed and store nothing
+    if not extracted_content or not extracted_content.strip():
+        raise Exception("Empty extraction")
+    try:
+        json.loads(extracted_content)
+    except ValueError:
+        raise Exception("Extraction is not valid JSON")
+    entry.extracted_content = extracted_content
+
+def _stage_embed(session, entry, scratch):
+    tags_vector = pipeline.run_io(
+        call_vec_api,
+        query_text=entry.extracted_content, 
+        task_type="RETRIEVAL_DOCUMENT"
+    )
+    if not tags_vector:
+        raise Exception("Embedding failed")
+    entry.tags_vector = tags_vector
+
+def _stage_store(session, entry, scratch):
+    # The data row, its colors and data_id commit together, so this never runs twice
+    data_entry = DataEntry(
+        user_id=entry.user_id,
+        file_path=entry.compressed_path,
+        thumbnail_path=entry.thumbnail_path,
+        placeholder=entry.placeholder,
+        dominant_color=entry.dominant_color,
+        source_hash=entry.source_hash,
+        dhash=entry.dhash,
+        tags=entry.extracted_content,
+        tags_vector=entry.tags_vector,
+        tags_tsv=func.data_tags_tsv(entry.extracted_content),
+        timestamp=int(time.time())
+    )
+    session.add(data_entry)
+    session.flush()
+
+    # A reused extraction has the same colors; copy them rather than parse the tags again
+    reused = session.query(DataColor).filter_by(data_id=entry.duplicate_of).all() if entry.duplicate_of else []
+    colors = [(c.color_hex, c.color_vector) for c in reused] or [(col["hex"], col["lab"]) for col in call_col_vec(entry.extracted_content)]
+    for color_hex, color_vector in colors:
+        dc = DataColor(
+            data_id=data_entry.id,
+            color_hex=color_hex,
+            color_vector=color_vector
+        )
+        session.add(dc)
+    entry.data_id = data_entry.id
+
+def _stage_index(session, entry, scratch):
+    # Keep the in-process vector store in step with the table
+    vectors.add_entry(session, entry.user_id, entry.data_id, entry.tags_vector)
+
+    # Precompute /get_similar for the new entry and slot it into existing lists
+    try:
+        neighbors.add_entry(session, entry.user_id, entry.data_id, entry.tags_vector)
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Failed to update neighbours for entry {entry.data_id}: {e}")
+
+    # The new entry (and its colors) is now searchable
+    bump_user_version(entry.user_id)
+
+STAGES = [
+    ("dedup", _stage_dedup, ()),
+    ("image", _stage_image, ("compressed_path", "thumbnail_path")),
+    ("match", _stage_match, ()),
+    ("extract", _stage_extract, ()),
+    ("embed", _stage_embed, ()),
+    ("store", _stage_store, ()),
+    ("index", _stage_index, ()),
+]
+
+def _stage_done(entry, name, output_files):
+    if name not in (entry.stage_timings or {}):
+        return False
+    # A file stage whose output has since gone missing runs again
+    return all(getattr(entry, attr) and os.path.exists(getattr(entry, attr)) for attr in output_files)
+
+def _process_entry_stages(session, staging_entry):
+    entry_id = staging_entry.id
+    # Values handed between stages within this attempt only
+    scratch = {}
+    for name, stage, output_files in STAGES:
+        if _stage_done(staging_entry, name, output_files):
+            logger.info(f"Entry {entry_id}: stage {name} already done")
+            continue
+
+        start = time.perf_counter()
+        stage(session, staging_entry, scratch)
+        elapsed = time.perf_counter() - start
+
+        metrics.observe(f"ingest.stage.{name}", elapsed)
+        staging_entry.stage_timings = dict(staging_entry.stage_timings or {}, **{name: round(elapsed, 3)})
+        session.commit()
+        logger.info(f"Entry {entry_id}: stage {name} took {elapsed:.2f}s")
@@ -0,0 +1,66 @@
+# core/processing/duplicates.py
+
+import logging
+from sqlalchemy import text
+from core.utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Near-duplicate lookup over a user's 64-bit dHashes by multi-index hashing.
+# The hash is split into CHUNKS 16-bit pieces, each with its own
+# (user_id, chunk) index. Two hashes at Hamming distance r < CHUNKS agree
+# exactly on at least one piece, so the rows sharing any piece with the new
+# hash are a complete candidate set, and only those are compared bit by bit.
+
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+def to_signed(value):
+    """Unsigned 64-bit hash -> the bigint stored in Postgres."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned(value):
+    return value & ((1 << 64) - 1)
+
+def hamming(a, b):
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count("1")
+
+def chunk_sql(i):
+    # Same expression as the data_dhash_chunk<i>_idx indexes
+    return f"((dhash >> {CHUNK_BITS * (CHUNKS - 1 - i)}) & {CHUNK_MASK})"
+
+def chunks(value):
+    value = to_unsigned(value)
+    return [(value >> (CHUNK_BITS * (CHUNKS - 1 - i))) & CHUNK_MASK for i in range(CHUNKS)]
+
+def max_distance():
+    # Past CHUNKS - 1 the chunk lookup could miss matches
+    return min(Config.NEAR_DUPLICATE_DISTANCE, CHUNKS - 1)
+
+def find_near_duplicate(session, user_id, value, exclude_id=None):
+    """
+    The user's closest entry within max_distance() bits of `value` that has
+    tags and an embedding to reuse, as (data id, distance), or None.
+    """
+    if value is None or Config.NEAR_DUPLICATE_DISTANCE < 0:
+        return None
+    params = {"user_id": user_id, "exclude_id": exclude_id or 0}
+    params.update({f"c{i}": c for i, c in enumerate(chunks(value))})
+    candidates = session.execute(
+        text(f"""
+            SELECT id, dhash FROM data
+            WHERE user_id = :user_id
+                AND id <> :exclude_id
+                AND tags_vector IS NOT NULL
+                AND ({" OR ".join(f"{chunk_sql(i)} = :c{i}" for i in range(CHUNKS))})
+        """),
+        params
+    ).fetchall()
+
+    limit = max_distance()
+    best = min(((hamming(h, value), data_id) for data_id, h in candidates), default=None)
+    logger.info(f"Near-duplicate lookup: {len(candidates)} candidates, best {best}")
+    if best is None or best[0] > limit:
+        return None
+    return best[1], best[0]
@@ -0,0 +1,140 @@
+# core/processing/jobs.py
+
+import time, logging
+from sqlalchemy import text
+from core.utils.config import Config
+from core.database.models import ProcessingStatus
+
+logger = logging.getLogger(__name__)
+
+# A staging row is claimable when it is pending, or processing under a lease
+# that has expired (its worker died or was killed). Pending rows with a future
+# locked_until are retries waiting out their backoff.
+CLAIMABLE = """
+    status IN (:pending, :processing)
+    AND (locked_until IS NULL OR locked_until < :now)
+    AND attempts < :max_attempts
+"""
+
+def _params(worker_id, max_attempts):
+    now = int(time.time())
+    return {
+        "pending": ProcessingStatus.PENDING,
+        "processing": ProcessingStatus.PROCESSING,
+        "failed": ProcessingStatus.FAILED,
+        "now": now,
+        "lease_until": now + Config.INGEST_VISIBILITY_TIMEOUT,
+        "worker_id": worker_id,
+        "max_attempts": max_attempts,
+    }
+
+# ---------------------------------- CLAIMING ------------------------------------
+
+def claim_next(session, worker_id, max_attempts=None):
+    """Claim the oldest claimable row for `worker_id`. Returns its id, or None."""
+    entry_id = session.execute(
+        text(f"""
+            UPDATE staging
+            SET status = :processing,
+                attempts = attempts + 1,
+                locked_until = :lease_until,
+                locked_by = :worker_id
+            WHERE id = (
+                SELECT id FROM staging
+                WHERE {CLAIMABLE}
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id
+        """),
+        _params(worker_id, max_attempts or Config.INGEST_MAX_ATTEMPTS)
+    ).scalar()
+    session.commit()
+    return entry_id
+
+def claim_entry(session, entry_id, worker_id, max_attempts=None):
+    """Claim one specific row (the in-process path). Returns False if someone else holds it."""
+    claimed = session.execute(
+        text(f"""
+            UPDATE staging
+            SET status = :processing,
+                attempts = attempts + 1,
+                locked_until = :lease_until,
+                locked_by = :worker_id
+            WHERE id = :entry_id AND {CLAIMABLE}
+            RETURNING id
+        """),
+        dict(_params(worker_id, max_attempts or Config.INGEST_MAX_ATTEMPTS), entry_id=entry_id)
+    ).scalar()
+    session.commit()
+    return claimed is not None
+
+def extend_leases(session, entry_ids, worker_id):
+    """Push out the lease on rows this worker is still processing."""
+    if not entry_ids:
+        return
+    session.execute(
+        text("""
+            UPDATE staging SET locked_until = :lease_until
+            WHERE id = ANY(:ids) AND locked_by = :worker_id AND status = :processing
+        """),
+        dict(_params(worker_id, 0), ids=list(entry_ids))
+    )
+    session.commit()
+
+def queue_depth(session, limit=1000, max_attempts=None):
+    """Rows waiting to be claimed, counted up to `limit`."""
+    return session.execute(
+        text(f"""
+            SELECT count(*) FROM (
+                SELECT 1 FROM staging WHERE {CLAIMABLE} LIMIT :limit
+            ) waiting
+        """),
+        dict(_params(None, max_attempts or Config.INGEST_MAX_ATTEMPTS), limit=limit)
+    ).scalar()
+
+# ---------------------------------- FINISHING ------------------------------------
+
+def complete(session, staging_entry):
+    staging_entry.status = ProcessingStatus.COMPLETED
+    staging_entry.locked_until = None
+    staging_entry.last_error = None
+    session.commit()
+
+def fail(session, staging_entry, error, max_attempts=None):
+    """
+    Record a failed attempt. Re-queues the row after a linear backoff while it
+    has attempts left and returns True; otherwise marks it FAILED.
+    """
+    max_attempts = max_attempts or Config.INGEST_MAX_ATTEMPTS
+    staging_entry.last_error = str(error)[:2000]
+    retrying = (staging_entry.attempts or 0) < max_attempts
+    if retrying:
+        staging_entry.status = ProcessingStatus.PENDING
+        staging_entry.locked_until = int(time.time()) + Config.INGEST_RETRY_BACKOFF * staging_entry.attempts
+    else:
+        staging_entry.status = ProcessingStatus.FAILED
+        staging_entry.locked_until = None
+    session.commit()
+    return retrying
+
+def fail_exhausted(session, max_attempts=None):
+    """Mark FAILED the rows whose last allowed attempt died with its worker."""
+    failed = session.execute(
+        text("""
+            UPDATE staging
+            SET status = :failed,
+                locked_until = NULL,
+                last_error = COALESCE(last_error, 'Lease expired on final attempt')
+            WHERE status = :processing
+                AND locked_until < :now
+                AND attempts >= :max_attempts
+            RETURNING id
+        """),
+        _params(None, max_attempts or Config.INGEST_MAX_ATTEMPTS)
+    ).scalars().all()
+    session.commit()
+    if failed:
+        logger.warning(f"Marked staging entries {failed} failed after their final lease expired")
+    return failed
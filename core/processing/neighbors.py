@@ -0,0 +1,185 @@
+# core/processing/neighbors.py
+
+import logging
+from sqlalchemy import text, insert
+from core.utils.config import Config
+from core.database import vectors
+from core.database.models import DataEntry, DataNeighbor
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock namespace for one user's neighbour lists
+LOCK_NAMESPACE = 724160
+
+# Entries whose lists a new entry may join are looked for among its nearest
+# REVERSE_FACTOR * k; neighbourhoods aren't symmetric, so k alone misses some
+REVERSE_FACTOR = 4
+
+def _lock_user(session, user_id):
+    """Serialize writers of one user's lists until the transaction ends; concurrent adds otherwise deadlock."""
+    session.execute(text("SELECT pg_advisory_xact_lock(:ns, :user_id)"), {"ns": LOCK_NAMESPACE, "user_id": user_id})
+
+# ---------------------------------- COMPUTING ------------------------------------
+
+def compute_neighbors(session, user_id, data_id, vector, k, offset=0):
+    """Live nearest neighbours of an entry as a list of (data_id, cosine_distance)."""
+    neighbors = vectors.search(user_id, vector, offset + k, exclude_ids=[data_id])
+    if neighbors is not None:
+        return neighbors[offset:]
+
+    rows = session.execute(
+        text("""
+            SELECT d.id, d.tags_vector <=> e.tags_vector AS distance
+            FROM data d, data e
+            WHERE e.id = :data_id
+                AND d.user_id = :userid
+                AND d.id != :data_id
+                AND d.tags_vector IS NOT NULL
+            ORDER BY distance, d.id
+            LIMIT :k OFFSET :offset
+        """),
+        {"userid": user_id, "data_id": data_id, "k": k, "offset": offset}
+    ).fetchall()
+    return [(r[0], r[1]) for r in rows if r[1] is not None]
+
+def store_neighbors(session, data_id, neighbors):
+    """Replace an entry's stored list. Caller commits."""
+    session.execute(text("DELETE FROM data_neighbors WHERE data_id = :data_id"), {"data_id": data_id})
+    if neighbors:
+        session.execute(
+            insert(DataNeighbor),
+            [{"data_id": data_id, "neighbor_id": n_id, "distance": dist} for n_id, dist in neighbors]
+        )
+
+# ---------------------------------- MAINTAINING ------------------------------------
+
+def add_entry(session, user_id, data_id, vector):
+    """
+    Build the new entry's list and insert it into the existing lists it now
+    belongs in: among the entries nearest to it, those whose list has room
+    left or whose worst neighbour is further away than the new entry. Those
+    lists are then trimmed back to SIMILAR_NEIGHBORS_K. The work is bounded by
+    k, not by the size of the library. Entries without a stored list are left
+    alone; they're computed on first lookup.
+    """
+    k = Config.SIMILAR_NEIGHBORS_K
+    _lock_user(session, user_id)
+    nearest = compute_neighbors(session, user_id, data_id, vector, k * REVERSE_FACTOR)
+    own = nearest[:k]
+    store_neighbors(session, data_id, own)
+
+    # A short list means the user has at most k other entries, so an empty
+    # stored list may just be one computed when there was nothing to compare to
+    if len(own) < k:
+        missing = session.execute(
+            text("""
+                SELECT id FROM data d
+                WHERE d.id = ANY(:ids)
+                    AND NOT EXISTS (SELECT 1 FROM data_neighbors n WHERE n.data_id = d.id)
+            """),
+            {"ids": [n[0] for n in own]}
+        ).scalars().all()
+        if missing:
+            refresh_entries(session, user_id, missing)
+            # That committed and released the lock
+            _lock_user(session, user_id)
+
+    # Each candidate's list size and worst distance come off data_neighbors_data_id_distance_idx
+    touched = session.execute(
+        text("""
+            INSERT INTO data_neighbors (data_id, neighbor_id, distance)
+            SELECT c.id, :data_id, c.distance
+            FROM unnest(CAST(:ids AS integer[]), CAST(:distances AS double precision[])) AS c(id, distance)
+            CROSS JOIN LATERAL (
+                SELECT COUNT(*) AS cnt, MAX(n.distance) AS worst
+                FROM data_neighbors n
+                WHERE n.data_id = c.id
+            ) l
+            WHERE l.cnt > 0
+                AND (l.cnt < :k OR c.distance < l.worst)
+            ON CONFLICT DO NOTHING
+            RETURNING data_id
+        """),
+        {
+            "data_id": data_id,
+            "ids": [n[0] for n in nearest],
+            "distances": [float(n[1]) for n in nearest],
+            "k": k,
+        }
+    ).scalars().all() if nearest else []
+
+    if touched:
+        session.execute(
+            text("""
+                DELETE FROM data_neighbors dn
+                USING (
+                    SELECT data_id, neighbor_id,
+                        row_number() OVER (PARTITION BY data_id ORDER BY distance, neighbor_id) AS rn
+                    FROM data_neighbors
+                    WHERE data_id = ANY(:ids)
+                ) r
+                WHERE dn.data_id = r.data_id
+                    AND dn.neighbor_id = r.neighbor_id
+                    AND r.rn > :k
+            """),
+            {"ids": touched, "k": k}
+        )
+    session.commit()
+    logger.info(f"Stored neighbours for entry {data_id}; updated {len(touched)} other lists")
+
+def lists_containing(session, data_id):
+    """Ids of the entries whose stored list includes `data_id`."""
+    return session.execute(
+        text("SELECT data_id FROM data_neighbors WHERE neighbor_id = :data_id"),
+        {"data_id": data_id}
+    ).scalars().all()
+
+def refresh_entries(session, user_id, data_ids):
+    """Recompute the stored lists of the given entries, e.g. after one of their neighbours was deleted."""
+    k = Config.SIMILAR_NEIGHBORS_K
+    _lock_user(session, user_id)
+    rows = session.query(DataEntry.id, DataEntry.tags_vector) \
+        .filter(DataEntry.id.in_(list(data_ids)), DataEntry.user_id == user_id) \
+        .all()
+    for data_id, vector in rows:
+        store_neighbors(session, data_id, compute_neighbors(session, user_id, data_id, vector, k))
+    session.commit()
+    logger.info(f"Refreshed neighbours for {len(rows)} entries of user {user_id}")
+
+# ---------------------------------- LOOKUP ------------------------------------
+
+def get_neighbors(session, user_id, data_id, vector, offset, limit):
+    """
+    One page of an entry's neighbours as (data_id, cosine_distance). Pages inside
+    the stored list are an index range scan; an entry without a list gets it
+    computed and stored here, and pages past SIMILAR_NEIGHBORS_K are computed live.
+    """
+    k = Config.SIMILAR_NEIGHBORS_K
+    if offset + limit > k:
+        return compute_neighbors(session, user_id, data_id, vector, limit, offset=offset)
+
+    rows = session.execute(
+        text("""
+            SELECT neighbor_id, distance
+            FROM data_neighbors
+            WHERE data_id = :data_id
+            ORDER BY distance, neighbor_id
+            LIMIT :limit OFFSET :offset
+        """),
+        {"data_id": data_id, "limit": limit, "offset": offset}
+    ).fetchall()
+    if rows:
+        return [(r[0], r[1]) for r in rows]
+
+    # An empty page either ran past a short list or the list was never computed
+    if offset > 0 and session.execute(
+        text("SELECT 1 FROM data_neighbors WHERE data_id = :data_id LIMIT 1"),
+        {"data_id": data_id}
+    ).first():
+        return []
+
+    _lock_user(session, user_id)
+    neighbors = compute_neighbors(session, user_id, data_id, vector, k)
+    store_neighbors(session, data_id, neighbors)
+    session.commit()
+    return neighbors[offset:offset + limit]
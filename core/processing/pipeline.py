@@ -0,0 +1,95 @@
+# core/processing/pipeline.py
+
+import time, logging, threading, multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from core.utils import metrics
+from core.utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+UTILIZATION_WINDOW = 60
+
+class StagePool:
+    """
+    A fixed number of slots in front of an executor. Callers block until a
+    slot is free, so at most `workers` tasks are ever inside the executor and
+    the callers waiting for a slot are this pool's queue. Queue depth, active
+    tasks and utilization over the last minute are published as gauges under
+    pipeline.<name>.*.
+    """
+
+    def __init__(self, name, workers, make_executor):
+        self.name = name
+        self.workers = workers
+        self._make_executor = make_executor
+        self._executor = None
+        self._slots = threading.Semaphore(max(workers, 0))
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._finished = deque()    # (end time, busy seconds) within the window
+
+    def _get_executor(self):
+        # Created on first use so each gunicorn worker gets its own
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._make_executor(self.workers)
+            return self._executor
+
+    def _publish(self):
+        now = time.monotonic()
+        while self._finished and self._finished[0][0] < now - UTILIZATION_WINDOW:
+            self._finished.popleft()
+        busy = sum(d for _, d in self._finished)
+        metrics.set_gauge(f"pipeline.{self.name}.queued", self._queued)
+        metrics.set_gauge(f"pipeline.{self.name}.active", self._active)
+        metrics.set_gauge(f"pipeline.{self.name}.utilization", round(min(1.0, busy / (self.workers * UTILIZATION_WINDOW)), 3))
+
+    def run(self, fn, *args, **kwargs):
+        """Run `fn` on this pool and wait for its result."""
+        if self.workers <= 0:
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            self._queued += 1
+            self._publish()
+
+        wait_start = time.perf_counter()
+        self._slots.acquire()
+        metrics.observe(f"pipeline.{self.name}.wait", time.perf_counter() - wait_start)
+
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+            self._publish()
+
+        start = time.perf_counter()
+        try:
+            return self._get_executor().submit(fn, *args, **kwargs).result()
+        finally:
+            busy = time.perf_counter() - start
+            self._slots.release()
+            with self._lock:
+                self._active -= 1
+                self._finished.append((time.monotonic(), busy))
+                self._publish()
+
+def _process_pool(workers):
+    # spawn, not fork: the parent is full of threads and open connections
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def _thread_pool(workers):
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-io")
+
+# Image decoding and re-encoding hold the GIL, so they run in other processes;
+# provider calls only wait on the network and get many more slots. A pool
+# sized 0 runs its stages inline on the calling thread.
+cpu_pool = StagePool("cpu", Config.INGEST_CPU_WORKERS, _process_pool)
+io_pool = StagePool("io", Config.INGEST_IO_CONCURRENCY, _thread_pool)
+
+def run_cpu(fn, *args, **kwargs):
+    return cpu_pool.run(fn, *args, **kwargs)
+
+def run_io(fn, *args, **kwargs):
+    return io_pool.run(fn, *args, **kwargs)
@@ -0,0 +1,296 @@
+# engine.py
+
+import logging
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from core.utils.config import Config
+from core.utils.timing import timed_route
+from core.database import vectors
+from core.database.database import get_db_session
+from core.content.parser import extract_time_filter, extract_color_filter, sanitize_tsquery
+
+logger = logging.getLogger(__name__)
+
+# Weights of each signal in the hybrid score
+FTS_WEIGHT      = 0.35
+VEC_WEIGHT      = 0.40
+TRGM_WEIGHT     = 0.15
+COLOR_WEIGHT    = 0.10
+RECENCY_WEIGHT  = 0.005
+
+# Minimum per-signal scores for a row to be considered a match
+FTS_MIN_RANK    = 0.05
+VEC_MAX_DIST    = 1.0
+TRGM_MIN_SIM    = 0.01
+
+# Candidate lookups for the two-stage mode run side by side on their own sessions
+candidate_executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix="search")
+
+# ---------------------------------- PARSING ------------------------------------
+
+def build_search_params(query_text, user_tz, embed):
+    """
+    Split the raw query into its time / color / text parts and build the bind
+    params for the search statement. `embed` is called with the remaining text
+    and should return a list of floats (or an empty list on failure).
+    """
+    query_wo_time_text, time_filter = extract_time_filter(query_text, user_tz)
+    query_wo_col_text, color_lab = extract_color_filter(query_wo_time_text)
+    logger.info(f"query_wo_col_text: {query_wo_col_text} | time_filter: {time_filter} | color_lab: {color_lab}")
+
+    fts_query = sanitize_tsquery(query_wo_col_text) if query_wo_col_text else ""
+    vec_query = embed(query_wo_col_text) if query_wo_col_text else None
+
+    return {
+        "fts_query": fts_query,
+        "trgm_query": query_wo_col_text,
+        "vec_query": vec_query,
+        "start_ts": time_filter[0] if time_filter else None,
+        "end_ts": time_filter[1] if time_filter else None,
+        "color_lab": color_lab,
+    }
+
+SIGNAL_NAMES = ("fts", "vector", "trigram", "time", "color")
+
+def active_signals(params):
+    """Returns the (fts, vec, trgm, time, color) activation flags for the params."""
+    return (
+        bool(params["fts_query"]),
+        params["vec_query"] is not None and len(params["vec_query"]) > 0,
+        bool(params["trgm_query"]),
+        params["start_ts"] is not None,
+        params["color_lab"] is not None,
+    )
+
+def signal_report(params, signals):
+    names = [name for name, on in zip(SIGNAL_NAMES, signals) if on]
+    return {
+        "signals": names,
+        # There was text to embed, but no vector in time (or at all)
+        "lexical_fallback": params["vec_query"] is not None and "vector" not in names,
+    }
+
+# ---------------------------------- COMPILING ------------------------------------
+
+@lru_cache(maxsize=64)
+def compile_search_sql(is_fts_active, is_vec_active, is_trgm_active, is_time_active, is_color_active, is_candidate_scoped=False, time_skips_match=False):
+    """
+    Build the minimal hybrid search statement for one combination of active
+    signals. Inactive signals are left out of the statement entirely so the
+    planner never sees them, and each active signal is computed exactly once
+    in a LATERAL subquery that both the score and the match filter reuse.
+
+    When `is_candidate_scoped` is set the statement only scores the ids bound
+    to :candidate_ids, which is how the two-stage mode reranks its union.
+
+    `time_skips_match` lets a time filter stand in for the text match, as
+    /query does; /relevant and /ideas still require a match under a time filter.
+    """
+    ctes = ["""
+        bounds AS (
+            SELECT
+                MIN(timestamp) AS min_ts,
+                MAX(timestamp) AS max_ts
+            FROM data
+            WHERE user_id = :userid
+        )"""]
+    joins = ["CROSS JOIN bounds b"]
+    score_terms = [f"""
+            ({RECENCY_WEIGHT} * CASE
+                WHEN b.max_ts > b.min_ts
+                THEN (d.timestamp - b.min_ts)::float / (b.max_ts - b.min_ts)
+                ELSE 0
+            END)"""]
+    filters = ["d.user_id = :userid", "d.tags IS NOT NULL"]
+    matches = []
+
+    if is_candidate_scoped:
+        filters.append("d.id = ANY(:candidate_ids)")
+
+    if is_fts_active:
+        ctes.append("""
+        q AS (
+            SELECT to_tsquery('english', :fts_query) AS tsq
+        )""")
+        joins.append("CROSS JOIN q")
+        joins.append("CROSS JOIN LATERAL (SELECT ts_rank(d.tags_tsv, q.tsq) AS text_rank) fts")
+        score_terms.append(f"({FTS_WEIGHT} * fts.text_rank)")
+        # The @@ clause lets the planner use data_tags_tsv_idx, the rank check keeps the old threshold
+        matches.append(f"(d.tags_tsv @@ q.tsq AND fts.text_rank >= {FTS_MIN_RANK})")
+
+    if is_vec_active:
+        joins.append("CROSS JOIN LATERAL (SELECT d.tags_vector <=> (:vec_query)::vector AS distance) vec")
+        score_terms.append(f"({VEC_WEIGHT} * (1 - vec.distance))")
+        matches.append(f"vec.distance < {VEC_MAX_DIST}")
+
+    if is_trgm_active:
+        joins.append("""CROSS JOIN LATERAL (
+                SELECT GREATEST(
+                    word_similarity(lower(d.tags), lower(:trgm_query)),
+                    similarity(lower(d.tags), lower(:trgm_query))
+                ) AS trgm_sim
+            ) trgm""")
+        score_terms.append(f"({TRGM_WEIGHT} * trgm.trgm_sim)")
+        matches.append(f"trgm.trgm_sim >= {TRGM_MIN_SIM}")
+
+    if is_color_active:
+        joins.append("""CROSS JOIN LATERAL (
+                SELECT MIN(dc.color_vector <-> (:color_lab)::vector) AS color_dist
+                FROM data_color dc
+                WHERE dc.data_id = d.id AND dc.color_vector IS NOT NULL
+            ) col""")
+        # Entries without colors contribute nothing instead of nulling the whole score
+        score_terms.append(f"({COLOR_WEIGHT} * COALESCE(1 - LEAST(col.color_dist / 100.0, 1), 0))")
+
+    if is_time_active:
+        filters.append("d.timestamp >= :start_ts")
+        filters.append("d.timestamp <= :end_ts")
+
+    # Color queries, and time queries where the caller allows it, return rows without needing a text match
+    if matches and not ((is_time_active and time_skips_match) or is_color_active):
+        filters.append("(" + " OR ".join(matches) + ")")
+
+    cte_sql = ",".join(ctes)
+    join_sql = "\n        ".join(joins)
+    score_sql = " + ".join(score_terms)
+    where_sql = "\n            AND ".join(filters)
+
+    sql = f"""
+        WITH {cte_sql}
+        SELECT
+            d.id,
+            d.file_path,
+            d.thumbnail_path,
+            d.tags,
+            d.timestamp,
+            {score_sql} AS hybrid_score,
+            d.placeholder,
+            d.dominant_color
+        FROM data d
+        {join_sql}
+        WHERE {where_sql}
+        ORDER BY hybrid_score DESC
+        LIMIT :result_limit
+    """
+    logger.info(
+        f"Compiled search statement for fts={is_fts_active} vec={is_vec_active} "
+        f"trgm={is_trgm_active} time={is_time_active} color={is_color_active} "
+        f"candidates={is_candidate_scoped} time_skips_match={time_skips_match}"
+    )
+    return text(sql)
+
+# ---------------------------------- CANDIDATES ------------------------------------
+
+# Each lookup is shaped so its own index can answer it: GIN for fts and
+# trigram, ivfflat for the vector ORDER BY ... LIMIT.
+CANDIDATE_SQL = {
+    "fts": text("""
+        SELECT d.id
+        FROM data d, to_tsquery('english', :fts_query) AS tsq
+        WHERE d.user_id = :userid
+            AND d.tags_tsv @@ tsq
+        ORDER BY ts_rank(d.tags_tsv, tsq) DESC
+        LIMIT :candidate_k
+    """),
+    "vec": text("""
+        SELECT d.id
+        FROM data d
+        WHERE d.user_id = :userid
+            AND d.tags_vector IS NOT NULL
+        ORDER BY d.tags_vector <=> (:vec_query)::vector
+        LIMIT :candidate_k
+    """),
+    "trgm": text("""
+        SELECT d.id
+        FROM data d
+        WHERE d.user_id = :userid
+            AND lower(d.tags) %> lower(:trgm_query)
+        ORDER BY word_similarity(lower(:trgm_query), lower(d.tags)) DESC
+        LIMIT :candidate_k
+    """),
+}
+
+def _fetch_candidates(signal, params):
+    if signal == "vec":
+        neighbors = vectors.search(params["userid"], params["vec_query"], params["candidate_k"])
+        if neighbors is not None:
+            return [n[0] for n in neighbors]
+
+    session = get_db_session()
+    try:
+        rows = session.execute(CANDIDATE_SQL[signal], params).fetchall()
+        return [r[0] for r in rows]
+    finally:
+        session.close()
+
+@timed_route("fetch_candidates")
+def fetch_candidates(params, signals, candidate_k):
+    """
+    First stage of the two-stage mode: pull at most `candidate_k` ids from each
+    active text signal in parallel and return the union.
+    """
+    is_fts_active, is_vec_active, is_trgm_active, _, _ = signals
+    active = [
+        name for name, on in (("fts", is_fts_active), ("vec", is_vec_active), ("trgm", is_trgm_active))
+        if on
+    ]
+    lookup_params = dict(params, candidate_k=candidate_k)
+    futures = {name: candidate_executor.submit(_fetch_candidates, name, lookup_params) for name in active}
+
+    candidate_ids = set()
+    for name, fut in futures.items():
+        ids = fut.result()
+        logger.info(f"{name} candidates: {len(ids)}")
+        candidate_ids.update(ids)
+
+    return list(candidate_ids)
+
+# ---------------------------------- SEARCHING ------------------------------------
+
+@timed_route("run_search")
+def run_search(session, user_id, query_text, user_tz, embed, result_limit, mode=None, candidate_k=None, report=None, time_skips_match=False):
+    """
+    Run the hybrid search for `query_text` over a user's entries. Returns rows of
+    (id, file_path, thumbnail_path, tags, timestamp, hybrid_score, placeholder,
+    dominant_color).
+
+    `mode` is "exhaustive" (score every row of the user) or "candidates" (score
+    only the union of per-signal top `candidate_k` ids). Defaults to
+    Config.SEARCH_MODE.
+
+    When given, `report` is filled with the signals the search ran on and
+    whether it fell back to the lexical ones because `embed` came back empty.
+
+    `time_skips_match` is passed through to compile_search_sql.
+    """
+    mode = mode or Config.SEARCH_MODE
+    params = build_search_params(query_text, user_tz, embed)
+    signals = active_signals(params)
+    if report is not None:
+        report.update(signal_report(params, signals))
+    params.update({
+        "userid": user_id,
+        "result_limit": result_limit,
+    })
+
+    if not any(signals):
+        logger.info("No active search signals; returning no results.")
+        return []
+
+    is_fts_active, is_vec_active, is_trgm_active, _, _ = signals
+    has_text_signal = is_fts_active or is_vec_active or is_trgm_active
+
+    # Time-only and color-only queries have nothing to pull candidates from
+    if mode == "candidates" and has_text_signal:
+        params["candidate_ids"] = fetch_candidates(params, signals, candidate_k or result_limit)
+        if not params["candidate_ids"]:
+            return []
+        sql = compile_search_sql(*signals, is_candidate_scoped=True, time_skips_match=time_skips_match)
+    else:
+        sql = compile_search_sql(*signals, time_skips_match=time_skips_match)
+
+    result = session.execute(sql, params).fetchall()
+    logger.info(f"len result: {len(result)}")
+
+    return result
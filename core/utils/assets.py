@@ -0,0 +1,35 @@
+# assets.py
+
+import hmac, time, base64, hashlib
+from urllib.parse import urlencode
+from core.utils.config import Config
+
+# Signed, expiring URLs for uploads, thumbnails and sprite sheets. The signature binds the
+# asset to the user it was issued to, so serving one needs no token or DB
+# lookup. Expiries are rounded up to ASSET_URL_BUCKET so a given asset keeps
+# the same URL for a while and clients can cache it.
+
+KINDS = {"file", "thumb", "sprite"}
+
+def _signature(kind, name, user_id, expires):
+    message = f"{kind}:{name}:{user_id}:{expires}".encode()
+    digest = hmac.new(Config.APP_SECRET_KEY.encode(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+
+def asset_url(kind, name, user_id):
+    if not name:
+        return None
+    bucket = Config.ASSET_URL_BUCKET
+    expires = -(-(int(time.time()) + Config.ASSET_URL_TTL) // bucket) * bucket
+    query = urlencode({"u": user_id, "e": expires, "s": _signature(kind, name, user_id, expires)})
+    return f"/api/asset/{kind}/{name}?{query}"
+
+def verify_asset(kind, name, user_id, expires, signature):
+    if kind not in KINDS or not signature:
+        return False
+    try:
+        if int(expires) < time.time():
+            return False
+    except (TypeError, ValueError):
+        return False
+    return hmac.compare_digest(_signature(kind, name, user_id, expires), signature)
@@ -6,6 +6,7 @@ import logging
 from hashlib import sha256
 from collections import defaultdict
 from cachetools import TTLCache
+from core.utils import metrics, singleflight
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +15,12 @@ CACHE_TTL_SECONDS   =   int(os.getenv("QUERY_CACHE_TTL"))
 CACHE_MAX_PER_USER  =   int(os.getenv("QUERY_CACHE_MAX_PER_USER"))
 REDIS_URL           =   os.getenv("REDIS_URL")
 KEY_PREFIX          =   os.getenv("QUERY_CACHE_PREFIX")
+# Without Redis, version bumps from other processes (gunicorn workers, services/worker.py)
+# never reach this one, so the in-process cache is only correct when a single process
+# serves and ingests everything. It stays off unless that is declared.
+INPROC_FALLBACK     =   os.getenv("QUERY_CACHE_INPROC", "0") == "1"
+# How long a result that compute_once won't cache stays visible to the requests waiting on it
+UNCACHED_TTL_SECONDS =  int(os.getenv("QUERY_CACHE_UNCACHED_TTL", "5"))
 
 # -------- Backend setup --------
 _redis = None
@@ -24,61 +31,113 @@ try:
     logger.info("Query cache using Redis at %s", REDIS_URL)
 except Exception as e:
     _redis = None
-    logger.warning("Redis unavailable (%s). Falling back to in-process cache (per worker).", e)
+    if INPROC_FALLBACK:
+        logger.warning("Redis unavailable (%s). Falling back to in-process cache (single-process mode).", e)
+    else:
+        logger.warning("Redis unavailable (%s). Query caching disabled (set QUERY_CACHE_INPROC=1 for a single process).", e)
+
+def get_redis():
+    """The shared Redis connection (decode_responses=True), or None if Redis is unavailable."""
+    return _redis
 
-# Fallback per-process cache (only used if Redis is not available)
+# Fallback per-process cache (only used if Redis is not available and INPROC_FALLBACK is set)
 _inproc = defaultdict(lambda: TTLCache(maxsize=CACHE_MAX_PER_USER, ttl=CACHE_TTL_SECONDS))
 
+# Per-process generation counters (only used if Redis is not available)
+_inproc_versions = defaultdict(int)
+
 # -------- Helpers --------
 def _normalize(text: str) -> str:
     return text.strip().lower()
 
-def _make_key(user_id, text: str) -> str:
+def _version_key(user_id) -> str:
+    return f"{KEY_PREFIX}ver:{user_id}"
+
+def _make_key(user_id, text: str, scope: str, version: int) -> str:
     norm = _normalize(text)
-    h = sha256(f"{user_id}:{norm}".encode()).hexdigest()
-    return f"{KEY_PREFIX}{user_id}:{h}"
+    h = sha256(f"{user_id}:{scope}:{norm}".encode()).hexdigest()
+    return f"{KEY_PREFIX}{user_id}:v{version}:{scope}:{h}"
+
+# -------- Versions --------
+# Every key embeds the user's current generation, so bumping it invalidates
+# all of the user's entries at once; the old ones simply age out by TTL.
+def get_user_version(user_id) -> int:
+    if _redis:
+        # No expiry: if it reset to 0 a later bump could resurrect live keys
+        return int(_redis.get(_version_key(user_id)) or 0)
+    return _inproc_versions[user_id]
+
+def bump_user_version(user_id) -> int:
+    if _redis:
+        version = _redis.incr(_version_key(user_id))
+    else:
+        _inproc_versions[user_id] += 1
+        version = _inproc_versions[user_id]
+    metrics.inc("cache.invalidations")
+    logger.info("BUMP - Cache version for user %s is now %s", user_id, version)
+    return version
 
-def get_cache_value(user_id, query_text):
-    k = _make_key(user_id, query_text)
+# Kept for callers that invalidate explicitly
+clear_user_cache = bump_user_version
+
+def _read(user_id, k):
     if _redis:
         val = _redis.get(k)
-        if val is not None:
-            logger.info("HIT - Cache hit for user %s", user_id)
-            return json.loads(val)
-        logger.info("MISS - Cache miss for user %s", user_id)
+        return json.loads(val) if val is not None else None
+    if not INPROC_FALLBACK:
         return None
-    # fallback
-    res = _inproc[user_id].get(k)
-    logger.info("%s - Cache %s for user %s",
-                "HIT" if res is not None else "MISS",
-                "hit" if res is not None else "miss", user_id)
+    return _inproc[user_id].get(k)
+
+# -------- Lookups --------
+# Pass the `version` read before computing a result to both calls so a result
+# computed from pre-bump data is never stored under the new version.
+def get_cache_value(user_id, query_text, scope="query", version=None):
+    if version is None:
+        version = get_user_version(user_id)
+    res = _read(user_id, _make_key(user_id, query_text, scope, version))
+
+    hit = res is not None
+    metrics.inc(f"cache.{scope}.{'hit' if hit else 'miss'}")
+    logger.info("%s - Cache %s for user %s (%s)",
+                "HIT" if hit else "MISS",
+                "hit" if hit else "miss", user_id, scope)
     return res
 
-def store_cache(user_id, query_text, result_json):
-    k = _make_key(user_id, query_text)
+def store_cache(user_id, query_text, result_json, scope="query", version=None, ttl=None):
+    if version is None:
+        version = get_user_version(user_id)
+    k = _make_key(user_id, query_text, scope, version)
     if _redis:
-        _redis.setex(k, CACHE_TTL_SECONDS, json.dumps(result_json))
-        # track keys per user for fast clear
-        setkey = f"{KEY_PREFIX}keys:{user_id}"
-        _redis.sadd(setkey, k)
-        _redis.expire(setkey, CACHE_TTL_SECONDS + 300)
-    else:
+        _redis.setex(k, ttl or CACHE_TTL_SECONDS, json.dumps(result_json))
+    elif INPROC_FALLBACK and ttl is None:
         _inproc[user_id][k] = result_json
+    else:
+        return k
+    metrics.inc(f"cache.{scope}.store")
     logger.info("STORE - Cached result for user %s key %s", user_id, k)
     return k
 
-def clear_user_cache(user_id):
-    if _redis:
-        setkey = f"{KEY_PREFIX}keys:{user_id}"
-        keys = list(_redis.smembers(setkey))
-        deleted = 0
-        if keys:
-            deleted = _redis.delete(*keys)
-        _redis.delete(setkey)
-        logger.info("CLEAR - Cleared %d Redis keys for user %s", deleted, user_id)
-        return
-    # fallback
-    if user_id in _inproc:
-        cleared = len(_inproc[user_id])
-        _inproc[user_id].clear()
-        logger.info("CLEAR - Cleared %d in-process entries for user %s", cleared, user_id)
\ No newline at end of file
+def compute_once(user_id, query_text, compute, scope="query", version=None, store_if=None):
+    """
+    Handle a cache miss: run `compute()` and cache its result, with concurrent
+    identical requests (in this worker, and in others through Redis) waiting
+    for that one result instead of repeating the search.
+
+    Results for which `store_if(result)` is false are only published for
+    UNCACHED_TTL_SECONDS: long enough for requests in other workers waiting
+    on this one to pick them up instead of each recomputing in turn, short
+    enough that the next request computes afresh.
+    """
+    if version is None:
+        version = get_user_version(user_id)
+    k = _make_key(user_id, query_text, scope, version)
+
+    def compute_and_store():
+        result = compute()
+        if store_if is None or store_if(result):
+            store_cache(user_id, query_text, result, scope=scope, version=version)
+        else:
+            store_cache(user_id, query_text, result, scope=scope, version=version, ttl=UNCACHED_TTL_SECONDS)
+        return result
+
+    return singleflight.run(k, compute_and_store, lambda: _read(user_id, k), redis=_redis)
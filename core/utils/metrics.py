@@ -0,0 +1,96 @@
+# metrics.py
+
+import os, json, time, threading
+from collections import defaultdict, deque
+
+# Counters, gauges and latency samples for this process. Every gunicorn
+# worker keeps its own, so /api/metrics reports the worker that answered.
+# Processes that serve no requests (services/worker.py) publish() their
+# snapshot to Redis, and /api/metrics includes whatever is published.
+
+PUBLISH_PREFIX = "metrics:"
+
+SAMPLE_WINDOW = 1024
+
+_lock = threading.Lock()
+_started = time.time()
+_counters = defaultdict(float)
+_gauges = {}
+_totals = defaultdict(lambda: [0, 0.0])                         # name -> [count, sum]
+_samples = defaultdict(lambda: deque(maxlen=SAMPLE_WINDOW))     # name -> recent values
+
+def inc(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+def observe(name, value):
+    """Record one sample (e.g. a latency in seconds) for a histogram."""
+    with _lock:
+        total = _totals[name]
+        total[0] += 1
+        total[1] += value
+        _samples[name].append(value)
+
+def _percentile(values, pct):
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+def percentile(name, pct, min_samples=1):
+    """`pct` percentile of the recent samples for `name`, or None with fewer than `min_samples`."""
+    with _lock:
+        values = sorted(_samples.get(name, ()))
+    if len(values) < max(1, min_samples):
+        return None
+    return _percentile(values, pct)
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        totals = {name: tuple(t) for name, t in _totals.items()}
+        samples = {name: sorted(s) for name, s in _samples.items()}
+
+    histograms = {}
+    for name, (count, total) in totals.items():
+        values = samples[name]
+        histograms[name] = {
+            "count": count,
+            "sum": round(total, 6),
+            "mean": round(total / count, 6) if count else 0,
+            # Percentiles cover the last SAMPLE_WINDOW samples
+            "p50": round(_percentile(values, 50), 6) if values else 0,
+            "p90": round(_percentile(values, 90), 6) if values else 0,
+            "p99": round(_percentile(values, 99), 6) if values else 0,
+            "max": round(values[-1], 6) if values else 0,
+        }
+
+    return {
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - _started, 1),
+        "counters": counters,
+        "gauges": gauges,
+        "histograms": histograms,
+    }
+
+# ---------------------------------- PUBLISHING ------------------------------------
+
+def publish(redis, source, ttl):
+    """Store this process's snapshot under `source` for `ttl` seconds."""
+    redis.setex(f"{PUBLISH_PREFIX}{source}", int(ttl), json.dumps(snapshot()))
+
+def published(redis):
+    """Snapshots other processes have published and not let expire, by source."""
+    snapshots = {}
+    for key in redis.scan_iter(match=f"{PUBLISH_PREFIX}*"):
+        value = redis.get(key)
+        if value is not None:
+            snapshots[key[len(PUBLISH_PREFIX):]] = json.loads(value)
+    return snapshots
@@ -52,6 +52,7 @@ def apply_middleware(app):
             return  # Flask-CORS will handle it
             
         if request.path.startswith("/api/get_file") or request.path.startswith("/api/get_thumbnail") \
+            or request.path.startswith("/api/asset/") \
             or request.path.startswith("/api/unsubscribe") or request.path.startswith("/api/click"):
             return
 
@@ -0,0 +1,101 @@
+# singleflight.py
+
+import time, uuid, logging, threading
+from core.utils import metrics
+from core.utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Deletes the lock only if we still hold it (it may have expired and been retaken)
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.failed = False
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# ---------------------------------- ACROSS WORKERS ------------------------------------
+
+def _run_locked(redis, key, compute, lookup):
+    """
+    Take the Redis lock for `key` and compute, or wait for whoever holds it to
+    publish a result that `lookup` can see. A holder that dies releases the
+    lock through its TTL, after which a waiter takes over.
+    """
+    lock_key = f"sf:{key}"
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + Config.SINGLE_FLIGHT_TIMEOUT
+    waited = False
+
+    while True:
+        try:
+            acquired = redis.set(lock_key, token, nx=True, px=int(Config.SINGLE_FLIGHT_TIMEOUT * 1000))
+        except Exception as e:
+            logger.warning(f"Single-flight lock unavailable ({e}); computing without it")
+            return compute()
+
+        if acquired:
+            try:
+                # The previous holder may have published between our miss and the lock
+                result = lookup() if waited else None
+                return result if result is not None else compute()
+            finally:
+                try:
+                    redis.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    logger.warning(f"Failed to release single-flight lock {lock_key}: {e}")
+
+        if not waited:
+            metrics.inc("singleflight.waited_remote")
+            waited = True
+        time.sleep(Config.SINGLE_FLIGHT_POLL_MS / 1000)
+
+        result = lookup()
+        if result is not None:
+            metrics.inc("singleflight.coalesced_remote")
+            return result
+        if time.monotonic() > deadline:
+            metrics.inc("singleflight.timeouts")
+            return compute()
+
+# ---------------------------------- ENTRY POINT ------------------------------------
+
+def run(key, compute, lookup, redis=None):
+    """
+    Run `compute()` once for concurrent callers with the same `key`. Threads of
+    this process wait for the first caller's result directly; with `redis`,
+    other processes wait on a lock and read the result back through `lookup()`,
+    so `compute` must publish its result where `lookup` finds it.
+    """
+    with _inflight_lock:
+        call = _inflight.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = _inflight[key] = _Call()
+
+    if not is_leader:
+        metrics.inc("singleflight.coalesced_local")
+        if call.event.wait(Config.SINGLE_FLIGHT_TIMEOUT) and not call.failed:
+            return call.result
+        # The leader failed or is stuck; don't fail with it
+        return compute()
+
+    try:
+        call.result = _run_locked(redis, key, compute, lookup) if redis else compute()
+        return call.result
+    except Exception:
+        call.failed = True
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        call.event.set()
@@ -1,5 +1,6 @@
 import time, logging
 from functools import wraps
+from core.utils import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +14,7 @@ def timed_route(label=None):
             finally:
                 duration = time.perf_counter() - start
                 route_name = label or func.__name__
+                metrics.observe(f"timer.{route_name}", duration)
                 logger.info(f"[TIMER] {route_name} took {duration:.4f} seconds")
         return wrapper
     return decorator
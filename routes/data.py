@@ -1,18 +1,25 @@
 # data.py
 
-import os, time, uuid, zipfile, json, logging, tempfile, requests, traceback
+import os, time, uuid, zipfile, json, logging, mimetypes, requests, traceback
 from io import BytesIO
 from routes import data_bp
 from werkzeug.utils import secure_filename
-from flask import request, jsonify, send_from_directory, abort
-from core.utils.cache import clear_user_cache
+from flask import Response, request, jsonify, send_from_directory, abort
+from sqlalchemy import text
+from core.utils.cache import bump_user_version, get_cache_value
+from core.database import vectors
 from core.database.database import get_db_session
 from core.database.models import StagingEntry, DataEntry, User, ProcessingStatus
 from core.utils.middleware import limiter
 from core.utils.logs import error_response
 from core.utils.decoraters import token_required, save_limit_required
 from core.utils.config import Config
-from core.processing.background import process_entry_async
+from core.utils.assets import asset_url, verify_asset
+from core.processing import neighbors
+from core.content import storage
+from core.content.storage import thumbnail_variant_path
+from core.content.sprites import build_sprite, sprite_dir
+from core.processing.background import process_entry_async, refresh_neighbors_async
 from core.notifications.emails import send_email_with_zip
 
 logger = logging.getLogger(__name__)
@@ -45,7 +52,7 @@ def upload_image(current_user):
         original_filename = secure_filename(file.filename)
         original_ext = os.path.splitext(original_filename)[1]
         temp_filename = f"{file_uuid_token}{original_ext}"
-        temp_path = os.path.join(tempfile.gettempdir(), temp_filename)
+        temp_path = os.path.join(Config.STAGING_DIR, temp_filename)
         file.save(temp_path)
 
         # Save initial info with PENDING status
@@ -60,12 +67,9 @@ def upload_image(current_user):
         session.commit()
         logger.info(f"StagingEntry {entry.id} created with PENDING status.")
         
-        # Kick off async processing
+        # Kick off async processing; the cache is invalidated once the entry is committed
         process_entry_async(entry.id)
 
-        # Clearing cache
-        clear_user_cache(current_user.id)
-
         return jsonify({
             'status': 'success',
             'message': 'Image upload accepted and is being processed',
@@ -116,7 +120,7 @@ def upload_imageurl(current_user):
         # Save file to temp
         file_uuid_token = uuid.uuid4().hex
         temp_filename = secure_filename(f"{file_uuid_token}.jpg")
-        temp_path = os.path.join(tempfile.gettempdir(), temp_filename)
+        temp_path = os.path.join(Config.STAGING_DIR, temp_filename)
         with open(temp_path, "wb") as out_file:
             out_file.write(response.content)
         
@@ -132,12 +136,9 @@ def upload_imageurl(current_user):
         session.commit()
         logger.info(f"StagingEntry {entry.id} created with PENDING status.")
         
-        # Kick off async processing
+        # Kick off async processing; the cache is invalidated once the entry is committed
         process_entry_async(entry.id)
 
-        # Clearing cache
-        clear_user_cache(current_user.id)
-
         return jsonify({
             'status': 'success',
             'message': 'Image URL accepted and is being processed',
@@ -169,7 +170,7 @@ def delete_file(current_user):
             e = "No file_name provided."
             logger.error(e)
             return error_response(e, 400)
-        file_path = os.path.join(Config.UPLOAD_DIR, file_name)
+        file_path = storage.resolve(Config.UPLOAD_DIR, file_name)
         logger.info(f"Received file_path: {file_path}\n")
 
         session = get_db_session()
@@ -185,17 +186,21 @@ def delete_file(current_user):
             logger.error(e)
             return error_response(e, 404)
 
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            logger.info(f"Deleted file: {file_path}")
-        else:
-            logger.warning(f"File not found at path: {file_path}")
-
+        entry_id = entry.id
+        thumbnail_path = entry.thumbnail_path
+        # The FK cascade drops the entry from these lists; refill them once it's gone
+        affected_ids = neighbors.lists_containing(session, entry_id)
         session.delete(entry)
         session.commit()
 
-        # Clear cache for the user so subsequent queries reflect the deletion
-        clear_user_cache(current_user.id)
+        # Other entries may share the same stored files
+        storage.release(session, [file_path], [thumbnail_path])
+
+        vectors.remove_entries(user.id, [entry_id])
+        refresh_neighbors_async(user.id, affected_ids)
+
+        # Invalidate the user's cached queries so they reflect the deletion
+        bump_user_version(current_user.id)
         
         return jsonify({'status': 'success', 'message': 'Deleted file successfully'})
     
@@ -209,39 +214,123 @@ def delete_file(current_user):
 
 # ---------------------------------- GETTING ------------------------------------
 
+def _negotiated_thumbnail(thumbnailname):
+    """
+    ?size= picks the smallest variant at least that large, in WebP when the
+    client takes it. Entries from before the backfill only have the original.
+    """
+    size = request.args.get('size', type=int)
+    if not size:
+        return thumbnailname
+    sizes = sorted(Config.THUMBNAIL_SIZES)
+    variant_size = next((s for s in sizes if s >= size), sizes[-1])
+    fmt = "webp" if "image/webp" in request.headers.get("Accept", "") else "jpeg"
+    variant_path = thumbnail_variant_path(storage.resolve(Config.THUMBNAIL_DIR, thumbnailname), variant_size, fmt)
+    return os.path.basename(variant_path) if os.path.exists(variant_path) else thumbnailname
+
+# token_required has already loaded the user, so these don't touch the DB again
+
 @data_bp.route('/get_file/<filename>', methods=['GET'])
 @token_required
 def get_file(current_user, filename):
-    session = get_db_session()
-    user = session.query(User).get(current_user.id)
-    if not user:
-        logger.error(f"User {current_user.username} not found.\n")
-        return error_response(f"User {current_user.username} not found.", 404)
-
     safe = secure_filename(filename)
-    file_path = os.path.join(Config.UPLOAD_DIR, safe)
+    file_path = storage.resolve(Config.UPLOAD_DIR, safe)
     if not os.path.exists(file_path):
         abort(404) # Or return error_response("File not found", 404)
 
-    return send_from_directory(Config.UPLOAD_DIR, filename)
+    return send_from_directory(Config.UPLOAD_DIR, storage.relative_path(safe))
 
 @data_bp.route('/get_thumbnail/<thumbnailname>')
 @limiter.limit("25 per second")
 @token_required
 def get_thumbnail(current_user, thumbnailname):
-    session = get_db_session()
-    user = session.query(User).get(current_user.id)
-    if not user:
-        e = f"User ID {current_user.id} not found"
-        logger.error(e)
-        return error_response(e, 404)
-
     thumbnailname = secure_filename(thumbnailname)
-    file_path = os.path.join(Config.THUMBNAIL_DIR, thumbnailname)
+    file_path = storage.resolve(Config.THUMBNAIL_DIR, thumbnailname)
     if not os.path.exists(file_path):
         abort(404) # Or return error_response("Thumbnail not found", 404)
 
-    return send_from_directory(Config.THUMBNAIL_DIR, thumbnailname)
+    response = send_from_directory(Config.THUMBNAIL_DIR, storage.relative_path(_negotiated_thumbnail(thumbnailname)))
+    response.headers["Vary"] = "Accept"
+    return response
+
+@data_bp.route('/asset/<kind>/<name>')
+def get_asset(kind, name):
+    """
+    Serve a file or thumbnail from a signed URL issued in query results
+    (core/utils/assets.py). Names are unique per upload, so responses are
+    cacheable for good; with ASSET_ACCEL_REDIRECT nginx sends the bytes.
+    """
+    name = secure_filename(name)
+    if not verify_asset(kind, name, request.args.get('u'), request.args.get('e'), request.args.get('s')):
+        return error_response("Invalid or expired link", 403)
+
+    if kind == "thumb":
+        directory, location = Config.THUMBNAIL_DIR, "thumbnails"
+        if not os.path.exists(storage.resolve(directory, name)):
+            abort(404)
+        name = _negotiated_thumbnail(name)
+    elif kind == "sprite":
+        directory, location = sprite_dir(), "sprites"
+        if not os.path.exists(os.path.join(directory, name)):
+            abort(404)
+    else:
+        directory, location = Config.UPLOAD_DIR, "uploads"
+        if not os.path.exists(storage.resolve(directory, name)):
+            abort(404)
+
+    relative = storage.relative_path(name)
+    if Config.ASSET_ACCEL_REDIRECT:
+        response = Response(mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream")
+        response.headers["X-Accel-Redirect"] = f"{Config.ASSET_ACCEL_PREFIX}/{location}/{relative}"
+    else:
+        response = send_from_directory(directory, relative)
+    response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    response.headers["Vary"] = "Accept"
+    return response
+
+@data_bp.route('/thumbnails/sprite', methods=['POST'])
+@token_required
+def get_sprite(current_user):
+    """
+    One sprite sheet for a grid of results, from {"file_ids": [...]} or the
+    cached results of {"query": "..."}. Returns the sheet's signed URL and
+    each entry's [x, y, width, height] in it.
+    """
+    body = request.get_json(silent=True) or {}
+    file_ids = body.get("file_ids")
+    if not file_ids and body.get("query"):
+        cached = get_cache_value(current_user.id, body["query"].strip(), scope="query")
+        if cached is None:
+            return error_response("Query results are no longer cached; pass file_ids", 404)
+        file_ids = [r["file_id"] for r in cached.get("results", []) if r.get("file_id")]
+    if not file_ids:
+        return error_response("No file_ids or query provided", 400)
+    sizes = sorted(Config.THUMBNAIL_SIZES)
+    try:
+        file_ids = [int(i) for i in file_ids][:100]
+        size = int(body.get("size", sizes[0]))
+        columns = min(max(int(body.get("columns", 10)), 1), 20)
+    except (TypeError, ValueError):
+        return error_response("file_ids, size and columns must be integers", 400)
+
+    tile = next((s for s in sizes if s >= size), sizes[-1])
+    fmt = "webp" if "image/webp" in request.headers.get("Accept", "") else "jpeg"
+
+    session = get_db_session()
+    try:
+        rows = session.execute(
+            text("SELECT id, thumbnail_path FROM data WHERE id = ANY(:ids) AND user_id = :userid"),
+            {"ids": file_ids, "userid": current_user.id}
+        ).fetchall()
+    finally:
+        session.close()
+    by_id = {r[0]: r[1] for r in rows}
+    entries = [(i, by_id[i]) for i in file_ids if by_id.get(i)]
+    if not entries:
+        return error_response("No thumbnails found for these entries", 404)
+
+    name, layout = build_sprite(entries, tile=tile, fmt=fmt, columns=columns)
+    return jsonify(dict(layout, sprite_url=asset_url("sprite", name, current_user.id))), 200
 
 # ---------------------------------- DOWNLOADING ------------------------------------
 
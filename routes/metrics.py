@@ -0,0 +1,29 @@
+# metrics.py
+
+import hmac, logging
+from flask import request, jsonify
+from routes import metrics_bp
+from core.utils import metrics
+from core.utils.cache import get_redis
+from core.utils.config import Config
+from core.utils.logs import error_response
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------- METRICS ------------------------------------
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    key = request.headers.get("X-API-Key", "")
+    if not Config.METRICS_API_KEY or not hmac.compare_digest(key, Config.METRICS_API_KEY):
+        return error_response("Unauthorized", 401)
+
+    snapshot = metrics.snapshot()
+    # Queue workers don't serve requests; they publish theirs
+    redis = get_redis()
+    if redis:
+        try:
+            snapshot["workers"] = metrics.published(redis)
+        except Exception as e:
+            logger.warning(f"Failed to read published metrics: {e}")
+    return jsonify(snapshot), 200
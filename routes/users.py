@@ -3,9 +3,11 @@
 import logging
 from flask import request, jsonify
 from core.utils.data import _safe_unlink
+from core.content import storage
 from routes import users_bp
 from core.utils.middleware import limiter
 from core.utils.tracking import verify_link_token
+from core.database import vectors
 from core.database.database import get_db_session
 from core.database.models import DataEntry, Frequency, StagingEntry, User
 from core.utils.logs import error_response
@@ -101,17 +103,14 @@ def account_delete(current_user):
         staging_entries = session.query(StagingEntry).filter_by(user_id=user.id).all()
         data_entries    = session.query(DataEntry).filter_by(user_id=user.id).all()
 
-        # 2) Delete files on disk
+        # 2) Delete staged uploads on disk
         removed_files = 0
         for s in staging_entries:
             if _safe_unlink(s.file_path):
                 removed_files += 1
 
-        for d in data_entries:
-            if _safe_unlink(d.file_path):
-                removed_files += 1
-            if _safe_unlink(d.thumbnail_path):
-                removed_files += 1
+        file_paths      = [d.file_path for d in data_entries]
+        thumbnail_paths = [d.thumbnail_path for d in data_entries]
 
         # 3) Bulk delete DB rows + user (faster than per-row delete)
         staging_deleted = session.query(StagingEntry).filter_by(user_id=user.id).delete(synchronize_session=False)
@@ -120,6 +119,11 @@ def account_delete(current_user):
 
         session.commit()
 
+        # 4) Stored files go once no other user's entries share them
+        removed_files += storage.release(session, file_paths, thumbnail_paths)
+
+        vectors.drop_user(current_user.id)
+
         logger.info(
             f"Deleted User {user.id}, "
             f"{staging_deleted} staging entries, "
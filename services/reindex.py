@@ -0,0 +1,120 @@
+# reindex.py
+
+import time, logging, argparse
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from core.database import vectors
+from core.database.database import get_db_session, batch_update
+from core.database.models import MaintenanceCheckpoint
+from core.ai.ai import call_vec_api_batch, EMBEDDING_MODEL, EMBEDDING_DIMS
+from core.utils.cache import bump_user_version
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, force=True)
+logger = logging.getLogger(__name__)
+
+# ---------- Checkpoint ----------
+
+def job_name(user_ids=None):
+    # A model or dimensionality change starts a fresh pass instead of resuming an old one
+    name = f"reembed:{EMBEDDING_MODEL}:{EMBEDDING_DIMS}"
+    return f"{name}:users={','.join(map(str, sorted(user_ids)))}" if user_ids else name
+
+def get_checkpoint(session, name, restart=False):
+    checkpoint = session.query(MaintenanceCheckpoint).get(name)
+    if checkpoint is None:
+        checkpoint = MaintenanceCheckpoint(name=name, last_id=0, processed=0, failed=0)
+        session.add(checkpoint)
+    elif restart:
+        checkpoint.last_id = 0
+        checkpoint.processed = 0
+        checkpoint.failed = 0
+    checkpoint.updated_at = int(time.time())
+    session.commit()
+    return checkpoint
+
+# ---------- Main Functions ----------
+
+def fetch_batch(session, last_id, batch_size, user_ids):
+    return session.execute(
+        text(f"""
+            SELECT id, user_id, tags
+            FROM data
+            WHERE id > :last_id
+                AND tags IS NOT NULL AND tags <> ''
+                {"AND user_id = ANY(:user_ids)" if user_ids else ""}
+            ORDER BY id
+            LIMIT :batch_size
+        """),
+        {"last_id": last_id, "batch_size": batch_size, "user_ids": user_ids}
+    ).fetchall()
+
+def reembed(batch_size=100, user_ids=None, restart=False, max_rows=None):
+    session = get_db_session()
+    try:
+        checkpoint = get_checkpoint(session, job_name(user_ids), restart=restart)
+        logger.info(f"Re-embedding from id > {checkpoint.last_id} ({checkpoint.processed} rows done before)")
+
+        touched_users = set()
+        done = 0
+        start = time.perf_counter()
+        while max_rows is None or done < max_rows:
+            rows = fetch_batch(session, checkpoint.last_id, batch_size, user_ids)
+            if not rows:
+                break
+
+            embeddings = call_vec_api_batch([r.tags for r in rows], task_type="RETRIEVAL_DOCUMENT", batch_size=batch_size)
+            pairs = [(r.id, vec) for r, vec in zip(rows, embeddings) if vec]
+            failed = [r.id for r, vec in zip(rows, embeddings) if not vec]
+
+            if pairs:
+                batch_update(
+                    session, "data", ["tags_vector"],
+                    [(data_id, "[" + ",".join(map(str, vec)) + "]") for data_id, vec in pairs],
+                    casts={"tags_vector": "vector"}
+                )
+            # Vectors and checkpoint commit together, so a crash resumes at the last full batch
+            checkpoint.last_id = rows[-1].id
+            checkpoint.processed += len(pairs)
+            checkpoint.failed += len(failed)
+            checkpoint.updated_at = int(time.time())
+            session.commit()
+
+            touched_users.update(r.user_id for r in rows)
+            done += len(rows)
+            if failed:
+                logger.warning(f"Embedding failed for ids {failed}")
+            elapsed = time.perf_counter() - start
+            logger.info(f"Re-embedded {done} rows (last id {checkpoint.last_id}, {done / elapsed:.1f} rows/s)")
+
+        # The mmap store and cached results still hold the old vectors
+        for uid in touched_users:
+            if vectors.is_enabled():
+                vectors.rebuild_user(session, uid)
+            bump_user_version(uid)
+
+        logger.info(
+            f"Done. {done} rows this run, {checkpoint.processed} total, {checkpoint.failed} failed. "
+            f"Run tests/test_fill_neighbors.py --rebuild to refresh /get_similar lists."
+        )
+    finally:
+        session.close()
+
+# ---------- Run directly ----------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumable batched re-embedding of entry tags")
+    parser.add_argument("-b", "--batch-size", type=int, default=100, help="Entries per provider call (default: 100)")
+    parser.add_argument("--users", type=str, help="Comma-separated list of user IDs (default: all users)")
+    parser.add_argument("--max-rows", type=int, help="Stop after this many rows (resume later)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first id")
+    args = parser.parse_args()
+
+    reembed(
+        batch_size=args.batch_size,
+        user_ids=[int(x) for x in args.users.split(",")] if args.users else None,
+        restart=args.restart,
+        max_rows=args.max_rows
+    )
@@ -0,0 +1,125 @@
+# worker.py
+
+import os, json, socket, signal, logging, argparse, threading
+from dotenv import load_dotenv
+
+from core.database.database import get_db_session
+from core.ai.batcher import extraction_batcher
+from core.processing import jobs
+from core.processing.background import run_claimed
+from core.utils import metrics
+from core.utils.cache import get_redis
+from core.utils.config import Config
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, force=True)
+logger = logging.getLogger(__name__)
+
+# ---------- State ----------
+
+stop_event = threading.Event()
+held = set()
+held_lock = threading.Lock()
+
+def _stop(signum, frame):
+    logger.info(f"Received signal {signum}; finishing in-flight entries")
+    stop_event.set()
+
+# ---------- Loops ----------
+
+def work_loop(worker_id, poll_interval):
+    while not stop_event.is_set():
+        session = get_db_session()
+        try:
+            entry_id = jobs.claim_next(session, worker_id)
+        except Exception as e:
+            logger.error(f"Claim failed: {e}")
+            entry_id = None
+        finally:
+            session.close()
+
+        if entry_id is None:
+            stop_event.wait(poll_interval)
+            continue
+
+        with held_lock:
+            held.add(entry_id)
+        try:
+            run_claimed(entry_id)
+        finally:
+            with held_lock:
+                held.discard(entry_id)
+
+def heartbeat_loop(worker_id):
+    # Renew leases well before they lapse, and retire rows whose last attempt died with its worker
+    interval = max(1, Config.INGEST_VISIBILITY_TIMEOUT / 3)
+    while not stop_event.wait(interval):
+        session = get_db_session()
+        try:
+            with held_lock:
+                ids = list(held)
+            jobs.extend_leases(session, ids, worker_id)
+            jobs.fail_exhausted(session)
+        except Exception as e:
+            logger.error(f"Heartbeat failed: {e}")
+        finally:
+            session.close()
+
+def depth_loop():
+    # Batch extractions only while there's a backlog to fill the batches
+    while not stop_event.wait(Config.EXTRACT_BATCH_DEPTH_INTERVAL):
+        session = get_db_session()
+        try:
+            depth = jobs.queue_depth(session)
+            metrics.set_gauge("ingest.queue_depth", depth)
+            extraction_batcher.set_active(depth >= Config.EXTRACT_BATCH_MIN_DEPTH)
+        except Exception as e:
+            logger.error(f"Queue depth check failed: {e}")
+        finally:
+            session.close()
+
+def metrics_loop(worker_id):
+    # Nothing serves this process's registry, so hand it to /api/metrics through Redis
+    interval = Config.METRICS_PUBLISH_INTERVAL
+    while not stop_event.wait(interval):
+        redis = get_redis()
+        try:
+            if redis:
+                metrics.publish(redis, f"worker:{worker_id}", ttl=interval * 3)
+            else:
+                logger.info(f"Metrics: {json.dumps(metrics.snapshot())}")
+        except Exception as e:
+            logger.error(f"Metrics publish failed: {e}")
+
+def run(concurrency, poll_interval):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    threads = [threading.Thread(target=heartbeat_loop, args=(worker_id,), name="heartbeat", daemon=True)]
+    threading.Thread(target=metrics_loop, args=(worker_id,), name="metrics", daemon=True).start()
+    if Config.EXTRACT_BATCH_MIN_DEPTH > 0:
+        threading.Thread(target=depth_loop, name="queue-depth", daemon=True).start()
+    threads += [
+        threading.Thread(target=work_loop, args=(worker_id, poll_interval), name=f"ingest-{i}")
+        for i in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    logger.info(f"Worker {worker_id} started with {concurrency} threads")
+
+    while any(t.is_alive() for t in threads[1:]):
+        for t in threads[1:]:
+            t.join(timeout=1)
+    logger.info(f"Worker {worker_id} stopped")
+
+# ---------- Run directly ----------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process staged uploads from the ingest queue")
+    parser.add_argument("-c", "--concurrency", type=int, default=Config.INGEST_WORKER_CONCURRENCY, help="Entries processed in parallel")
+    parser.add_argument("-p", "--poll-interval", type=float, default=1.0, help="Seconds to wait when the queue is empty (default: 1)")
+    args = parser.parse_args()
+
+    run(args.concurrency, args.poll_interval)
@@ -0,0 +1,90 @@
+# test_backfill_dhash.py
+
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from dotenv import load_dotenv
+from sqlalchemy import text
+from core.database.database import get_db_session, batch_update
+from core.content.images import dhash, preview_source
+from core.processing.duplicates import to_signed
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("backfill_dhash")
+
+def hash_for(row):
+    # Ingest hashes the full decode, so prefer the stored file to the thumbnail
+    data_id, file_path, thumbnail_path = row
+    path = next((p for p in (file_path, thumbnail_path) if p and os.path.exists(p)), None)
+    if not path:
+        return data_id, None
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", (256, 256))
+            return data_id, to_signed(dhash(preview_source(img.convert("RGB"))))
+    except Exception as e:
+        logger.error(f"Entry {data_id}: {e}")
+        return data_id, None
+
+# Computes the perceptual hash of entries ingested before near-duplicate
+# detection, so new uploads can match them. Files are decoded in parallel
+# at reduced size and each batch is one UPDATE.
+def backfill_dhash(batch_size: int = 500, workers: int = 8, rebuild: bool = False, user_ids=None):
+    session = get_db_session()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        last_id = 0
+        done = failed = 0
+        start = time.perf_counter()
+
+        while True:
+            rows = session.execute(
+                text(f"""
+                    SELECT id, file_path, thumbnail_path FROM data
+                    WHERE id > :last_id
+                        {"" if rebuild else "AND dhash IS NULL"}
+                        {"AND user_id = ANY(:user_ids)" if user_ids else ""}
+                    ORDER BY id
+                    LIMIT :batch_size
+                """),
+                {"last_id": last_id, "batch_size": batch_size, "user_ids": user_ids}
+            ).fetchall()
+            if not rows:
+                break
+
+            results = list(pool.map(hash_for, rows))
+            found = [(data_id, value) for data_id, value in results if value is not None]
+            failed += len(results) - len(found)
+            if found:
+                batch_update(session, "data", ["dhash"], found)
+                session.commit()
+                done += len(found)
+
+            last_id = rows[-1][0]
+            elapsed = time.perf_counter() - start
+            logger.info(f"Backfilled {done}, failed {failed} (last id {last_id}, {done / elapsed:.1f} entries/s)")
+
+        logger.info(f"Done. Backfilled {done}, failed {failed}.")
+    finally:
+        pool.shutdown()
+        session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute perceptual hashes for existing entries")
+    parser.add_argument("-b", "--batch-size", type=int, default=500, help="Entries per batch (default: 500)")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Decode threads (default: 8)")
+    parser.add_argument("--users", type=str, help="Comma-separated list of user IDs (default: all users)")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute hashes that already exist")
+    args = parser.parse_args()
+
+    backfill_dhash(
+        batch_size=args.batch_size,
+        workers=args.workers,
+        rebuild=args.rebuild,
+        user_ids=[int(x) for x in args.users.split(",")] if args.users else None
+    )
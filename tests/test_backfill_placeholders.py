@@ -0,0 +1,99 @@
+# test_backfill_placeholders.py
+
+import os
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from dotenv import load_dotenv
+from sqlalchemy import text
+from core.utils.config import Config
+from core.database.database import get_db_session, batch_update
+from core.content.images import image_previews, thumbnail_variant_path
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("backfill_placeholders")
+
+def source_path(file_path, thumbnail_path):
+    # A 16px placeholder only needs the smallest thumbnail; fall back to the full file
+    candidates = []
+    if thumbnail_path:
+        candidates += [thumbnail_variant_path(thumbnail_path, min(Config.THUMBNAIL_SIZES), "jpeg"), thumbnail_path]
+    candidates.append(file_path)
+    return next((p for p in candidates if p and os.path.exists(p)), None)
+
+def previews_for(row):
+    data_id, file_path, thumbnail_path = row
+    path = source_path(file_path, thumbnail_path)
+    if not path:
+        return data_id, None
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", (128, 128))
+            return data_id, image_previews(img.convert("RGB"))
+    except Exception as e:
+        logger.error(f"Entry {data_id}: {e}")
+        return data_id, None
+
+# Fills placeholder and dominant_color for entries ingested before they were
+# computed. Thumbnails are decoded in parallel and each batch is one UPDATE.
+def backfill_placeholders(batch_size: int = 500, workers: int = 8, rebuild: bool = False, user_ids=None):
+    session = get_db_session()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        last_id = 0
+        done = failed = 0
+        start = time.perf_counter()
+
+        while True:
+            rows = session.execute(
+                text(f"""
+                    SELECT id, file_path, thumbnail_path FROM data
+                    WHERE id > :last_id
+                        {"" if rebuild else "AND placeholder IS NULL"}
+                        {"AND user_id = ANY(:user_ids)" if user_ids else ""}
+                    ORDER BY id
+                    LIMIT :batch_size
+                """),
+                {"last_id": last_id, "batch_size": batch_size, "user_ids": user_ids}
+            ).fetchall()
+            if not rows:
+                break
+
+            results = list(pool.map(previews_for, rows))
+            found = [(data_id, previews) for data_id, previews in results if previews]
+            failed += len(results) - len(found)
+            if found:
+                batch_update(
+                    session, "data", ["placeholder", "dominant_color"],
+                    [(data_id, placeholder, color) for data_id, (placeholder, color) in found]
+                )
+                session.commit()
+                done += len(found)
+
+            last_id = rows[-1][0]
+            elapsed = time.perf_counter() - start
+            logger.info(f"Backfilled {done}, failed {failed} (last id {last_id}, {done / elapsed:.1f} entries/s)")
+
+        logger.info(f"Done. Backfilled {done}, failed {failed}.")
+    finally:
+        pool.shutdown()
+        session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute placeholders and dominant colors for existing entries")
+    parser.add_argument("-b", "--batch-size", type=int, default=500, help="Entries per batch (default: 500)")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Decode threads (default: 8)")
+    parser.add_argument("--users", type=str, help="Comma-separated list of user IDs (default: all users)")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute placeholders that already exist")
+    args = parser.parse_args()
+
+    backfill_placeholders(
+        batch_size=args.batch_size,
+        workers=args.workers,
+        rebuild=args.rebuild,
+        user_ids=[int(x) for x in args.users.split(",")] if args.users else None
+    )
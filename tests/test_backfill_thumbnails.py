@@ -0,0 +1,97 @@
+# test_backfill_thumbnails.py
+
+import os
+import time
+import logging
+import argparse
+from collections import defaultdict
+
+from PIL import Image
+from dotenv import load_dotenv
+from sqlalchemy import text
+from core.utils.config import Config
+from core.database.database import get_db_session
+from core.content.images import THUMBNAIL_FORMATS, save_thumbnail_variants, thumbnail_variant_path
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("backfill_thumbnails")
+
+def variant_paths(thumbnail_path):
+    return [thumbnail_variant_path(thumbnail_path, size, fmt) for size in Config.THUMBNAIL_SIZES for fmt in THUMBNAIL_FORMATS]
+
+# Writes the size/format variants for entries created before ingest produced
+# them, then reports the average bytes per variant against the full files.
+def backfill_thumbnails(batch_size: int = 500, rebuild: bool = False, user_ids=None):
+    session = get_db_session()
+    try:
+        last_id = 0
+        done = skipped = failed = 0
+        totals = defaultdict(lambda: [0, 0])    # label -> [files, bytes]
+        start = time.perf_counter()
+
+        while True:
+            rows = session.execute(
+                text(f"""
+                    SELECT id, file_path, thumbnail_path FROM data
+                    WHERE id > :last_id
+                        AND thumbnail_path IS NOT NULL
+                        {"AND user_id = ANY(:user_ids)" if user_ids else ""}
+                    ORDER BY id
+                    LIMIT :batch_size
+                """),
+                {"last_id": last_id, "batch_size": batch_size, "user_ids": user_ids}
+            ).fetchall()
+            if not rows:
+                break
+
+            for data_id, file_path, thumbnail_path in rows:
+                paths = variant_paths(thumbnail_path)
+                if not rebuild and all(os.path.exists(p) for p in paths):
+                    skipped += 1
+                else:
+                    # Prefer the full image; old entries may only have the thumbnail left
+                    source = file_path if file_path and os.path.exists(file_path) else thumbnail_path
+                    try:
+                        with Image.open(source) as img:
+                            save_thumbnail_variants(img.convert("RGB"), thumbnail_path)
+                        done += 1
+                    except Exception as e:
+                        failed += 1
+                        logger.error(f"Entry {data_id}: {e}")
+                        continue
+
+                for size in Config.THUMBNAIL_SIZES:
+                    for fmt in THUMBNAIL_FORMATS:
+                        p = thumbnail_variant_path(thumbnail_path, size, fmt)
+                        if os.path.exists(p):
+                            totals[f"{size} {fmt}"][0] += 1
+                            totals[f"{size} {fmt}"][1] += os.path.getsize(p)
+                for label, p in (("thumbnail", thumbnail_path), ("full", file_path)):
+                    if p and os.path.exists(p):
+                        totals[label][0] += 1
+                        totals[label][1] += os.path.getsize(p)
+
+            last_id = rows[-1][0]
+            elapsed = time.perf_counter() - start
+            logger.info(f"Backfilled {done}, skipped {skipped}, failed {failed} (last id {last_id}, {done / elapsed:.1f} entries/s)")
+
+        logger.info(f"Done. Backfilled {done}, skipped {skipped}, failed {failed}.")
+        for label, (count, size) in sorted(totals.items()):
+            if count:
+                print(f"{label:<12} {count:>7} files  avg {size / count / 1024:8.1f} KB")
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate thumbnail size/format variants for existing entries")
+    parser.add_argument("-b", "--batch-size", type=int, default=500, help="Entries per batch (default: 500)")
+    parser.add_argument("--users", type=str, help="Comma-separated list of user IDs (default: all users)")
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate variants that already exist")
+    args = parser.parse_args()
+
+    backfill_thumbnails(
+        batch_size=args.batch_size,
+        rebuild=args.rebuild,
+        user_ids=[int(x) for x in args.users.split(",")] if args.users else None
+    )
@@ -0,0 +1,64 @@
+# test_backfill_tsv.py
+
+import time
+import logging
+import argparse
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from core.database.database import get_db_session
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("backfill_tsv")
+
+# Walks the table in id order so each batch is a short transaction on an index range
+def backfill_tags_tsv(batch_size: int = 1000, rebuild: bool = False):
+    session = get_db_session()
+    try:
+        last_id = 0
+        total = 0
+        start = time.perf_counter()
+
+        while True:
+            ids = session.execute(
+                text(f"""
+                    SELECT id FROM data
+                    WHERE id > :last_id
+                        {"" if rebuild else "AND tags_tsv IS NULL"}
+                        AND tags IS NOT NULL
+                    ORDER BY id
+                    LIMIT :batch_size
+                """),
+                {"last_id": last_id, "batch_size": batch_size}
+            ).scalars().all()
+            if not ids:
+                break
+
+            updated = session.execute(
+                text("UPDATE data SET tags_tsv = data_tags_tsv(tags) WHERE id = ANY(:ids)"),
+                {"ids": ids}
+            ).rowcount
+            session.commit()
+
+            total += updated
+            last_id = ids[-1]
+            elapsed = time.perf_counter() - start
+            logger.info(f"Updated {total} rows (last id {last_id}, {total / elapsed:.0f} rows/s)")
+
+        logger.info(f"Done. Backfilled tags_tsv for {total} rows.")
+
+        session.execute(text("ANALYZE data;"))
+        session.commit()
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the weighted tags_tsv column")
+    parser.add_argument("-b", "--batch-size", type=int, default=1000,
+                        help="Rows per UPDATE (default: 1000)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Recompute tags_tsv for all rows, not just missing ones")
+    args = parser.parse_args()
+
+    backfill_tags_tsv(batch_size=args.batch_size, rebuild=args.rebuild)
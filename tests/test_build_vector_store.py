@@ -0,0 +1,41 @@
+# test_build_vector_store.py
+
+import time
+import logging
+import argparse
+
+from dotenv import load_dotenv
+from core.utils.config import Config
+from core.database import vectors
+from core.database.database import get_db_session
+from core.database.models import User
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("build_vector_store")
+
+def build_vector_store(user_ids: list[int] | None = None):
+    if not vectors.is_enabled():
+        logger.error("VECTOR_STORE_DIR is not set; nothing to build.")
+        return
+
+    session = get_db_session()
+    try:
+        if not user_ids:
+            user_ids = [row.id for row in session.query(User.id).order_by(User.id).all()]
+        logger.info(f"Building vector store in {Config.VECTOR_STORE_DIR} for {len(user_ids)} users")
+
+        total = 0
+        start = time.perf_counter()
+        for uid in user_ids:
+            total += vectors.rebuild_user(session, uid)
+        logger.info(f"Done. {total} vectors in {time.perf_counter() - start:.1f}s")
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the per-user memory-mapped vector store from the data table")
+    parser.add_argument("--users", type=str, help="Comma-separated list of user IDs (default: all users)")
+    args = parser.parse_args()
+
+    build_vector_store([int(x) for x in args.users.split(",")] if args.users else None)
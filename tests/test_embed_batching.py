@@ -0,0 +1,57 @@
+# test_embed_batching.py
+
+import time
+import logging
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from core.utils import metrics
+from core.utils.config import Config
+from core.ai import batcher
+
+load_dotenv()
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s]: %(message)s")
+logger = logging.getLogger("test_embed_batching")
+
+# Fires `requests` distinct query embeddings from `concurrency` threads, once
+# with direct calls and once through the batcher, and compares throughput.
+def run(window_ms, requests, concurrency):
+    Config.EMBED_BATCH_WINDOW_MS = window_ms
+    batcher.query_batcher.window = window_ms / 1000
+    queries = [f"benchmark query {i} {time.time_ns()}" for i in range(requests)]
+
+    def one(q):
+        start = time.perf_counter()
+        vec = batcher.embed_query(q)
+        return time.perf_counter() - start, len(vec) > 0
+
+    batches_before = metrics.get_counter("embed_batch.batches")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, queries))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(r[0] for r in results)
+    ok = sum(1 for r in results if r[1])
+    calls = requests if window_ms <= 0 else int(metrics.get_counter("embed_batch.batches") - batches_before)
+    label = "direct" if window_ms <= 0 else f"batched ({window_ms:g}ms)"
+    print(f"{label:<18} {requests / elapsed:>8.1f} req/s  p50={statistics.median(latencies)*1000:.0f}ms  "
+          f"p99={latencies[int(0.99 * (len(latencies) - 1))]*1000:.0f}ms  provider calls={calls}  ok={ok}/{requests}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare direct vs micro-batched query embeddings under load")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="Embeddings per run (default: 200)")
+    parser.add_argument("-c", "--concurrency", type=int, default=32, help="Concurrent callers (default: 32)")
+    parser.add_argument("-w", "--window-ms", type=float, default=5, help="Batch window in ms (default: 5)")
+    args = parser.parse_args()
+
+    run(0, args.requests, args.concurrency)
+    run(args.window_ms, args.requests, args.concurrency)
+
+    hist = metrics.snapshot()["histograms"]
+    for name in ("embed_batch.size", "embed_batch.latency"):
+        if name in hist:
+            h = hist[name]
+            print(f"{name:<20} count={h['count']} mean={h['mean']:.3f} p50={h['p50']:.3f} p99={h['p99']:.3f} max={h['max']:.3f}")
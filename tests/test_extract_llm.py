@@ -4,7 +4,7 @@ from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
-from core.processing.background import encode_image_to_base64
+from core.content.images import encode_image_to_base64
 from core.utils.config import Config
 
 load_dotenv()
@@ -0,0 +1,72 @@
+# test_fill_neighbors.py
+
+import time
+import logging
+import argparse
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from core.utils.config import Config
+from core.database.database import get_db_session
+from core.database.models import User, DataEntry
+from core.processing.neighbors import compute_neighbors, store_neighbors
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("fill_neighbors")
+
+# Fills data_neighbors for entries that don't have a list yet (or all of them with --rebuild)
+def fill_neighbors(user_ids: list[int] | None = None, batch_size: int = 200, rebuild: bool = False):
+    session = get_db_session()
+    try:
+        if not user_ids:
+            user_ids = [row.id for row in session.query(User.id).order_by(User.id).all()]
+
+        total = 0
+        start = time.perf_counter()
+        for uid in user_ids:
+            last_id = 0
+            while True:
+                query = session.query(DataEntry.id, DataEntry.tags_vector).filter(
+                    DataEntry.user_id == uid,
+                    DataEntry.id > last_id,
+                    DataEntry.tags_vector.isnot(None)
+                )
+                if not rebuild:
+                    query = query.filter(
+                        text("NOT EXISTS (SELECT 1 FROM data_neighbors n WHERE n.data_id = data.id)")
+                    )
+                batch = query.order_by(DataEntry.id).limit(batch_size).all()
+                if not batch:
+                    break
+
+                for data_id, vector in batch:
+                    store_neighbors(session, data_id, compute_neighbors(session, uid, data_id, vector, Config.SIMILAR_NEIGHBORS_K))
+                session.commit()
+
+                total += len(batch)
+                last_id = batch[-1][0]
+                elapsed = time.perf_counter() - start
+                logger.info(f"User {uid}: filled {total} entries (last id {last_id}, {total / elapsed:.1f} entries/s)")
+
+        logger.info(f"Done. Filled neighbour lists for {total} entries.")
+
+        session.execute(text("ANALYZE data_neighbors;"))
+        session.commit()
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute /get_similar neighbour lists")
+    parser.add_argument("--users", type=str, help="Comma-separated list of user IDs (default: all users)")
+    parser.add_argument("-b", "--batch-size", type=int, default=200,
+                        help="Entries per commit (default: 200)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Recompute every list, not just missing ones")
+    args = parser.parse_args()
+
+    fill_neighbors(
+        [int(x) for x in args.users.split(",")] if args.users else None,
+        batch_size=args.batch_size,
+        rebuild=args.rebuild
+    )
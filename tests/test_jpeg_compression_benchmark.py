@@ -0,0 +1,123 @@
+# test_jpeg_compression_benchmark.py
+
+import io
+import time
+import random
+import argparse
+import statistics
+
+from PIL import Image, ImageDraw, ImageFilter
+from core.content import images
+
+# Generated screenshots: flat UI chrome, text-like runs, cards, and a photo
+# region with noise, at common phone and desktop resolutions.
+SIZES = [(1170, 2532), (1290, 2796), (1080, 2400), (1920, 1080), (2560, 1440), (2880, 1800)]
+
+def make_screenshot(size, seed):
+    rng = random.Random(seed)
+    w, h = size
+    bg = tuple(rng.randint(200, 255) for _ in range(3)) if rng.random() < 0.7 else tuple(rng.randint(10, 50) for _ in range(3))
+    img = Image.new("RGB", size, bg)
+    draw = ImageDraw.Draw(img)
+
+    # Status bar / header
+    draw.rectangle([0, 0, w, int(h * 0.06)], fill=tuple(rng.randint(0, 255) for _ in range(3)))
+
+    # Photo region
+    if rng.random() < 0.8:
+        pw, ph = int(w * rng.uniform(0.5, 1.0)), int(h * rng.uniform(0.15, 0.4))
+        photo = Image.effect_noise((pw, ph), rng.uniform(30, 90)).convert("RGB")
+        tint = Image.new("RGB", (pw, ph), tuple(rng.randint(0, 255) for _ in range(3)))
+        photo = Image.blend(photo, tint, 0.5).filter(ImageFilter.GaussianBlur(rng.uniform(0, 2)))
+        img.paste(photo, (rng.randint(0, w - pw), int(h * 0.08)))
+
+    # Cards and text runs
+    y = int(h * 0.45)
+    line_h = max(12, h // 90)
+    while y < h - line_h * 2:
+        if rng.random() < 0.15:
+            draw.rounded_rectangle([20, y, w - 20, y + line_h * 5], radius=16, outline=(120, 120, 120), width=2)
+        x = 40
+        for _ in range(rng.randint(3, 12)):
+            word = rng.randint(20, 120)
+            if x + word > w - 40:
+                break
+            color = (0, 0, 0) if sum(bg) > 380 else (230, 230, 230)
+            draw.rectangle([x, y, x + word, y + line_h - 4], fill=color)
+            x += word + rng.randint(8, 16)
+        y += line_h + rng.randint(4, 20)
+    return img
+
+def legacy_encode(img, target_bytes):
+    """compress_image before predictive quality selection: binary search per 0.8x scale step."""
+    scale = 1.0
+    while scale > 0.1:
+        if scale < 1.0:
+            img_resized = img.resize((int(img.width * scale), int(img.height * scale)), Image.LANCZOS)
+        else:
+            img_resized = img
+        low, high = 5, 95
+        best_bytes = None
+        while low <= high:
+            mid = (low + high) // 2
+            buffer = io.BytesIO()
+            img_resized.save(buffer, format="JPEG", quality=mid, optimize=True)
+            if buffer.tell() <= target_bytes:
+                best_bytes = buffer.getvalue()
+                low = mid + 1
+            else:
+                high = mid - 1
+        if best_bytes:
+            return best_bytes, img_resized
+        scale *= 0.8
+    return None, img
+
+def counting_saves():
+    # Full encodes and the small unoptimized probe encodes, counted separately
+    counter = {"n": 0, "probes": 0}
+    original = Image.Image.save
+
+    def save(self, *args, **kwargs):
+        counter["n" if kwargs.get("optimize") else "probes"] += 1
+        return original(self, *args, **kwargs)
+
+    Image.Image.save = save
+    return counter, lambda: setattr(Image.Image, "save", original)
+
+def run(label, encode, corpus, target_bytes):
+    counter, restore = counting_saves()
+    times, encodes, probes, sizes, widths = [], [], [], [], []
+    try:
+        for img in corpus:
+            before, probes_before = counter["n"], counter["probes"]
+            start = time.perf_counter()
+            data, encoded = encode(img, target_bytes)
+            times.append(time.perf_counter() - start)
+            encodes.append(counter["n"] - before)
+            probes.append(counter["probes"] - probes_before)
+            sizes.append(len(data) if data else 0)
+            widths.append(encoded.width / img.width)
+    finally:
+        restore()
+
+    over = sum(1 for s in sizes if s > target_bytes)
+    print(f"{label:<12} time mean={statistics.mean(times)*1000:.0f}ms p90={sorted(times)[int(0.9 * (len(times) - 1))]*1000:.0f}ms  "
+          f"encodes mean={statistics.mean(encodes):.1f} max={max(encodes)} (+{statistics.mean(probes):.0f} probes)  "
+          f"size mean={statistics.mean(sizes)/1024:.0f}KB ({statistics.mean(sizes)/target_bytes:.0%} of target)  "
+          f"scale mean={statistics.mean(widths):.2f}  over target={over}")
+    return sizes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare predictive JPEG quality selection against the binary search")
+    parser.add_argument("-n", "--images", type=int, default=24, help="Generated screenshots (default: 24)")
+    parser.add_argument("-t", "--target-kb", type=int, default=500, help="Size budget in KB (default: 500)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    corpus = [make_screenshot(SIZES[i % len(SIZES)], args.seed + i) for i in range(args.images)]
+    target = args.target_kb * 1024
+
+    legacy = run("legacy", legacy_encode, corpus, target)
+    predictive = run("predictive", images._encode_jpeg, corpus, target)
+    ratios = [p / l for p, l in zip(predictive, legacy) if l]
+    print(f"predictive/legacy size ratio: mean={statistics.mean(ratios):.2f} min={min(ratios):.2f}")
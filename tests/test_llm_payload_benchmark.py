@@ -0,0 +1,153 @@
+# test_llm_payload_benchmark.py
+
+import io
+import time
+import random
+import argparse
+import statistics
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from core.content import images
+
+# Offline comparison of vision-LLM payload sizes: generated screenshots with
+# known text go through each sizing policy, and a local stand-in model reads
+# them back. With pytesseract installed the stand-in is real OCR (word
+# recall); otherwise it is a nearest-template word classifier: each word is
+# cut from the payload, scaled back up and matched against clean renderings
+# of every vocabulary word, and counts as read when the best match is right.
+
+WORDS = ("post reply likes views follow trending thread design server image upload "
+         "search query vector token latency budget screenshot comment shared retweet").split()
+SIZES = [(1170, 2532), (1290, 2796), (1080, 2400), (1920, 1080), (2560, 1440)]
+FIXED_SIDES = [512, 768, 1024, 1536]
+
+def make_page(size, seed):
+    """A screenshot-like page and the boxes of the words on it."""
+    rng = random.Random(seed)
+    w, h = size
+    img = Image.new("RGB", size, (250, 250, 250) if rng.random() < 0.7 else (18, 18, 22))
+    ink = (20, 20, 20) if img.getpixel((0, 0))[0] > 128 else (235, 235, 235)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, w, int(h * 0.05)], fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    if rng.random() < 0.6:
+        photo = Image.effect_noise((w - 80, int(h * 0.25)), 50).convert("RGB")
+        img.paste(photo, (40, int(h * 0.07)))
+
+    words = []
+    y = int(h * 0.35)
+    while y < h - 80:
+        font_px = rng.choice([18, 22, 26, 32, 40])
+        font = ImageFont.load_default(size=font_px)
+        x = 40
+        for _ in range(rng.randint(3, 10)):
+            word = rng.choice(WORDS)
+            box = draw.textbbox((x, y), word, font=font)
+            if box[2] > w - 40:
+                break
+            draw.text((x, y), word, fill=ink, font=font)
+            words.append((word, box, font_px))
+            x = box[2] + font_px // 2
+        y += int(font_px * 1.6)
+    return img, words
+
+def fixed_side(side):
+    def prepare(img):
+        scale = min(1.0, side / max(img.size))
+        resized = images._resize(img, scale)
+        return images._jpeg(resized, 85), resized.size
+    return prepare
+
+def compressed(img):
+    data, encoded = images._encode_jpeg(img, 500 * 1024)
+    return data, encoded.size
+
+def adaptive(img):
+    data, info = images.llm_payload_image(img)
+    return data, (info["width"], info["height"])
+
+TEMPLATE_SIZE = (96, 24)
+_templates = {}
+
+def _normalized(img):
+    arr = np.asarray(img.convert("L").resize(TEMPLATE_SIZE, Image.BICUBIC), dtype=np.float32).ravel()
+    arr -= arr.mean()
+    norm = np.linalg.norm(arr)
+    return arr / norm if norm else arr
+
+def templates(font_px):
+    """Clean renderings of every vocabulary word at one font size, dark on light."""
+    if font_px not in _templates:
+        font = ImageFont.load_default(size=font_px)
+        rows = []
+        for word in WORDS:
+            box = font.getbbox(word)
+            img = Image.new("L", (box[2] - box[0], box[3] - box[1]), 255)
+            ImageDraw.Draw(img).text((-box[0], -box[1]), word, fill=0, font=font)
+            rows.append(_normalized(img))
+        _templates[font_px] = np.stack(rows)
+    return _templates[font_px]
+
+def template_reader(original, payload, words):
+    """Share of words whose payload crop is closest to its own template."""
+    scale = payload.width / original.width
+    small = payload.convert("L")
+    read = 0
+    for word, (x0, y0, x1, y1), font_px in words:
+        crop = small.crop((int(x0 * scale), int(y0 * scale), max(int(x0 * scale) + 1, round(x1 * scale)), max(int(y0 * scale) + 1, round(y1 * scale))))
+        vec = _normalized(crop)
+        # Light-on-dark pages match the templates inverted
+        scores = np.abs(templates(font_px) @ vec)
+        if WORDS[int(np.argmax(scores))] == word:
+            read += 1
+    return read / max(1, len(words))
+
+def tesseract_reader(original, payload, words):
+    import pytesseract
+    found = set(pytesseract.image_to_string(payload).lower().split())
+    return sum(1 for word, *_ in words if word in found) / max(1, len(words))
+
+def pick_reader(name):
+    if name in ("auto", "tesseract"):
+        try:
+            import pytesseract
+            pytesseract.get_tesseract_version()
+            return "tesseract", tesseract_reader
+        except Exception:
+            if name == "tesseract":
+                raise
+    return "template", template_reader
+
+def run(label, prepare, corpus, reader):
+    prep, read_times, sizes, tokens, recall = [], [], [], [], []
+    for img, words in corpus:
+        start = time.perf_counter()
+        data, (w, h) = prepare(img)
+        prep.append(time.perf_counter() - start)
+        sizes.append(len(data))
+        tokens.append(images.estimate_tokens(w, h))
+
+        payload = Image.open(io.BytesIO(data))
+        start = time.perf_counter()
+        recall.append(reader(img, payload, words))
+        read_times.append(time.perf_counter() - start)
+
+    print(f"{label:<12} prep={statistics.mean(prep)*1000:5.0f}ms  read={statistics.mean(read_times)*1000:6.0f}ms  "
+          f"bytes={statistics.mean(sizes)/1024:6.0f}KB  tokens={statistics.mean(tokens):6.0f}  "
+          f"recall mean={statistics.mean(recall):.3f} min={min(recall):.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare vision-LLM payload sizes on generated screenshots")
+    parser.add_argument("-n", "--images", type=int, default=10, help="Generated screenshots (default: 10)")
+    parser.add_argument("--reader", choices=["auto", "tesseract", "template"], default="auto", help="Stand-in model (default: tesseract if installed)")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    reader_name, reader = pick_reader(args.reader)
+    print(f"Stand-in model: {reader_name}")
+    corpus = [make_page(SIZES[i % len(SIZES)], args.seed + i) for i in range(args.images)]
+
+    run("compressed", compressed, corpus, reader)
+    for side in FIXED_SIDES:
+        run(f"side {side}", fixed_side(side), corpus, reader)
+    run("adaptive", adaptive, corpus, reader)
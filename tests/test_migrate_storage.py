@@ -0,0 +1,128 @@
+# test_migrate_storage.py
+
+import os
+import time
+import shutil
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from core.utils.config import Config
+from core.database.database import get_db_session, batch_update
+from core.content import storage
+from core.content.storage import THUMBNAIL_FORMATS, thumbnail_variant_path
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("migrate_storage")
+
+def is_migrated(path):
+    return not path or storage.CONTENT_NAME.match(os.path.basename(path))
+
+def link_into(src, dest):
+    """Make `dest` hold `src`'s bytes without touching `src`. False if `dest` already existed."""
+    if os.path.exists(dest):
+        return False
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    try:
+        os.link(src, dest)
+    except FileExistsError:
+        return False
+    except OSError:
+        # Different filesystem: copy next to it, then rename into place
+        tmp = f"{dest}.migrate.tmp"
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dest)
+    return True
+
+def content_copy(root, path):
+    """Link `path` into `root` under its content name. Returns (new path, whether it was new)."""
+    ext = os.path.splitext(path)[1].lstrip(".").lower() or "jpg"
+    dest = storage.content_path(root, storage.hash_file(path), ext)
+    return dest, link_into(path, dest)
+
+def migrate_row(row):
+    """New (file_path, thumbnail_path) for one entry, leaving the old files in place."""
+    data_id, file_path, thumbnail_path = row
+    new_file, new_thumb, duplicates = file_path, thumbnail_path, 0
+    try:
+        if not is_migrated(file_path) and os.path.exists(file_path):
+            new_file, created = content_copy(Config.UPLOAD_DIR, file_path)
+            duplicates += not created
+        if not is_migrated(thumbnail_path) and os.path.exists(thumbnail_path):
+            new_thumb, created = content_copy(Config.THUMBNAIL_DIR, thumbnail_path)
+            duplicates += not created
+            for size in Config.THUMBNAIL_SIZES:
+                for fmt in THUMBNAIL_FORMATS:
+                    old_variant = thumbnail_variant_path(thumbnail_path, size, fmt)
+                    if os.path.exists(old_variant):
+                        link_into(old_variant, thumbnail_variant_path(new_thumb, size, fmt))
+    except Exception as e:
+        logger.error(f"Entry {data_id}: {e}")
+        return data_id, file_path, thumbnail_path, 0
+    return data_id, new_file, new_thumb, duplicates
+
+# Moves uuid-named files from the flat UPLOAD_DIR/THUMBNAIL_DIR into the
+# content-addressed shard layout (core/content/storage.py). Each file is
+# linked to its new name, the batch's rows are repointed in one commit, and
+# only then are the old names released, so a crash at any point leaves every
+# row pointing at a file that exists. Safe to re-run.
+def migrate_storage(batch_size: int = 500, workers: int = 8, user_ids=None):
+    session = get_db_session()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        last_id = 0
+        migrated = duplicates = removed = 0
+        start = time.perf_counter()
+
+        while True:
+            rows = session.execute(
+                text(f"""
+                    SELECT id, file_path, thumbnail_path FROM data
+                    WHERE id > :last_id
+                        {"AND user_id = ANY(:user_ids)" if user_ids else ""}
+                    ORDER BY id
+                    LIMIT :batch_size
+                """),
+                {"last_id": last_id, "batch_size": batch_size, "user_ids": user_ids}
+            ).fetchall()
+            if not rows:
+                break
+
+            results = list(pool.map(migrate_row, [r for r in rows if not (is_migrated(r[1]) and is_migrated(r[2]))]))
+            old = {r[0]: r for r in rows}
+            moved = [(i, f, t) for i, f, t, _ in results if (f, t) != (old[i][1], old[i][2])]
+            if moved:
+                batch_update(session, "data", ["file_path", "thumbnail_path"], moved)
+                session.commit()
+                removed += storage.release(
+                    session,
+                    [old[i][1] for i, f, _ in moved if f != old[i][1]],
+                    [old[i][2] for i, _, t in moved if t != old[i][2]]
+                )
+                migrated += len(moved)
+                duplicates += sum(d for *_, d in results)
+
+            last_id = rows[-1][0]
+            elapsed = time.perf_counter() - start
+            logger.info(f"Migrated {migrated} entries, {duplicates} files already stored (last id {last_id}, {migrated / elapsed:.1f} entries/s)")
+
+        logger.info(f"Done. Migrated {migrated} entries, {duplicates} duplicate files, removed {removed} old files.")
+    finally:
+        pool.shutdown()
+        session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move uploads and thumbnails into content-addressed sharded storage")
+    parser.add_argument("-b", "--batch-size", type=int, default=500, help="Entries per batch (default: 500)")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Hashing threads (default: 8)")
+    parser.add_argument("--users", type=str, help="Comma-separated list of user IDs (default: all users)")
+    args = parser.parse_args()
+
+    migrate_storage(
+        batch_size=args.batch_size,
+        workers=args.workers,
+        user_ids=[int(x) for x in args.users.split(",")] if args.users else None
+    )
@@ -0,0 +1,100 @@
+# test_near_duplicate_verify.py
+
+import os
+import sys
+import random
+import argparse
+import tempfile
+
+from PIL import Image, ImageDraw, ImageFont
+from core.utils.config import Config
+from core.content import images
+from core.processing.duplicates import hamming, max_distance
+
+# Near-duplicate reuse on generated screenshots. Pages from one app template
+# (same header, avatar, image block and line layout) with different text must
+# not be confirmed even when their dHashes fall within NEAR_DUPLICATE_DISTANCE;
+# re-encodings and rescales of one page must be.
+
+WORDS = ("post reply likes views follow trending thread design server image upload "
+         "search query vector token latency budget screenshot comment shared retweet").split()
+SIZES = [(1170, 2532), (1290, 2796), (1080, 2400)]
+
+def template_page(size, layout_seed, text_seed):
+    """A screenshot whose layout comes from `layout_seed` and whose words come from `text_seed`."""
+    layout, words = random.Random(layout_seed), random.Random(text_seed)
+    w, h = size
+    dark = layout.random() < 0.3
+    img = Image.new("RGB", size, (18, 18, 22) if dark else (250, 250, 250))
+    ink = (235, 235, 235) if dark else (20, 20, 20)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, w, int(h * 0.06)], fill=tuple(layout.randint(0, 255) for _ in range(3)))
+    draw.ellipse([40, int(h * 0.08), 160, int(h * 0.08) + 120], fill=(120, 140, 200))
+    photo = Image.effect_noise((w - 80, int(h * 0.2)), 40).convert("RGB")
+    img.paste(photo, (40, int(h * 0.14)))
+
+    font_px = layout.choice([26, 32, 40])
+    font = ImageFont.load_default(size=font_px)
+    y = int(h * 0.38)
+    while y < h - 120:
+        x = 40
+        for _ in range(layout.randint(4, 9)):
+            word = words.choice(WORDS)
+            box = draw.textbbox((x, y), word, font=font)
+            if box[2] > w - 40:
+                break
+            draw.text((x, y), word, fill=ink, font=font)
+            x = box[2] + font_px // 2
+        y += int(font_px * 1.7)
+    return img
+
+def save(img, directory, name, quality=85, scale=1.0):
+    if scale != 1.0:
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.LANCZOS)
+    path = os.path.join(directory, f"{name}.jpg")
+    img.save(path, "JPEG", quality=quality)
+    return path
+
+def file_dhash(path):
+    with Image.open(path) as img:
+        return images.dhash(images.preview_source(img.convert("RGB")))
+
+def run(pages, seed):
+    limit = Config.NEAR_DUPLICATE_MAX_TILE_DIFF
+    failures = 0
+    close_pairs = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(pages):
+            size = SIZES[i % len(SIZES)]
+            base = template_page(size, seed + i, seed + i)
+            original = save(base, tmp, f"{i}_original")
+            h = file_dhash(original)
+
+            # The same screenshot again: recompressed, rescaled
+            for name, kwargs in (("requality", {"quality": 70}), ("rescale", {"scale": 0.8})):
+                path = save(base, tmp, f"{i}_{name}", **kwargs)
+                diff = images.tile_difference(original, path)
+                ok = diff <= limit
+                failures += not ok
+                print(f"page {i} {name:<10} bits={hamming(h, file_dhash(path)):2d} tile_diff={diff:6.1f} confirmed={ok}")
+
+            # Same template, different text
+            for j in range(3):
+                path = save(template_page(size, seed + i, seed + 1000 + i * 10 + j), tmp, f"{i}_other{j}")
+                bits = hamming(h, file_dhash(path))
+                diff = images.tile_difference(original, path)
+                ok = diff > limit
+                close_pairs += bits <= max_distance()
+                failures += not ok
+                print(f"page {i} other text bits={bits:2d} tile_diff={diff:6.1f} rejected={ok}")
+
+    print(f"{close_pairs} different-text pairs within {max_distance()} dHash bits; {failures} failures")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check near-duplicate confirmation on same-layout, different-text screenshots")
+    parser.add_argument("-n", "--pages", type=int, default=6, help="Template pages (default: 6)")
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    sys.exit(1 if run(args.pages, args.seed) else 0)
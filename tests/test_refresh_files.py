@@ -92,12 +92,14 @@ def cleanup_orphans():
         session.close()
 
     removed = 0
-    for fname in os.listdir(Config.UPLOAD_DIR):
-        fpath = os.path.join(Config.UPLOAD_DIR, fname)
-        if os.path.isfile(fpath) and fpath not in valid_paths:
-            os.remove(fpath)
-            removed += 1
-            logger.info(f"🗑 Removed orphan file {fpath}")
+    # Walks the content-addressed shard directories as well as legacy flat files
+    for dirpath, _, fnames in os.walk(Config.UPLOAD_DIR):
+        for fname in fnames:
+            fpath = os.path.join(dirpath, fname)
+            if fpath not in valid_paths:
+                os.remove(fpath)
+                removed += 1
+                logger.info(f"🗑 Removed orphan file {fpath}")
     logger.info(f"Cleanup done. Removed {removed} files.")
 
 if __name__ == "__main__":
@@ -12,7 +12,7 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine, desc
 from core.utils.config import Config
 from core.database.models import DataEntry
-from core.processing.background import encode_image_to_base64
+from core.content.images import encode_image_to_base64
 from core.content.images import compress_image, generate_thumbnail
 from core.ai.ai import call_llm_api, call_vec_api
 
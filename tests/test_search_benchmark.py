@@ -0,0 +1,102 @@
+# test_search_benchmark.py
+
+import time
+import logging
+import argparse
+import statistics
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from core.database.database import get_db_session
+from core.database.models import User
+from core.search.engine import run_search
+from core.ai.ai import call_vec_api
+
+load_dotenv()
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s]: %(message)s")
+logger = logging.getLogger("test_search_benchmark")
+
+DEFAULT_QUERIES = [
+    "cars",
+    "red sports car",
+    "game ui inventory",
+    "twitter posts about ai",
+    "neon cyberpunk city",
+    "recipes with chicken",
+    "worldbuilding maps",
+    "pixel art",
+]
+
+# Embed each query once so both modes are timed on the database work only
+@lru_cache(maxsize=256)
+def _embed(text_input):
+    return tuple(call_vec_api(query_text=text_input, task_type="RETRIEVAL_QUERY"))
+
+def embed(text_input):
+    return list(_embed(text_input))
+
+def time_mode(session, user, query_text, mode, result_limit, candidate_k, runs):
+    durations = []
+    rows = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        rows = run_search(
+            session,
+            user_id=user.id,
+            query_text=query_text,
+            user_tz=user.timezone,
+            embed=embed,
+            result_limit=result_limit,
+            mode=mode,
+            candidate_k=candidate_k
+        )
+        durations.append(time.perf_counter() - start)
+    return durations, [r[0] for r in rows]
+
+def percentile(values, pct):
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+def run_benchmark(user_id, queries, result_limit, candidate_k, runs):
+    session = get_db_session()
+    try:
+        user = session.query(User).get(user_id)
+        if not user:
+            print(f"User {user_id} not found")
+            return
+
+        exhaustive_all, candidates_all, overlaps, top10_overlaps = [], [], [], []
+        print(f"{'query':<28} {'exh p50':>9} {'cand p50':>9} {'overlap':>8} {'top10':>6}")
+        for q in queries:
+            embed(q)
+            exh_times, exh_ids = time_mode(session, user, q, "exhaustive", result_limit, candidate_k, runs)
+            cand_times, cand_ids = time_mode(session, user, q, "candidates", result_limit, candidate_k, runs)
+            exhaustive_all += exh_times
+            candidates_all += cand_times
+
+            overlap = len(set(exh_ids) & set(cand_ids)) / len(exh_ids) if exh_ids else 1.0
+            top10 = len(set(exh_ids[:10]) & set(cand_ids[:10])) / len(exh_ids[:10]) if exh_ids else 1.0
+            overlaps.append(overlap)
+            top10_overlaps.append(top10)
+
+            print(f"{q[:28]:<28} {statistics.median(exh_times)*1000:>7.1f}ms {statistics.median(cand_times)*1000:>7.1f}ms {overlap:>8.2f} {top10:>6.2f}")
+
+        print("-" * 64)
+        print(f"exhaustive  p50={percentile(exhaustive_all, 50)*1000:.1f}ms p99={percentile(exhaustive_all, 99)*1000:.1f}ms")
+        print(f"candidates  p50={percentile(candidates_all, 50)*1000:.1f}ms p99={percentile(candidates_all, 99)*1000:.1f}ms")
+        print(f"mean overlap@{result_limit}={statistics.mean(overlaps):.2f} mean overlap@10={statistics.mean(top10_overlaps):.2f}")
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare exhaustive vs two-stage candidate search")
+    parser.add_argument("-u", "--user", type=int, default=1, help="User ID to search as (default: 1)")
+    parser.add_argument("-q", "--queries", type=str, help="Comma-separated list of queries")
+    parser.add_argument("-l", "--limit", type=int, default=100, help="Result limit (default: 100)")
+    parser.add_argument("-k", "--candidate-k", type=int, default=400, help="Per-signal candidate K (default: 400)")
+    parser.add_argument("-r", "--runs", type=int, default=5, help="Runs per query and mode (default: 5)")
+    args = parser.parse_args()
+
+    query_list = [q.strip() for q in args.queries.split(",")] if args.queries else DEFAULT_QUERIES
+    run_benchmark(args.user, query_list, args.limit, args.candidate_k, args.runs)
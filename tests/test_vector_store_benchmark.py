@@ -0,0 +1,94 @@
+# test_vector_store_benchmark.py
+
+import time
+import tempfile
+import argparse
+import statistics
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import text
+from psycopg2.extras import execute_values
+from core.utils.config import Config
+from core.database import vectors
+from core.database.database import get_db_session
+
+load_dotenv()
+
+SIZES = [1_000, 10_000, 100_000]
+TOP_K = 100
+RUNS = 20
+BENCH_USER_ID = -1
+
+def random_vectors(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((n, vectors.DIMS), dtype=np.float32)
+
+def write_store(ids, vecs):
+    vectors._write_generation(BENCH_USER_ID, 1, ids, vectors._normalize(vecs))
+    vectors._write_gen(BENCH_USER_ID, 1)
+
+def bench_numpy(queries):
+    durations = []
+    for q in queries:
+        start = time.perf_counter()
+        vectors.search(BENCH_USER_ID, q, TOP_K)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def bench_sql(session, ids, vecs, queries):
+    session.execute(text("CREATE TEMP TABLE bench_vectors (id bigint, v vector(768))"))
+    raw_conn = session.connection().connection
+    with raw_conn.cursor() as cur:
+        execute_values(
+            cur,
+            "INSERT INTO bench_vectors (id, v) VALUES %s",
+            [(int(i), "[" + ",".join(f"{x:.6f}" for x in v) + "]") for i, v in zip(ids, vecs)],
+            template="(%s, %s::vector)",
+            page_size=1000
+        )
+    session.execute(text("ANALYZE bench_vectors"))
+
+    durations = []
+    for q in queries:
+        start = time.perf_counter()
+        session.execute(
+            text("SELECT id FROM bench_vectors ORDER BY v <=> (:q)::vector LIMIT :k"),
+            {"q": q.tolist(), "k": TOP_K}
+        ).fetchall()
+        durations.append(time.perf_counter() - start)
+
+    session.execute(text("DROP TABLE bench_vectors"))
+    session.commit()
+    return durations
+
+def run(skip_sql):
+    Config.VECTOR_STORE_DIR = tempfile.mkdtemp(prefix="vecbench_")
+    session = None if skip_sql else get_db_session()
+    try:
+        print(f"{'rows':>8} {'numpy p50':>10} {'numpy p99':>10} {'sql p50':>10} {'sql p99':>10}")
+        for n in SIZES:
+            ids = np.arange(1, n + 1, dtype=np.int64)
+            vecs = random_vectors(n)
+            queries = random_vectors(RUNS, seed=n)
+            write_store(ids, vecs)
+            np_times = bench_numpy(queries)
+
+            sql_p50 = sql_p99 = float("nan")
+            if session is not None:
+                sql_times = bench_sql(session, ids, vecs, queries)
+                sql_p50 = statistics.median(sql_times) * 1000
+                sql_p99 = max(sql_times) * 1000
+
+            print(f"{n:>8} {statistics.median(np_times)*1000:>8.2f}ms {max(np_times)*1000:>8.2f}ms {sql_p50:>8.2f}ms {sql_p99:>8.2f}ms")
+            vectors.drop_user(BENCH_USER_ID)
+    finally:
+        if session is not None:
+            session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the mmap vector store against pgvector exact search")
+    parser.add_argument("--skip-sql", action="store_true", help="Only time the NumPy path")
+    args = parser.parse_args()
+
+    run(args.skip_sql)